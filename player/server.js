@@ -1,7 +1,8 @@
 const express = require('express');
 const path = require('path');
 const fs = require('fs');
-const { exec } = require('child_process');
+const { execFile } = require('child_process');
+const http = require('http');
 const app = express();
 const PORT = 3000;
 
@@ -13,6 +14,11 @@ const PUBLIC_DIR = path.join(PLAYER_DIR, 'public');
 const MIDI_DIR = path.join(PLAYER_DIR, '../mid/cleaned');
 const MP3_DIR = path.join(PLAYER_DIR, '../mp3');
 const SETUP_DIR = path.join(PLAYER_DIR, '../setup');
+const PYTHON = path.join(PLAYER_DIR, '../venv/bin/python'); // Check this path!
+const ALIGNMENT_STORE = path.join(PLAYER_DIR, '../source/alignment_store.py');
+const AI_MUSIC_CLI = path.join(PLAYER_DIR, '../source/ai_music.py');
+// Warm analysis worker (source/analysis_server.py); spawning a script is the fallback
+const ANALYSIS_PORT = parseInt(process.env.AI_MUSIC_ANALYSIS_PORT) || 8765;
 
 app.use(express.static(PUBLIC_DIR));
 app.use('/setup', express.static(SETUP_DIR));
@@ -51,29 +57,46 @@ app.get('/api/alignment/dtw/:category', (req, res) => {
 });
 
 // --- SAVE MANUAL ---
+// Upserts one key in the alignment store (setup/alignments.db), which then
+// re-exports alignment_manual_<category>.json atomically.
 app.post('/api/save_alignment', (req, res) => {
     const { category, key, offset, speed } = req.body;
-    const p = path.join(SETUP_DIR, `alignment_manual_${category}.json`);
-    let data = {};
-    if (fs.existsSync(p)) {
-        try { data = JSON.parse(fs.readFileSync(p, 'utf8')); } catch(e){}
-    }
-    data[key] = { offset, speed, timestamp: new Date().toISOString() };
-    fs.writeFileSync(p, JSON.stringify(data, null, 2));
-    console.log(`Saved ${key} (${Object.keys(data).length} total)`);
-    res.json({ success: true });
+    const entry = JSON.stringify({ offset, speed, timestamp: new Date().toISOString() });
+    execFile(PYTHON, [ALIGNMENT_STORE, 'save', 'manual', category, key, entry], (err, stdout, stderr) => {
+        if (err) return res.status(500).json({ error: stderr });
+        console.log(stdout.trim());
+        res.json({ success: true });
+    });
 });
 
 // --- RE-ANALYZE ---
+// Runs a job on the analysis server; cb(null, job) when it answered, cb(err) when it is not running.
+function submitAnalysisJob(job, cb) {
+    const body = JSON.stringify({ ...job, wait: true });
+    const req = http.request({ host: '127.0.0.1', port: ANALYSIS_PORT, path: '/jobs', method: 'POST',
+                               headers: { 'Content-Type': 'application/json', 'Content-Length': Buffer.byteLength(body) } }, r => {
+        let data = '';
+        r.on('data', chunk => data += chunk);
+        r.on('end', () => { try { cb(null, JSON.parse(data)); } catch (e) { cb(e); } });
+    });
+    req.on('error', cb);
+    req.end(body);
+}
+
 app.post('/api/reanalyze', (req, res) => {
     const { category, key } = req.body;
-    const script = path.join(PLAYER_DIR, '../source/04_analyze_data.py');
-    const python = path.join(PLAYER_DIR, '../venv/bin/python'); // Check this path!
-    
-    exec(`${python} "${script}" ${category} "${key}"`, (err, stdout, stderr) => {
-        if(err) return res.status(500).json({error: stderr});
-        console.log(stdout);
-        res.json({success: true});
+    submitAnalysisJob({ type: 'analyze', category, key }, (err, job) => {
+        if (!err) {
+            if (job.status !== 'done') return res.status(500).json({ error: job.error });
+            console.log(`Re-analyzed ${key} in ${job.seconds}s (analysis server)`);
+            return res.json({ success: true });
+        }
+        // No analysis server running: spawn the CLI (pays the import cost every time)
+        execFile(PYTHON, [AI_MUSIC_CLI, 'analyze', category, key], (err, stdout, stderr) => {
+            if(err) return res.status(500).json({error: stderr});
+            console.log(stdout);
+            res.json({success: true});
+        });
     });
 });
 
@@ -92,6 +115,43 @@ app.get('/api/analysis/:category/:key', (req, res) => {
     if(fs.existsSync(p)) res.sendFile(p); else res.status(404).send('Not found');
 });
 
+// --- WAVEFORM PEAKS ---
+// Serves one level of the <key>.peaks pyramid written by 04_analyze_data.py
+// (format in source/peaks.py): the coarsest level with at least ?width= peaks.
+// Body is raw little-endian int16 [min, max] pairs; level info is in the headers.
+app.get('/api/peaks/:category/:key', (req, res) => {
+    const p = path.join(MP3_DIR, req.params.category, 'wav', `${req.params.key}.peaks`);
+    if (!fs.existsSync(p)) return res.status(404).send('Not found');
+
+    const fd = fs.openSync(p, 'r');
+    try {
+        const head = Buffer.alloc(24);
+        fs.readSync(fd, head, 0, 24, 0);
+        if (head.toString('latin1', 0, 8) !== 'AIMPEAK1') return res.status(500).send('Bad peaks file');
+        const nLevels = head.readUInt32LE(12);
+        const duration = head.readDoubleLE(16);
+        const table = Buffer.alloc(16 * nLevels);
+        fs.readSync(fd, table, 0, table.length, 24);
+
+        const levels = [];
+        for (let i = 0; i < nLevels; i++) {
+            levels.push({ pps: table.readUInt32LE(i * 16), count: table.readUInt32LE(i * 16 + 8),
+                          offset: table.readUInt32LE(i * 16 + 12) });
+        }
+        levels.sort((a, b) => a.pps - b.pps);
+        const width = parseInt(req.query.width) || 0;
+        const level = levels.find(l => l.count >= width) || levels[levels.length - 1];
+
+        const data = Buffer.alloc(level.count * 4);
+        fs.readSync(fd, data, 0, data.length, level.offset);
+        res.set({ 'Content-Type': 'application/octet-stream',
+                  'X-Peaks-Pixels-Per-Second': level.pps, 'X-Peaks-Duration': duration });
+        res.send(data);
+    } finally {
+        fs.closeSync(fd);
+    }
+});
+
 app.use('/midi', express.static(MIDI_DIR));
 app.use('/audio', express.static(MP3_DIR));
 // ... existing code ...
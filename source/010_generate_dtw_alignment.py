@@ -1,14 +1,27 @@
 import os
+import sys
 import json
 import numpy as np
 import librosa
 import pretty_midi
+import psutil
+import soundfile as sf
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from scipy.interpolate import interp1d
+import feature_cache
+import banded_dtw
+import build_manifest
+import alignment_store
+import perf_log
+import transposition
+import key_schedule
+import feature_pool
 
 # --- CONFIG ---
 BASE_DIR = os.path.expanduser("~/ai_music")
 SETUP_DIR = os.path.join(BASE_DIR, "setup")
-CATEGORIES = ["first", "one_kor", "one_kor_sgl"]
+CATEGORIES = key_schedule.CATEGORIES
 SR = 22050
 #HOP_LENGTH = 512
 #from 013_make_one_DTW
@@ -19,85 +32,137 @@ DTW_BAND_WIDTH = 0.06
 OUTPUT_RESOLUTION_SEC = 0.25
 DTW_SUBSEQUENCE = False
 DTW_STEP_SIZES = np.array([[1, 1], [1, 0], [0, 1]]) 
+# 'banded': one DTW at HOP_LENGTH. 'multiscale': coarse-to-fine over MULTISCALE_HOPS,
+# only refining inside a corridor of MULTISCALE_RADIUS frames around the coarser path.
+DTW_MODE = 'banded'
+MULTISCALE_HOPS = [2048, 512, HOP_LENGTH]
+MULTISCALE_RADIUS = 32
+# 'auto': detect the key difference between recording and MIDI (transposition.estimate)
+# and align against the MIDI chroma shifted by it. 'off': always align as is.
+TRANSPOSITION = 'auto'
+# Parallel batch: worker processes, and the share of free RAM the running tracks may use
+WORKERS = os.cpu_count() or 1
+MEMORY_BUDGET_FRACTION = 0.7
 
 
-def load_manual_saves(cat):
-    path = os.path.join(SETUP_DIR, f"alignment_manual_{cat}.json")
-    if os.path.exists(path):
-        with open(path, 'r') as f: return json.load(f)
-    return {}
+def load_manual_saves(cat, conn=None):
+    return alignment_store.load(conn or alignment_store.connect(), "manual", cat)
 
 def get_midi_start_time(pm):
     start_times = [n.start for i in pm.instruments for n in i.notes]
     return min(start_times) if start_times else 0.0
 
-def process_category(cat):
-    print(f"\n--- Processing {cat} ---")
-    manual_data = load_manual_saves(cat)
+def manual_deviation(path_midi_norm, path_audio, manual_entry):
+    """Mean distance (s) between a warping path and the manual alignment line."""
+    m = manual_entry
+    # Human: Audio = (MidiNorm * Speed) + Offset
+    human_est = (path_midi_norm * float(m['speed'])) + float(m['offset'])
+    diff = np.abs(path_audio - human_est)
+    return float(np.mean(diff))
+
+def detect_shift(c_rec, c_midi):
+    """Semitones the recording sounds above the MIDI (0 with TRANSPOSITION 'off')."""
+    if TRANSPOSITION != 'auto':
+        return 0
+    with perf_log.span("transposition"):
+        return transposition.estimate(c_rec, c_midi)[0]
+
+def compute_warping_path(wav_path, ref, mode):
+    """
+    Returns (wp, shift): the DTW path (end -> start) as [midi_frame, audio_frame] pairs
+    at HOP_LENGTH, and the transposition it was aligned with. `ref` is the key's
+    key_schedule.MidiReference.
+    """
+    if mode == 'multiscale':
+        # Cached per file content + SR/hop, so unchanged tracks skip the CQT
+        with perf_log.span("chroma"):
+            levels = [(ref.chroma(SR, hop),
+                       feature_cache.audio_chroma(wav_path, SR, hop)) for hop in MULTISCALE_HOPS]
+        perf_log.note(midi_frames=levels[-1][0].shape[1], audio_frames=levels[-1][1].shape[1])
+        shift = detect_shift(levels[-1][1], levels[-1][0])
+        levels = [(transposition.apply(c_midi, shift), c_rec) for c_midi, c_rec in levels]
+        with perf_log.span("dtw"):
+            _, wp = banded_dtw.multiscale_dtw(levels, MULTISCALE_HOPS, metric=DTW_METRIC,
+                                              step_sizes_sigma=DTW_STEP_SIZES,
+                                              band_rad=DTW_BAND_WIDTH,
+                                              subseq=DTW_SUBSEQUENCE,
+                                              radius=MULTISCALE_RADIUS)
+        return wp, shift
+
+    # Cached per file content + SR/HOP_LENGTH, so unchanged tracks skip the CQT
+    with perf_log.span("chroma_audio"):
+        c_rec = feature_cache.audio_chroma(wav_path, SR, HOP_LENGTH)
+    with perf_log.span("chroma_midi"):
+        c_midi = ref.chroma(SR, HOP_LENGTH)
+    if perf_log.enabled():
+        lo, hi = banded_dtw.band_bounds(c_midi.shape[1], c_rec.shape[1], DTW_BAND_WIDTH)
+        perf_log.note(midi_frames=c_midi.shape[1], audio_frames=c_rec.shape[1],
+                      full_cells=c_midi.shape[1] * c_rec.shape[1], band_cells=int(np.sum(hi - lo)))
     
-    wav_dir = os.path.join(BASE_DIR, "mp3", cat, "wav")
-    midi_dir = os.path.join(BASE_DIR, "mid/cleaned")
-    files = [f for f in os.listdir(wav_dir) if f.endswith('.wav')]
+    # One alignment, against the MIDI moved into the recording's key
+    shift = detect_shift(c_rec, c_midi)
+    c_midi = transposition.apply(c_midi, shift)
     
-    dtw_output = {}
-    errors_found = []
+    #D, wp = librosa.sequence.dtw(X=c_midi, Y=c_rec, metric='cosine')  OQ:Orig
+    # Banded DTW: only the DTW_BAND_WIDTH corridor is allocated (O(N*band) memory)
+    with perf_log.span("dtw"):
+        _, wp = banded_dtw.dtw(c_midi, c_rec, metric=DTW_METRIC,
+                               step_sizes_sigma=DTW_STEP_SIZES,
+                               band_rad=DTW_BAND_WIDTH,
+                               subseq=DTW_SUBSEQUENCE)
+    return wp, shift
+
+def align_track(key, wav_path, midi_path, manual_entry, mode, ref=None):
+    """
+    Aligns one recording to its MIDI. Pass the key's MidiReference to share the MIDI side
+    with its other recordings. Returns (key, dtw_entry, error_line), dtw_entry is None if
+    the track failed.
+    """
+    category = os.path.basename(os.path.dirname(os.path.dirname(wav_path)))
+    with perf_log.track(key, category=category, stage="dtw", mode=mode):
+        return _align_track(key, wav_path, ref or key_schedule.MidiReference(midi_path), manual_entry, mode)
 
-    for i, f in enumerate(files):
-        key = f.replace(".wav", "")
-        midi_path = os.path.join(midi_dir, f"{key}.mid")
-        wav_path = os.path.join(wav_dir, f)
+def align_key(key, midi_path, jobs, mode):
+    """
+    Aligns every recording of one key, (category, wav_path, manual_entry) each, against one
+    MidiReference. Runs in the main process or a pool worker.
+    Returns [(category, key, dtw_entry, error_line), ...] in job order.
+    """
+    ref = key_schedule.MidiReference(midi_path)
+    return [(cat,) + align_track(key, wav_path, midi_path, manual_entry, mode, ref=ref)
+            for cat, wav_path, manual_entry in jobs]
+
+def _align_track(key, wav_path, ref, manual_entry, mode):
+    try:
+        pm = ref.pm
+        wp, shift = compute_warping_path(wav_path, ref, mode)
+        
+        wp = wp[::-1] 
+        midi_frames = wp[:, 0]
+        audio_frames = wp[:, 1]
+        
+        frames_to_sec = HOP_LENGTH / SR
+        path_midi_abs = midi_frames * frames_to_sec
+        path_audio = audio_frames * frames_to_sec
         
-        if not os.path.exists(midi_path): continue
-        print(f"[{i+1}/{len(files)}] {key}...", end="\r")
+        # --- CHANGE: KEEP ABSOLUTE TIME (No Normalization) ---
+        # This maps the exact timestamp in the .mid file to the exact timestamp in the .wav
+        
+        # Error Checking (Still needs normalization to compare with Manual sliders)
+        first_note_time = get_midi_start_time(pm)
+        path_midi_norm = path_midi_abs - first_note_time
+        
+        error_score = 0.0
+        error_line = None
+        if manual_entry is not None:
+            error_score = manual_deviation(path_midi_norm, path_audio, manual_entry)
+            if error_score > ERROR_THRESHOLD_SEC:
+                error_line = f"{key}: Avg Deviation {error_score:.2f}s"
 
-        try:
-            y_rec, _ = librosa.load(wav_path, sr=SR)
-            pm = pretty_midi.PrettyMIDI(midi_path)
-            y_midi = pm.synthesize(fs=SR)
-            
-            c_rec = librosa.feature.chroma_cqt(y=y_rec, sr=SR, hop_length=HOP_LENGTH)
-            c_midi = librosa.feature.chroma_cqt(y=y_midi, sr=SR, hop_length=HOP_LENGTH)
-            
-            #D, wp = librosa.sequence.dtw(X=c_midi, Y=c_rec, metric='cosine')  OQ:Orig
-            if DTW_SUBSEQUENCE:
-                D, wp = librosa.sequence.dtw(X=c_midi, Y=c_rec, metric=DTW_METRIC, 
-                                            step_sizes_sigma=DTW_STEP_SIZES, 
-                                            global_constraints=DTW_SUBSEQUENCE,                                          
-                                            band_rad=DTW_BAND_WIDTH)
-            else:
-                # Librosa Dtw standard
-                D, wp = librosa.sequence.dtw(X=c_midi, Y=c_rec, metric=DTW_METRIC, 
-                                            step_sizes_sigma=DTW_STEP_SIZES,
-                                            band_rad=DTW_BAND_WIDTH)            
-            
-            wp = wp[::-1] 
-            midi_frames = wp[:, 0]
-            audio_frames = wp[:, 1]
-            
-            frames_to_sec = HOP_LENGTH / SR
-            path_midi_abs = midi_frames * frames_to_sec
-            path_audio = audio_frames * frames_to_sec
-            
-            # --- CHANGE: KEEP ABSOLUTE TIME (No Normalization) ---
-            # This maps the exact timestamp in the .mid file to the exact timestamp in the .wav
-            
-            # Error Checking (Still needs normalization to compare with Manual sliders)
-            first_note_time = get_midi_start_time(pm)
-            path_midi_norm = path_midi_abs - first_note_time
-            
-            error_score = 0.0
-            if key in manual_data:
-                m = manual_data[key]
-                # Human: Audio = (MidiNorm * Speed) + Offset
-                human_est = (path_midi_norm * float(m['speed'])) + float(m['offset'])
-                diff = np.abs(path_audio - human_est)
-                error_score = np.mean(diff)
-                if error_score > ERROR_THRESHOLD_SEC:
-                    errors_found.append(f"{key}: Avg Deviation {error_score:.2f}s")
-
-            # --- DOWNSAMPLING ---
-            # Interpolate raw midi time -> raw audio time
-            # Range: from 0 to end of MIDI
+        # --- DOWNSAMPLING ---
+        # Interpolate raw midi time -> raw audio time
+        # Range: from 0 to end of MIDI
+        with perf_log.span("interpolate"):
             midi_duration = pm.get_end_time()
             lookup_times = np.arange(0, midi_duration, 0.25) 
             
@@ -111,22 +176,231 @@ def process_category(cat):
                 simplified_audio = lookup_times 
             
             points = np.column_stack((lookup_times, simplified_audio)).round(3).tolist()
-            
-            dtw_output[key] = {
-                "points": points, 
-                "error": round(error_score, 3)
-            }
+        perf_log.note(path_length=len(wp), points=len(points), transpose=shift)
+        
+        return key, {"points": points, "error": round(error_score, 3), "transpose": shift}, error_line
 
-        except Exception as e:
-            print(f"\nError {key}: {e}")
+    except Exception as e:
+        print(f"\nError {key}: {e}")
+        perf_log.note(failed=str(e))
+        return key, None, None
 
-    with open(os.path.join(SETUP_DIR, f"alignment_dtw_{cat}.json"), 'w') as f:
-        json.dump(dtw_output, f)
-        
-    if errors_found:
-        with open(os.path.join(SETUP_DIR, f"dtw_errors_{cat}.txt"), 'w') as f:
-            f.write("\n".join(errors_found))
+def estimate_track_bytes(wav_path):
+    """Rough peak memory of align_track, used to keep big tracks from running all at once."""
+    try:
+        duration = sf.info(wav_path).duration
+    except RuntimeError:
+        duration = os.path.getsize(wav_path) / (2 * SR)
+    samples = duration * SR
+    frames = samples / HOP_LENGTH
+    # Audio + MIDI synthesis (float32/float64) and their CQTs (84 complex bins per frame)
+    signal_bytes = samples * (4 + 8) * 2 + frames * 84 * 8 * 2
+    # Band of the accumulated cost (float64) + step matrix (int8)
+    band = DTW_BAND_WIDTH if DTW_BAND_WIDTH is not None else 0.5
+    dtw_bytes = frames * (2 * band * frames + 1) * 9
+    return int(signal_bytes + dtw_bytes)
+
+def midi_hops(mode):
+    return MULTISCALE_HOPS if mode == 'multiscale' else [HOP_LENGTH]
+
+def prepare_midi(midi_path, mode):
+    """MidiReference with the chroma `mode` needs fetched (computed on a cold cache)."""
+    ref = key_schedule.MidiReference(midi_path)
+    try:
+        for hop in midi_hops(mode):
+            ref.chroma(SR, hop)
+    except Exception:
+        pass  # Unreadable MIDI: align_track fails the key's tracks with the error
+    return ref
+
+def warm_midi(midi_path, mode):
+    """Pool task: fills the feature cache with a key's MIDI chroma."""
+    prepare_midi(midi_path, mode)
+
+def run_parallel(tasks, workers, on_result):
+    """
+    Runs align_track over tasks (category first, estimated bytes last) in a process pool.
+    Every key's MIDI chroma is made first, in parallel (prepare_midi). The parent then
+    publishes it once per key in a feature_pool.FeaturePool, so the recordings of a key run
+    side by side on different workers, all reading the same shared arrays; the segment is
+    released when the key's last recording is done. A task is only submitted while
+    the estimated memory of all running tasks fits into MEMORY_BUDGET_FRACTION of free RAM
+    (one task always runs, however big).
+    """
+    budget = psutil.virtual_memory().available * MEMORY_BUDGET_FRACTION
+    # Largest keys first (small ones fill gaps), the recordings of a key next to each other
+    key_bytes = {}
+    for t in tasks:
+        key_bytes[t[1]] = max(key_bytes.get(t[1], 0), t[-1])
+    queue = sorted(tasks, key=lambda t: (-key_bytes[t[1]], t[1], -t[-1]))
+    remaining = Counter(t[1] for t in tasks)
+    shared = {}
+    running = {}
+
+    with feature_pool.FeaturePool() as features, \
+         ProcessPoolExecutor(max_workers=workers, initializer=feature_pool.worker_init) as pool:
+        midi_jobs = {(t[1], t[3], t[5]) for t in tasks}
+        for fut in [pool.submit(warm_midi, midi_path, mode) for _, midi_path, mode in midi_jobs]:
+            fut.result()
+
+        while queue or running:
+            in_use = sum(est for _, est in running.values())
+            i = 0
+            while i < len(queue) and len(running) < workers:
+                est = queue[i][-1]
+                if running and in_use + est > budget:
+                    i += 1
+                    continue
+                task = queue.pop(i)
+                key = task[1]
+                if key not in shared:
+                    shared[key] = prepare_midi(task[3], task[5]).share(features)
+                running[pool.submit(align_track, *task[1:-1], ref=shared[key])] = (task, est)
+                in_use += est
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                task, _ = running.pop(fut)
+                on_result(task[0], *fut.result())
+                remaining[task[1]] -= 1
+                if not remaining[task[1]]:
+                    for handle in shared.pop(task[1]).handles.values():
+                        features.release(handle)
+
+def dtw_params(mode):
+    """Everything that changes the DTW output; part of the build manifest fingerprint."""
+    params = {"sr": SR, "hop_length": HOP_LENGTH, "metric": DTW_METRIC, "band_width": DTW_BAND_WIDTH,
+              "subsequence": DTW_SUBSEQUENCE, "step_sizes": DTW_STEP_SIZES, "mode": mode,
+              "error_threshold": ERROR_THRESHOLD_SEC, "transposition": TRANSPOSITION,
+              "midi_renderer": feature_cache.midi_renderer()}
+    if TRANSPOSITION == 'auto':
+        params["transposition_min_gain"] = transposition.MIN_GAIN
+    if mode == 'multiscale':
+        params.update(multiscale_hops=MULTISCALE_HOPS, multiscale_radius=MULTISCALE_RADIUS)
+    return params
+
+def process_category(cat, mode=DTW_MODE, workers=WORKERS, force=False):
+    process_categories([cat], mode, workers, force)
+
+def track_fingerprint(manifest, wav_path, midi_path, manual_entry):
+    """Fingerprint of one track in the dtw_{cat} manifest (the manual line is scored against)."""
+    manual_inputs = None
+    if manual_entry is not None:
+        manual_inputs = [float(manual_entry['speed']), float(manual_entry['offset'])]
+    return manifest.fingerprint([wav_path, midi_path], manual=manual_inputs)
+
+def export_keys(cat, conn=None):
+    """
+    Keys of the DTW JSON export in the order process_categories writes them: current WAV
+    files in os.listdir order whose MIDI exists and that have a DTW entry.
+    """
+    wav_dir = os.path.join(BASE_DIR, "mp3", cat, "wav")
+    midi_dir = os.path.join(BASE_DIR, "mid/cleaned")
+    entries = alignment_store.load(conn or alignment_store.connect(), "dtw", cat)
+    keys = [f.replace(".wav", "") for f in os.listdir(wav_dir) if f.endswith('.wav')]
+    return [k for k in keys if k in entries and os.path.exists(os.path.join(midi_dir, f"{k}.mid"))]
+
+def process_categories(categories=CATEGORIES, mode=DTW_MODE, workers=WORKERS, force=False):
+    """
+    Aligns the stale tracks of all `categories`, scheduled by key (key_schedule), so each
+    MIDI's chroma is fetched once instead of once per category: serially, one align_key
+    call per key; with workers, one task per recording against the key's MIDI chroma
+    shared through a FeaturePool (run_parallel). Each category keeps its own manifest,
+    store rows, JSON export and error file, exactly as if run on its own.
+    """
+    print(f"\n--- Processing {', '.join(categories)} ({mode}, {workers} workers) ---")
+    conn = alignment_store.connect()
+    midi_dir = os.path.join(BASE_DIR, "mid/cleaned")
+
+    state = {}
+    tasks = []
+    for cat in categories:
+        manual_data = load_manual_saves(cat, conn)
+        wav_dir = os.path.join(BASE_DIR, "mp3", cat, "wav")
+        files = [f for f in os.listdir(wav_dir) if f.endswith('.wav')]
+
+        # Tracks whose WAV, MIDI, manual alignment and DTW params are unchanged keep their old entry
+        manifest = build_manifest.Manifest(f"dtw_{cat}", dtw_params(mode), force=force)
+        previous = alignment_store.load(conn, "dtw", cat)
+
+        order = []
+        results = {}
+        fingerprints = {}
+        stale = 0
+        for f in files:
+            key = f.replace(".wav", "")
+            midi_path = os.path.join(midi_dir, f"{key}.mid")
+            wav_path = os.path.join(wav_dir, f)
+            if not os.path.exists(midi_path): continue
+            order.append(key)
+
+            manual_entry = manual_data.get(key)
+            fingerprints[key] = track_fingerprint(manifest, wav_path, midi_path, manual_entry)
+
+            if key in previous and manifest.is_fresh(key, fingerprints[key]):
+                entry = previous[key]
+                error_line = None
+                if manual_entry is not None and entry['error'] > ERROR_THRESHOLD_SEC:
+                    error_line = f"{key}: Avg Deviation {entry['error']:.2f}s"
+                results[key] = (entry, error_line)
+                continue
+            stale += 1
+            tasks.append((key, midi_path, cat, wav_path, manual_entry))
+
+        state[cat] = (manifest, order, results, fingerprints)
+        print(f"{cat}: {len(order) - stale}/{len(order)} tracks already up to date")
+
+    # Finished tracks are checkpointed into the alignment store (and the manifest) as they
+    # complete, so a crash or Ctrl-C keeps the work done so far and the next run resumes
+    done_count = 0
+    def on_result(cat, key, entry, error_line):
+        nonlocal done_count
+        done_count += 1
+        manifest, _, results, fingerprints = state[cat]
+        results[key] = (entry, error_line)
+        if entry is not None:
+            alignment_store.upsert(conn, "dtw", cat, key, entry)
+            manifest.record(key, fingerprints[key])
+        else:
+            manifest.forget(key)
+        manifest.save()
+        print(f"[{done_count}/{len(tasks)}] {cat}/{key}...", end="\r")
+
+    if workers > 1 and len(tasks) > 1:
+        run_parallel([(cat, key, wav_path, midi_path, manual_entry, mode, estimate_track_bytes(wav_path))
+                      for key, midi_path, cat, wav_path, manual_entry in tasks], workers, on_result)
+    else:
+        # One call per key, with the recordings of that key from every category
+        for key, jobs in key_schedule.group_by_key(tasks).items():
+            for result in align_key(key, jobs[0][1], [job[2:] for job in jobs], mode):
+                on_result(*result)
+
+    for cat in categories:
+        _, order, results, _ = state[cat]
+        # Same order as the serial loop, so the output does not depend on the worker count
+        dtw_output = {}
+        errors_found = []
+        for key in order:
+            entry, error_line = results[key]
+            if entry is not None: dtw_output[key] = entry
+            if error_line: errors_found.append(error_line)
+
+        # JSON export for the player, in file order (independent of the worker count)
+        with perf_log.track("(export)", category=cat, stage="dtw"), perf_log.span("json_export"):
+            alignment_store.export_json(conn, "dtw", cat, keys=list(dtw_output))
+
+        if errors_found:
+            with open(os.path.join(SETUP_DIR, f"dtw_errors_{cat}.txt"), 'w') as f:
+                f.write("\n".join(errors_found))
 
 if __name__ == "__main__":
-    for cat in CATEGORIES:
-        process_category(cat)
\ No newline at end of file
+    # python 010_generate_dtw_alignment.py [--multiscale] [--workers N] [--force] [--perf] [--symbolic]
+    # --perf logs per-track stage timings (perf_log.py summarizes them)
+    # --symbolic renders MIDI features from the notes instead of synthesizing (feature_cache.MIDI_RENDERER)
+    if "--perf" in sys.argv: perf_log.enable()
+    if "--symbolic" in sys.argv: os.environ["AI_MUSIC_MIDI_RENDERER"] = "symbolic"
+    mode = 'multiscale' if "--multiscale" in sys.argv else DTW_MODE
+    workers = WORKERS
+    if "--workers" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    process_categories(CATEGORIES, mode, workers, force="--force" in sys.argv)
\ No newline at end of file
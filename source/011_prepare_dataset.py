@@ -4,123 +4,272 @@ import numpy as np
 import librosa
 import pretty_midi
 import sys
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+import feature_cache
+import build_manifest
+import alignment_store
+import shard_dataset
+import audio_io
+import perf_log
+import feature_pool
 
 # --- CONFIG ---
 BASE_DIR = os.path.expanduser("~/ai_music")
 DATASET_DIR = os.path.join(BASE_DIR, "dataset_npz")
+# "shards": uncompressed, memory-mappable shards + offset index (shard_dataset.py, dataset_shards/)
+# "npz": one savez_compressed file per track (dataset_npz/)
+DATASET_FORMAT = "shards"
 SETUP_DIR = os.path.join(BASE_DIR, "setup")
 SR = 22050
 HOP_LENGTH = 512
 CQT_BINS = 84
 BINS_PER_OCTAVE = 12
 MIN_NOTE = 24
+# Labels: 'mono' = one MIDI pitch per frame, 'poly' = (frames, 88) multi-hot piano roll (for chords)
+LABEL_MODE = "mono"
+LOWEST_KEY = 21 # A0
+PIANO_KEYS = 88
+# Parallel batch (--workers N): tracks are computed in worker processes and handed back
+# through the feature cache (feature_pool.file_handle) instead of being pickled; the
+# parent writes them in file order, so the output does not depend on the worker count.
+WORKERS = 1
+# feature_cache parameters of the normalized CQT (X)
+CQT_PARAMS = {"sr": SR, "hop_length": HOP_LENGTH, "n_bins": CQT_BINS,
+              "bins_per_octave": BINS_PER_OCTAVE, "fmin": 'C1'}
+# Anything that changes X/Y; part of the build manifest fingerprint
+DATASET_PARAMS = {"sr": SR, "hop_length": HOP_LENGTH, "cqt_bins": CQT_BINS,
+                  "bins_per_octave": BINS_PER_OCTAVE, "min_note": MIN_NOTE, "label_mode": LABEL_MODE}
 
 def load_alignment_map(category):
-    dtw_path = os.path.join(SETUP_DIR, f"alignment_dtw_{category}.json")
-    dtw_data = {}
-    if os.path.exists(dtw_path):
-        with open(dtw_path, 'r') as f: dtw_data = json.load(f)
-        
-    manual_path = os.path.join(SETUP_DIR, f"alignment_manual_{category}.json")
-    manual_data = {}
-    if os.path.exists(manual_path):
-        with open(manual_path, 'r') as f: manual_data = json.load(f)
+    conn = alignment_store.connect()
+    dtw_data = alignment_store.load(conn, "dtw", category)
+    manual_data = alignment_store.load(conn, "manual", category)
     return dtw_data, manual_data
 
-def get_aligned_midi_roll(midi_path, duration_frames, alignment_info):
+def map_midi_times(times, alignment_info, first_note_time):
+    """Maps raw MIDI times (any shape) to audio frame indices in one vectorized pass."""
+    mode = alignment_info.get('mode', 'none')
+    if mode == 'dtw':
+        # Direct Mapping: Raw Midi -> Raw Audio
+        points = np.asarray(alignment_info['points'], dtype=np.float64)
+        t_audio = np.interp(times, points[:, 0], points[:, 1])
+    elif mode == 'manual':
+        # Normalized Mapping: (Raw - Start) -> Audio
+        t_audio = ((times - first_note_time) * alignment_info['speed']) + alignment_info['offset']
+    else:
+        t_audio = times # Fallback
+    # astype truncates toward zero, like int()
+    return (t_audio * SR / HOP_LENGTH).astype(np.int64)
+
+def get_aligned_midi_roll(midi_path, duration_frames, alignment_info, label_mode=None):
+    """
+    label_mode 'mono': (frames,) int16 MIDI pitch, later notes overwrite earlier ones.
+    label_mode 'poly': (frames, 88) uint8 multi-hot piano roll (A0..C8), keeps chords.
+    """
+    label_mode = label_mode or LABEL_MODE
     try:
         pm = pretty_midi.PrettyMIDI(midi_path)
     except:
-        return np.zeros(duration_frames)
+        return np.zeros(duration_frames) if label_mode == 'mono' else np.zeros((duration_frames, PIANO_KEYS), dtype=np.uint8)
 
-    targets = np.zeros(duration_frames, dtype=np.int16)
-    mode = alignment_info.get('mode', 'none')
+    notes = np.array([(n.start, n.end, n.pitch) for i in pm.instruments if not i.is_drum for n in i.notes],
+                     dtype=np.float64).reshape(-1, 3)
     
     # Calculate normalization only if needed for Manual mode
     first_note_time = 0.0
-    if mode == 'manual':
-        start_times = [n.start for i in pm.instruments for n in i.notes if not i.is_drum]
-        if start_times: first_note_time = min(start_times)
-    
-    def time_to_frame(t_midi_raw):
-        t_audio = 0.0
-        
-        if mode == 'dtw':
-            # Direct Mapping: Raw Midi -> Raw Audio
-            points = alignment_info['points']
-            t_audio = np.interp(t_midi_raw, [p[0] for p in points], [p[1] for p in points])
-            
-        elif mode == 'manual':
-            # Normalized Mapping: (Raw - Start) -> Audio
-            t_norm = t_midi_raw - first_note_time
-            t_audio = (t_norm * alignment_info['speed']) + alignment_info['offset']
-            
-        else:
-            t_audio = t_midi_raw # Fallback
-            
-        return int(t_audio * SR / HOP_LENGTH)
-
-    for instrument in pm.instruments:
-        if instrument.is_drum: continue
-        for note in instrument.notes:
-            start_frame = max(0, time_to_frame(note.start))
-            end_frame = min(duration_frames, time_to_frame(note.end))
-            if start_frame < end_frame:
-                targets[start_frame:end_frame] = note.pitch
+    if alignment_info.get('mode') == 'manual' and len(notes):
+        first_note_time = notes[:, 0].min()
 
+    # All onsets and offsets through the alignment at once
+    frames = map_midi_times(notes[:, :2], alignment_info, first_note_time)
+    start_frames = np.maximum(0, frames[:, 0])
+    end_frames = np.minimum(duration_frames, frames[:, 1])
+    pitches = notes[:, 2].astype(np.int64)
+    valid = start_frames < end_frames
+
+    if label_mode == 'poly':
+        valid &= (pitches >= LOWEST_KEY) & (pitches < LOWEST_KEY + PIANO_KEYS)
+        # +1 at the onset, -1 at the offset, cumulative sum = number of sounding notes per key
+        delta = np.zeros((duration_frames + 1, PIANO_KEYS), dtype=np.int32)
+        np.add.at(delta, (start_frames[valid], pitches[valid] - LOWEST_KEY), 1)
+        np.add.at(delta, (end_frames[valid], pitches[valid] - LOWEST_KEY), -1)
+        return (np.cumsum(delta, axis=0)[:-1] > 0).astype(np.uint8)
+
+    targets = np.zeros(duration_frames, dtype=np.int16)
+    for s, e, p in zip(start_frames[valid], end_frames[valid], pitches[valid]):
+        targets[s:e] = p
     return targets
 
-def process_track(category, key, dtw_entry, manual_entry):
+def process_track(category, key, dtw_entry, manual_entry, writer=None):
+    with perf_log.track(key, category=category, stage="dataset"):
+        result = build_track(category, key, dtw_entry, manual_entry)
+        if result is None: return None
+        tag, C_norm, Y = result
+        return tag if write_track(category, key, C_norm, Y, writer) else None
+
+def build_track(category, key, dtw_entry, manual_entry, shared=False):
+    """
+    (tag, C_norm, Y) of one track, None if it is missing or failed. With shared=True (pool
+    workers) C_norm comes back as a feature_pool handle of its feature_cache entry.
+    """
     wav_path = os.path.join(BASE_DIR, "mp3", category, "wav", f"{key}.wav")
     midi_path = os.path.join(BASE_DIR, "mid/cleaned", f"{key}.mid")
-    save_path = os.path.join(DATASET_DIR, category, f"{key}.npz")
-    
-    if not os.path.exists(wav_path) or not os.path.exists(midi_path): return
 
-    try:
-        y, _ = librosa.load(wav_path, sr=SR)
-        C = librosa.cqt(y, sr=SR, hop_length=HOP_LENGTH, n_bins=CQT_BINS, bins_per_octave=BINS_PER_OCTAVE, fmin=librosa.note_to_hz('C1'))
+    if not os.path.exists(wav_path) or not os.path.exists(midi_path): return None
+
+    def compute_cqt():
+        with perf_log.span("decode"):
+            y, _ = audio_io.load(wav_path, sr=SR)
+        with perf_log.span("cqt"):
+            C = librosa.cqt(y, sr=SR, hop_length=HOP_LENGTH, n_bins=CQT_BINS, bins_per_octave=BINS_PER_OCTAVE, fmin=librosa.note_to_hz('C1'))
         C_db = librosa.amplitude_to_db(np.abs(C), ref=np.max)
-        C_norm = np.clip((C_db + 80.0) / 80.0, 0, 1)
+        return np.clip((C_db + 80.0) / 80.0, 0, 1)
+
+    try:
+        with perf_log.span("features"):
+            C_norm = feature_cache.get_feature(wav_path, "cqt_norm", compute_cqt, **CQT_PARAMS)
         X = C_norm.T  
 
         # --- UPDATED PRIORITY: DTW FIRST ---
-        align_info = {'mode': 'none'}
-        tag = "RAW"
-        
-        if dtw_entry:
-            align_info = {'mode': 'dtw', 'points': dtw_entry['points']}
-            tag = "DTW"
-        elif manual_entry:
-            align_info = {'mode': 'manual', 'offset': manual_entry['offset'], 'speed': manual_entry['speed']}
-            tag = "MANUAL"
+        align_info = alignment_inputs(dtw_entry, manual_entry)
+        tag = {'dtw': "DTW", 'manual': "MANUAL", 'none': "RAW"}[align_info['mode']]
 
-        Y = get_aligned_midi_roll(midi_path, X.shape[0], align_info)
-        np.savez_compressed(save_path, x=X.astype(np.float32), y=Y)
-        return tag
+        with perf_log.span("midi_roll"):
+            Y = get_aligned_midi_roll(midi_path, X.shape[0], align_info)
+        perf_log.note(frames=X.shape[0], x_shape=list(X.shape), y_shape=list(Y.shape), mode=align_info['mode'])
+        if shared:
+            npy_path = feature_cache.feature_path(wav_path, "cqt_norm", **CQT_PARAMS)
+            if os.path.exists(npy_path):  # Else (cache write failed) the array is pickled
+                C_norm = feature_pool.file_handle(npy_path)
+        return tag, C_norm, Y
 
     except Exception as e:
         print(f"  Error {key}: {e}")
+        perf_log.note(failed=str(e))
         return None
 
-def run_batch():
+def build_track_task(category, key, dtw_entry, manual_entry):
+    """Pool task: build_track with its own perf record."""
+    with perf_log.track(key, category=category, stage="dataset"):
+        return build_track(category, key, dtw_entry, manual_entry, shared=True)
+
+def label_dtype(label_mode=None):
+    return np.int16 if (label_mode or LABEL_MODE) == 'mono' else np.uint8
+
+def shard_layout(label_mode=None):
+    """What the shards hold for label_mode: X (frames, CQT_BINS) float32, Y as get_aligned_midi_roll."""
+    label_mode = label_mode or LABEL_MODE
+    return shard_dataset.layout(np.float32, [CQT_BINS], label_dtype(label_mode),
+                                [] if label_mode == 'mono' else [PIANO_KEYS])
+
+def write_track(category, key, C_norm, Y, writer=None):
+    """Returns False (and the track counts as failed) if it could not be written."""
+    save_path = os.path.join(DATASET_DIR, category, f"{key}.npz")
+    X = C_norm.T
+    try:
+        with perf_log.span("write"):
+            if writer is not None:
+                writer.add(key, X.astype(np.float32), Y.astype(label_dtype()))
+            else:
+                np.savez_compressed(save_path, x=X.astype(np.float32), y=Y)
+        return True
+    except Exception as e:
+        print(f"  Error writing {key}: {e}")
+        perf_log.note(failed=str(e))
+        return False
+
+def alignment_inputs(dtw_entry, manual_entry):
+    """The part of the alignment entries that process_track actually uses (DTW wins)."""
+    if dtw_entry:
+        return {'mode': 'dtw', 'points': dtw_entry['points']}
+    if manual_entry:
+        return {'mode': 'manual', 'offset': manual_entry['offset'], 'speed': manual_entry['speed']}
+    return {'mode': 'none'}
+
+def run_batch(force=False, fmt=DATASET_FORMAT, workers=WORKERS):
     os.makedirs(DATASET_DIR, exist_ok=True)
-    for cat in ["first", "one_kor", "one_kor_sgl"]:
-        print(f"\n--- Generating: {cat} ---")
-        out_dir = os.path.join(DATASET_DIR, cat)
-        os.makedirs(out_dir, exist_ok=True)
-        dtw_map, manual_map = load_alignment_map(cat)
+    # One pool for all categories: workers pay their import/warm-up cost once
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=feature_pool.worker_init) if workers > 1 else None
+    with pool or nullcontext():
+        for cat in ["first", "one_kor", "one_kor_sgl"]:
+            print(f"\n--- Generating: {cat} ({fmt}) ---")
+            writer = None
+            if fmt == "shards":
+                # Shards of another label mode are started over (every track is stale then anyway)
+                writer = shard_dataset.ShardWriter(os.path.join(shard_dataset.SHARD_DIR, cat),
+                                                   layout=shard_layout())
+                manifest_name = f"dataset_shards_{cat}"
+            else:
+                out_dir = os.path.join(DATASET_DIR, cat)
+                os.makedirs(out_dir, exist_ok=True)
+                manifest_name = f"dataset_{cat}"
+            dtw_map, manual_map = load_alignment_map(cat)
+            # Only tracks whose audio, MIDI, alignment or DATASET_PARAMS changed are rebuilt
+            manifest = build_manifest.Manifest(manifest_name, DATASET_PARAMS, force=force)
         
-        files = [f.replace(".wav","") for f in os.listdir(os.path.join(BASE_DIR, "mp3", cat, "wav")) if f.endswith(".wav")]
-        count = 0
-        for i, key in enumerate(files):
-            dtw = dtw_map.get(key)
-            man = manual_map.get(key)
-            tag = process_track(cat, key, dtw, man)
-            if tag:
-                count += 1
-                if count % 10 == 0: print(f"[{count}/{len(files)}] Last: {key} -> {tag}", end="\r")
+            files = [f.replace(".wav","") for f in os.listdir(os.path.join(BASE_DIR, "mp3", cat, "wav")) if f.endswith(".wav")]
+            up_to_date = 0
+            stale = []
+            for i, key in enumerate(files):
+                dtw = dtw_map.get(key)
+                man = manual_map.get(key)
+                wav_path = os.path.join(BASE_DIR, "mp3", cat, "wav", f"{key}.wav")
+                midi_path = os.path.join(BASE_DIR, "mid/cleaned", f"{key}.mid")
+                fingerprint = manifest.fingerprint([wav_path, midi_path], alignment=alignment_inputs(dtw, man))
+                if writer is not None:
+                    fresh = key in writer and manifest.is_fresh(key, fingerprint)
+                else:
+                    fresh = manifest.is_fresh(key, fingerprint, os.path.join(out_dir, f"{key}.npz"))
+                if fresh:
+                    up_to_date += 1
+                    continue
+                stale.append((key, fingerprint, dtw, man))
+
+            count = 0
+            def finish(key, fingerprint, tag):
+                nonlocal count
+                if tag:
+                    manifest.record(key, fingerprint)
+                    count += 1
+                    if count % 10 == 0: print(f"[{count}/{len(files)}] Last: {key} -> {tag}", end="\r")
+                else:
+                    # A failed rebuild must not leave the frames of the old alignment readable
+                    if writer is not None: writer.remove(key)
+                    manifest.forget(key)
+
+            if pool is not None and len(stale) > 1:
+                futures = [pool.submit(build_track_task, cat, key, dtw, man) for key, _, dtw, man in stale]
+                # Written in file order as results arrive, X mapped from the feature cache
+                for (key, fingerprint, _, _), fut in zip(stale, futures):
+                    result = fut.result()
+                    if result is None:
+                        finish(key, fingerprint, None)
+                        continue
+                    tag, C_norm, Y = result
+                    if isinstance(C_norm, tuple):
+                        C_norm = feature_pool.attach(C_norm)
+                    with perf_log.track(key, category=cat, stage="dataset_write"):
+                        written = write_track(cat, key, C_norm, Y, writer)
+                    finish(key, fingerprint, tag if written else None)
+            else:
+                for key, fingerprint, dtw, man in stale:
+                    finish(key, fingerprint, process_track(cat, key, dtw, man, writer))
+            if writer is not None:
+                # Tracks whose WAV is gone; compact() reclaims their frames
+                for key in [k for k in writer.index["tracks"] if k not in files]:
+                    writer.remove(key)
+                    manifest.forget(key)
+                writer.close()
+                if writer.garbage_ratio() > shard_dataset.COMPACT_GARBAGE_RATIO:
+                    shard_dataset.compact(writer.out_dir)
+            manifest.save()
+            print(f"\n{cat}: {count} rebuilt, {up_to_date} already up to date")
     print("\nDone.")
 
 if __name__ == "__main__":
-    run_batch()
\ No newline at end of file
+    # --force ignores the build manifest and rebuilds every track, --npz writes the old format,
+    # --perf logs per-track stage timings (perf_log.py summarizes them), --workers N builds tracks in parallel
+    if "--perf" in sys.argv: perf_log.enable()
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else WORKERS
+    run_batch(force="--force" in sys.argv, fmt="npz" if "--npz" in sys.argv else DATASET_FORMAT, workers=workers)
\ No newline at end of file
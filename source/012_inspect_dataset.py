@@ -3,25 +3,43 @@ import matplotlib.pyplot as plt
 import os
 import random
 import glob
+import shard_dataset
 
 BASE_DIR = os.path.expanduser("~/ai_music")
 DATASET_DIR = os.path.join(BASE_DIR, "dataset_npz")
 
-def inspect_random():
+def pick_random_track():
+    """Returns (name, X, Y) of a random track, from the shards if present, else from the .npz files."""
+    shard_tracks = []
+    for cat in ["first", "one_kor", "one_kor_sgl"]:
+        out_dir = os.path.join(shard_dataset.SHARD_DIR, cat)
+        if shard_dataset.load_index(out_dir) is not None:
+            ds = shard_dataset.ShardedDataset(out_dir)
+            shard_tracks += [(ds, cat, key) for key in ds.keys()]
+    if shard_tracks:
+        ds, cat, key = random.choice(shard_tracks)
+        print(f"Inspecting: {cat}/{key} (shards)")
+        X, Y = ds.track(key)
+        return f"{cat}/{key}", X, Y
+
     # Find all .npz files
     files = glob.glob(os.path.join(DATASET_DIR, "*", "*.npz"))
     if not files:
-        print("No .npz files found. Run 011_prepare_dataset.py first.")
-        return
+        return None
 
     path = random.choice(files)
-    filename = os.path.basename(path)
     print(f"Inspecting: {path}")
 
     # Load
     data = np.load(path)
-    X = data['x'] # (Time, Freq)
-    Y = data['y'] # (Time,) - Pitch values
+    return os.path.basename(path), data['x'], data['y']
+
+def inspect_random():
+    track = pick_random_track()
+    if track is None:
+        print("No dataset found. Run 011_prepare_dataset.py first.")
+        return
+    filename, X, Y = track # X: (Time, Freq), Y: (Time,) - Pitch values
 
     # Plot
     plt.figure(figsize=(12, 6))
@@ -36,13 +54,18 @@ def inspect_random():
     # We need to map MIDI pitch to CQT Bin Index.
     # Bin = Pitch - 24 (If BINS_PER_OCTAVE=12 and starting at C1)
     
-    # Filter out silence (0)
-    time_indices = np.arange(len(Y))
-    mask = Y > 0
-    
-    midi_cqt_bins = Y[mask] - 24 
+    if Y.ndim == 2:
+        # Polyphonic (frames, 88) piano roll: key index 0 = A0 (midi 21)
+        time_indices, keys = np.nonzero(Y)
+        midi_cqt_bins = keys + 21 - 24
+    else:
+        # Filter out silence (0)
+        time_indices = np.arange(len(Y))
+        mask = Y > 0
+        time_indices = time_indices[mask]
+        midi_cqt_bins = Y[mask] - 24 
     
-    plt.scatter(time_indices[mask], midi_cqt_bins, color='cyan', s=5, label='Aligned MIDI Label')
+    plt.scatter(time_indices, midi_cqt_bins, color='cyan', s=5, label='Aligned MIDI Label')
     
     plt.title(f"Dataset Inspection: {filename}")
     plt.xlabel("Time Frames")
@@ -5,6 +5,8 @@ import librosa
 import pretty_midi
 from scipy.interpolate import interp1d
 import sys
+import feature_cache
+import banded_dtw
 
 # --- CONFIGURATION ---
 BASE_DIR = os.path.expanduser("~/ai_music")
@@ -28,7 +30,7 @@ DTW_STEP_SIZES = np.array([[1, 1], [1, 0], [0, 1]])
 
 # 3. BAND WIDTH: Global constraint (Sakoe-Chiba).
 # Limits how far the path can stray from the diagonal. 
-# None = No limit. Int = Number of frames (e.g., 100 frames ~= 2.3 seconds)
+# Fraction of the shorter sequence (0.12 = 12%). None = No limit (full N x M matrix!).
 # Set this if the AI is jumping to a completely wrong verse. OQ was none
 DTW_BAND_WIDTH = 0.12
 
@@ -65,28 +67,21 @@ def run_experiment(category, key):
     try:
         # 1. Load Data
         print("Loading Audio & MIDI...")
-        y_rec, _ = librosa.load(wav_path, sr=SR)
         pm = pretty_midi.PrettyMIDI(midi_path)
-        y_midi = pm.synthesize(fs=SR)
         
-        # 2. Compute Features (CQT)
+        # 2. Compute Features (CQT) - served from the feature cache when unchanged
         print("Computing Chroma...")
-        c_rec = librosa.feature.chroma_cqt(y=y_rec, sr=SR, hop_length=HOP_LENGTH)
-        c_midi = librosa.feature.chroma_cqt(y=y_midi, sr=SR, hop_length=HOP_LENGTH)
+        c_rec = feature_cache.audio_chroma(wav_path, SR, HOP_LENGTH)
+        c_midi = feature_cache.midi_chroma(midi_path, SR, HOP_LENGTH, pm=pm)
         
         # 3. Run DTW with Experimental Parameters
         print(f"Running DTW (Metric={DTW_METRIC}, Subseq={DTW_SUBSEQUENCE})...")
         
-        if DTW_SUBSEQUENCE:
-            D, wp = librosa.sequence.dtw(X=c_midi, Y=c_rec, metric=DTW_METRIC, 
-                                         step_sizes_sigma=DTW_STEP_SIZES, 
-                                         global_constraints=DTW_SUBSEQUENCE,                                          
-                                         band_rad=DTW_BAND_WIDTH)
-        else:
-            # Librosa Dtw standard
-            D, wp = librosa.sequence.dtw(X=c_midi, Y=c_rec, metric=DTW_METRIC, 
-                                         step_sizes_sigma=DTW_STEP_SIZES,
-                                         band_rad=DTW_BAND_WIDTH)
+        # Banded DTW: only the band is allocated, so long recordings fit in memory
+        _, wp = banded_dtw.dtw(c_midi, c_rec, metric=DTW_METRIC,
+                               step_sizes_sigma=DTW_STEP_SIZES,
+                               band_rad=DTW_BAND_WIDTH,
+                               subseq=DTW_SUBSEQUENCE)
 
         # 4. Post-Process Path
         wp = wp[::-1] # Reverse to be [Start -> End]
@@ -10,6 +10,8 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import tkinter as tk
 from tkinter import ttk, messagebox
+import feature_cache
+import midi_synth
 
 # --- CONFIGURATION ---
 BASE_DIR = os.path.expanduser("~/ai_music")
@@ -105,6 +107,8 @@ class AlignmentApp:
 
         midi_path = os.path.join(MIDI_DIR, f"{key}.mid")
         mp3_path = os.path.join(BASE_DIR, "mp3", category, f"{key}.mp3")
+        self.midi_path = midi_path
+        self.mp3_path = mp3_path
 
         if not os.path.exists(midi_path):
             messagebox.showerror("Missing MIDI", f"Could not find matching MIDI: {midi_path}")
@@ -113,7 +117,7 @@ class AlignmentApp:
         # 1. Load MIDI
         try:
             pm = pretty_midi.PrettyMIDI(midi_path)
-            self.midi_audio = pm.synthesize(fs=self.sr)
+            self.midi_audio = midi_synth.render(midi_path, self.sr, pm=pm)
         except Exception as e:
             print(f"Error parsing MIDI: {e}")
             return
@@ -149,8 +153,15 @@ class AlignmentApp:
 
         # 3. Compute CQT (CPB-like features)
         # hop_length=512 -> ~23ms time resolution
-        C_midi = librosa.feature.chroma_cqt(y=midi_crop, sr=self.sr, hop_length=512)
-        C_rec = librosa.feature.chroma_cqt(y=rec_crop, sr=self.sr, hop_length=512)
+        # Cached per source file + speed + crop, so flipping between songs/speeds is instant
+        C_midi = feature_cache.get_feature(
+            self.midi_path, "chroma_cqt_synth_crop",
+            lambda: librosa.feature.chroma_cqt(y=midi_crop, sr=self.sr, hop_length=512),
+            sr=self.sr, hop_length=512, n_samples=min_len)
+        C_rec = feature_cache.get_feature(
+            self.mp3_path, "chroma_cqt_stretch_crop",
+            lambda: librosa.feature.chroma_cqt(y=rec_crop, sr=self.sr, hop_length=512),
+            sr=self.sr, hop_length=512, duration=30, rate=speed, n_samples=min_len)
 
         # 4. Plot
         self.plot_results(C_midi, C_rec, midi_crop, rec_crop)
@@ -1,46 +1,65 @@
 import os
+import sys
 import glob
-from pydub import AudioSegment
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import audio_io
 
 # Install pydub if missing: pip install pydub
 # Ensure ffmpeg is installed: sudo apt install ffmpeg
 
 BASE_DIR = os.path.expanduser("~/ai_music/mp3")
 CATEGORIES = ["first", "one_kor", "one_kor_sgl"]
+WORKERS = os.cpu_count()
+# Also write a float32 .npy next to each WAV (memory-mapped by audio_io.load)
+WRITE_NPY = False
 
-def convert_mp3s():
-    print("--- Starting MP3 to WAV Conversion ---")
-    
+def convert_one(mp3_path, wav_path, write_npy):
+    """Runs in a worker. Returns (mp3_path, duration or None, error message)."""
+    try:
+        return mp3_path, audio_io.ingest_mp3(mp3_path, wav_path, write_npy=write_npy), ""
+    except Exception as e:
+        return mp3_path, None, str(e)
+
+def convert_mp3s(workers=WORKERS, write_npy=WRITE_NPY, force=False):
+    print("--- Starting MP3 to WAV Conversion (mono, 22050Hz) ---")
+
+    # 1. Collect work: every MP3 whose WAV is missing or not yet in the canonical format
+    tasks = []
     for cat in CATEGORIES:
         source_dir = os.path.join(BASE_DIR, cat)
         target_dir = os.path.join(source_dir, "wav")
-        
-        # Create wav subdirectory if it doesn't exist
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir)
-            print(f"Created directory: {target_dir}")
-            
+        os.makedirs(target_dir, exist_ok=True)
+
         files = glob.glob(os.path.join(source_dir, "*.mp3"))
-        
-        print(f"Processing {cat}: {len(files)} files...")
-        
+        todo = 0
         for f in files:
-            filename = os.path.basename(f)
-            name_only = os.path.splitext(filename)[0]
+            name_only = os.path.splitext(os.path.basename(f))[0]
             wav_path = os.path.join(target_dir, f"{name_only}.wav")
-            
-            # Skip if already exists to save time
-            if os.path.exists(wav_path):
+            done = os.path.exists(wav_path) and audio_io.is_canonical(wav_path)
+            if write_npy and not os.path.exists(audio_io.npy_path(wav_path)):
+                done = False
+            if done and not force:
                 continue
-                
-            try:
-                sound = AudioSegment.from_mp3(f)
-                # Export as standard WAV (16-bit PCM)
-                sound.export(wav_path, format="wav")
-            except Exception as e:
-                print(f"Failed to convert {filename}: {e}")
+            tasks.append((f, wav_path))
+            todo += 1
+        print(f"{cat}: {len(files)} files, {todo} to convert")
+
+    # 2. Decode in parallel; a failing file is reported and the rest continue
+    failed = []
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(convert_one, mp3, wav, write_npy) for mp3, wav in tasks]
+        for i, fut in enumerate(as_completed(futures), 1):
+            mp3_path, duration, error = fut.result()
+            if duration is None:
+                failed.append(mp3_path)
+                print(f"\nFailed to convert {os.path.basename(mp3_path)}: {error}")
+            print(f"  {i}/{len(tasks)} converted...", end="\r")
 
-    print("--- Conversion Complete ---")
+    print(f"\n--- Conversion Complete: {len(tasks) - len(failed)} ok, {len(failed)} failed ---")
+    return failed
 
 if __name__ == "__main__":
-    convert_mp3s()
\ No newline at end of file
+    # python 02_convert_to_wav.py [--npy] [--force] [--workers N]
+    args = sys.argv[1:]
+    workers = int(args[args.index("--workers") + 1]) if "--workers" in args else WORKERS
+    convert_mp3s(workers=workers, write_npy="--npy" in args or WRITE_NPY, force="--force" in args)
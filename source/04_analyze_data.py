@@ -5,15 +5,32 @@ import numpy as np
 import librosa
 import pretty_midi
 import sys
-from scipy.spatial.distance import cdist
+import feature_cache
+import build_manifest
+import sync_offset
+import transposition
+import peaks
+import audio_io
+import key_schedule
 
 # Configuration
 BASE_DIR = os.path.expanduser("~/ai_music")
 SR = 22050
 HOP_LENGTH = 512
+PIXELS_PER_SECOND = 50
+# Auto-sync searches every lag over the whole recording; set seconds here to limit it
+SYNC_MAX_LAG_SEC = None
+# 'auto': sync against the MIDI chroma shifted into the recording's key. 'off': as is.
+TRANSPOSITION = 'auto'
+# Anything that changes the output of analyze_track; part of the build manifest fingerprint
+ANALYSIS_PARAMS = {"sr": SR, "hop_length": HOP_LENGTH, "pixels_per_second": PIXELS_PER_SECOND,
+                   "peak_levels": peaks.PEAK_LEVELS,
+                   "sync": "xcorr", "sync_max_lag_sec": SYNC_MAX_LAG_SEC,
+                   "transposition": TRANSPOSITION, "transposition_min_gain": transposition.MIN_GAIN,
+                   "midi_renderer": feature_cache.midi_renderer()}
 
-def analyze_track(category, key):
-    # Paths
+def track_paths(category, key):
+    """Returns (audio path to load, midi path, output json path)."""
     mp3_path = os.path.join(BASE_DIR, "mp3", category, f"{key}.mp3")
     # Also check if a WAV exists directly (since you might have updated the WAV but not the MP3)
     wav_source_path = os.path.join(BASE_DIR, "mp3", category, "wav", f"{key}.wav")
@@ -23,82 +40,104 @@ def analyze_track(category, key):
     
     # Prefer loading from WAV if available (it's faster and might be the updated file)
     load_path = wav_source_path if os.path.exists(wav_source_path) else mp3_path
+    return load_path, midi_path, output_json
+
+def peaks_path(output_json):
+    return os.path.splitext(output_json)[0] + ".peaks"
+
+def analyze_track(category, key, ref=None):
+    """Pass the key's key_schedule.MidiReference to share its MIDI chroma across categories."""
+    load_path, midi_path, output_json = track_paths(category, key)
     
     if not os.path.exists(load_path):
         print(f"Error: Audio file not found: {load_path}")
-        return
+        return False
     if not os.path.exists(midi_path):
         print(f"Error: MIDI file not found: {midi_path}")
-        return
+        return False
 
     print(f"Analyzing {key} ({category})...")
 
     # --- 1. Load Audio ---
-    y_rec, _ = librosa.load(load_path, sr=SR)
+    y_rec, _ = audio_io.load(load_path, sr=SR)
     duration = len(y_rec) / SR
 
     # --- 2. Generate Waveform ---
-    pixels_per_second = 50
-    target_length = int(duration * pixels_per_second)
+    # Peak pyramid for the player (binary, one min/max level per zoom), plus the
+    # single-resolution JSON list older pages still read
+    peaks.write_peaks(peaks_path(output_json), peaks.build_pyramid(y_rec, SR), SR, duration)
+    target_length = int(duration * PIXELS_PER_SECOND)
     hop = max(1, len(y_rec) // target_length)
-    waveform = []
-    for i in range(0, len(y_rec), hop):
-        chunk = y_rec[i:i+hop]
-        if len(chunk) > 0:
-            waveform.append(float(np.max(np.abs(chunk))))
-    
+    waveform = np.abs(peaks.min_max(y_rec, hop)).max(axis=1).tolist()
+
     # --- 3. AUTO-SYNC ---
+    transpose = 0
     try:
-        pm = pretty_midi.PrettyMIDI(midi_path)
-        y_midi = pm.synthesize(fs=SR)
-        
-        chroma_rec = librosa.feature.chroma_cqt(y=y_rec, sr=SR, hop_length=HOP_LENGTH)
-        chroma_midi = librosa.feature.chroma_cqt(y=y_midi, sr=SR, hop_length=HOP_LENGTH)
-        
-        # Analyze first 30s
-        frames_to_check = int(30 * SR / HOP_LENGTH)
-        c_rec_short = chroma_rec[:, :frames_to_check]
-        c_midi_short = chroma_midi[:, :frames_to_check]
+        chroma_rec = feature_cache.audio_chroma(load_path, SR, HOP_LENGTH, y=y_rec)
+        chroma_midi = (ref or key_schedule.MidiReference(midi_path)).chroma(SR, HOP_LENGTH)
+        if TRANSPOSITION == 'auto':
+            transpose = transposition.estimate(chroma_rec, chroma_midi)[0]
+            chroma_midi = transposition.apply(chroma_midi, transpose)
         
-        dist = cdist(c_rec_short.T, c_midi_short.T, metric='cosine')
-        
-        frames_per_sec = SR / HOP_LENGTH
-        search_range = int(6 * frames_per_sec)
-        
-        diagonals = []
-        for lag in range(-int(2 * frames_per_sec), search_range):
-            d_cost = np.trace(dist, offset=lag)
-            overlap = dist.shape[0] - abs(lag)
-            if overlap > 0:
-                diagonals.append((lag, d_cost / overlap))
-        
-        best_lag, _ = min(diagonals, key=lambda x: x[1])
-        calculated_offset = -(best_lag * HOP_LENGTH / SR)
+        # Whole recording, all lags at once (FFT cross-correlation)
+        calculated_offset, sync_confidence = sync_offset.estimate_offset(
+            chroma_rec, chroma_midi, SR, HOP_LENGTH, max_lag_sec=SYNC_MAX_LAG_SEC)
     except Exception as e:
         print(f"Sync calculation failed: {e}")
-        calculated_offset = 0.0
+        calculated_offset, sync_confidence = 0.0, 0.0
 
     # --- 4. Export ---
     data = {
         "waveform": waveform,
         "duration": duration,
-        "auto_offset": calculated_offset
+        "auto_offset": calculated_offset,
+        "sync_confidence": sync_confidence,
+        "transpose": transpose
     }
     
     with open(output_json, 'w') as f:
         json.dump(data, f)
     print(f"Success: Updated {output_json}")
+    return True
 
-def run_batch():
-    for cat in ["first", "one_kor", "one_kor_sgl"]:
+def run_batch(force=False, categories=key_schedule.CATEGORIES):
+    # Only tracks whose audio, MIDI or ANALYSIS_PARAMS changed are re-analyzed
+    manifests = {}
+    counts = {}
+    stale = []
+    for cat in categories:
+        manifest = build_manifest.Manifest(f"analyze_{cat}", ANALYSIS_PARAMS, force=force)
         files = glob.glob(os.path.join(BASE_DIR, "mp3", cat, "*.mp3"))
+        up_to_date = 0
         for f in files:
             key = os.path.splitext(os.path.basename(f))[0]
-            analyze_track(cat, key)
+            load_path, midi_path, output_json = track_paths(cat, key)
+            fingerprint = manifest.fingerprint([load_path, midi_path])
+            if manifest.is_fresh(key, fingerprint, output_json) and os.path.exists(peaks_path(output_json)):
+                up_to_date += 1
+                continue
+            stale.append((key, cat, midi_path, fingerprint))
+        manifests[cat] = manifest
+        counts[cat] = (up_to_date, len(files))
+
+    # Key by key, so the MIDI chroma is fetched once for all categories (key_schedule)
+    for key, jobs in key_schedule.group_by_key(stale).items():
+        ref = key_schedule.MidiReference(jobs[0][2])
+        for _, cat, _, fingerprint in jobs:
+            if analyze_track(cat, key, ref=ref):
+                manifests[cat].record(key, fingerprint)
+            else:
+                manifests[cat].forget(key)
+
+    for cat in categories:
+        manifests[cat].save()
+        print(f"{cat}: {counts[cat][0]}/{counts[cat][1]} already up to date")
 
 if __name__ == "__main__":
     # If arguments provided: python script.py [category] [key]
-    if len(sys.argv) > 2:
-        analyze_track(sys.argv[1], sys.argv[2])
+    # Batch: python script.py [--force]  (--force ignores the build manifest)
+    args = [a for a in sys.argv[1:] if a != "--force"]
+    if len(args) > 1:
+        analyze_track(args[0], args[1])
     else:
-        run_batch()
\ No newline at end of file
+        run_batch(force="--force" in sys.argv)
\ No newline at end of file
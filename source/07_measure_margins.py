@@ -1,8 +1,17 @@
 import os
+import sys
 import glob
 import json
+import numpy as np
+import soundfile as sf
 import librosa
 import pretty_midi
+import build_manifest
+import alignment_store
+import feature_cache
+import sync_offset
+import transposition
+import audio_io
 
 BASE_DIR = os.path.expanduser("~/ai_music")
 SETUP_DIR = os.path.join(BASE_DIR, "setup")
@@ -10,20 +19,220 @@ CATEGORIES = ["first", "one_kor", "one_kor_sgl"]
 
 # Silence Threshold (dB) - adjusted for synth vs recording
 TOP_DB = 30 
+# librosa.effects.trim framing at 22050 Hz; scaled to the file's own rate when streaming
+TRIM_SR = 22050
+FRAME_LENGTH = 2048
+HOP_LENGTH = 512
+# Frames read per block by the streaming detector (constant memory)
+BLOCK_FRAMES = 256
+# Orchestra offsets: 'off' assumes the recording starts with the MIDI (offset 0).
+# 'xcorr' takes sync_offset.estimate_offset's offset when its confidence is at least
+# SYNC_MIN_CONFIDENCE and falls back to 0 otherwise; "offset_method" records which was used.
+OFFSET_SYNC = 'off'
+SYNC_MIN_CONFIDENCE = 4.0
+SYNC_SR = 22050
+SYNC_HOP_LENGTH = 512
+# Anything that changes the measured values; part of the build manifest fingerprint
+MARGIN_PARAMS = {"top_db": TOP_DB, "sr": TRIM_SR, "frame_length": FRAME_LENGTH, "hop_length": HOP_LENGTH}
 
-def measure_all():
+def margin_params(sync=OFFSET_SYNC):
+    if sync == 'off':
+        return MARGIN_PARAMS
+    return dict(MARGIN_PARAMS, sync=sync, sync_min_confidence=SYNC_MIN_CONFIDENCE,
+                sync_sr=SYNC_SR, sync_hop_length=SYNC_HOP_LENGTH,
+                transposition_min_gain=transposition.MIN_GAIN,
+                midi_renderer=feature_cache.midi_renderer())
+
+# --- STREAMING TRIM ---
+# Same rule as librosa.effects.trim(y, top_db=TOP_DB): a frame is active if its RMS
+# (centered frames, zero padded) is within TOP_DB of the loudest frame. The file is
+# read with soundfile in blocks at its own rate: the loudest frame is found once per
+# file version (remembered per (path, size, mtime) in MAX_POWER_INDEX_PATH, so a re-run
+# never reads a whole file), then only the edges are read until the first active
+# frame from the front and from the back.
+MAX_POWER_INDEX_PATH = os.path.join(build_manifest.MANIFEST_DIR, "max_frame_power.json")
+_max_power_index = None
+
+def _native_framing(sr):
+    scale = sr / TRIM_SR
+    return max(2, int(round(FRAME_LENGTH * scale / 2)) * 2), max(1, int(round(HOP_LENGTH * scale)))
+
+def _frame_powers(f, k0, k1, frame, hop, n):
+    """Mean square of frames k0..k1-1 (frame k is centered on sample k * hop)."""
+    a = k0 * hop - frame // 2
+    b = (k1 - 1) * hop - frame // 2 + frame
+    f.seek(max(0, a))
+    y = f.read(min(b, n) - max(0, a), dtype='float32', always_2d=True).mean(axis=1)
+    y = np.pad(y, (max(0, -a), max(0, b - n)))
+    csum = np.concatenate(([0.0], np.cumsum(y.astype(np.float64) ** 2)))
+    starts = np.arange(k1 - k0) * hop
+    return (csum[starts + frame] - csum[starts]) / frame
+
+def _frame_blocks(n_frames, reverse=False):
+    blocks = [(k, min(k + BLOCK_FRAMES, n_frames)) for k in range(0, n_frames, BLOCK_FRAMES)]
+    return blocks[::-1] if reverse else blocks
+
+def max_frame_power(wav_path):
+    with sf.SoundFile(wav_path) as f:
+        frame, hop = _native_framing(f.samplerate)
+        n_frames = 1 + f.frames // hop
+        return np.array([max(_frame_powers(f, k0, k1, frame, hop, f.frames).max()
+                             for k0, k1 in _frame_blocks(n_frames))])
+
+def known_max_frame_power(wav_path):
+    """max_frame_power, computed once per (path, size, mtime) and framing."""
+    global _max_power_index
+    if _max_power_index is None:
+        _max_power_index = {}
+        if os.path.exists(MAX_POWER_INDEX_PATH):
+            try:
+                with open(MAX_POWER_INDEX_PATH, 'r') as f: _max_power_index = json.load(f)
+            except ValueError:
+                pass
+
+    st = os.stat(wav_path)
+    abs_path = os.path.abspath(wav_path)
+    stamp = [st.st_size, st.st_mtime_ns, TRIM_SR, FRAME_LENGTH, HOP_LENGTH]
+    known = _max_power_index.get(abs_path)
+    if known and known[:-1] == stamp:
+        return known[-1]
+    ref = float(max_frame_power(wav_path)[0])
+    _max_power_index[abs_path] = stamp + [ref]
+    return ref
+
+def save_max_power_index():
+    if _max_power_index is None: return
+    build_manifest.write_json(MAX_POWER_INDEX_PATH, _max_power_index)
+
+def stream_trim(wav_path, top_db=TOP_DB):
+    """(start_sec, end_sec) of the non-silent part, like librosa.effects.trim's index / sr."""
+    ref = known_max_frame_power(wav_path)
+    # amplitude_to_db(rms, ref=np.max) > -top_db, in the power domain
+    threshold = max(1e-10, ref) * 10 ** (-top_db / 10)
+
+    with sf.SoundFile(wav_path) as f:
+        sr, n = f.samplerate, f.frames
+        frame, hop = _native_framing(sr)
+        n_frames = 1 + n // hop
+
+        first = last = None
+        for k0, k1 in _frame_blocks(n_frames):
+            active = np.flatnonzero(np.maximum(1e-10, _frame_powers(f, k0, k1, frame, hop, n)) > threshold)
+            if active.size:
+                first = k0 + active[0]
+                break
+        if first is None:
+            return 0.0, 0.0
+        for k0, k1 in _frame_blocks(n_frames, reverse=True):
+            active = np.flatnonzero(np.maximum(1e-10, _frame_powers(f, k0, k1, frame, hop, n)) > threshold)
+            if active.size:
+                last = k0 + active[-1]
+                break
+    return first * hop / sr, min(n, (last + 1) * hop) / sr
+
+def librosa_trim(wav_path, top_db=TOP_DB):
+    """Full decode fallback for files soundfile cannot read."""
+    y, sr = audio_io.load(wav_path, sr=TRIM_SR)
+    yt, index = librosa.effects.trim(y, top_db=top_db)
+    return index[0] / sr, index[1] / sr
+
+def xcorr_offset(wav_path, midi_path, pm=None):
+    """(offset_sec, confidence) from the chroma cross-correlation, MIDI shifted into the recording's key."""
+    chroma_rec = feature_cache.audio_chroma(wav_path, SYNC_SR, SYNC_HOP_LENGTH)
+    chroma_midi = feature_cache.midi_chroma(midi_path, SYNC_SR, SYNC_HOP_LENGTH, pm=pm)
+    chroma_midi = transposition.apply(chroma_midi, transposition.estimate(chroma_rec, chroma_midi)[0])
+    return sync_offset.estimate_offset(chroma_rec, chroma_midi, SYNC_SR, SYNC_HOP_LENGTH)
+
+def measure_track(cat, wav_path, midi_path, sync=OFFSET_SYNC):
+    """Heuristic offset/speed of one recording vs. its MIDI."""
+    # 1. Measure WAV (Silence Detection)
+    try:
+        try:
+            wav_start_sec, wav_end_sec = stream_trim(wav_path)
+        except RuntimeError:
+            wav_start_sec, wav_end_sec = librosa_trim(wav_path)
+        wav_active_dur = wav_end_sec - wav_start_sec
+    except:
+        wav_start_sec = 0.0
+        wav_active_dur = 0.0
+
+    # 2. Measure MIDI
+    pm = None
+    try:
+        pm = pretty_midi.PrettyMIDI(midi_path)
+        start_times = [n.start for i in pm.instruments for n in i.notes]
+        end_times = [n.end for i in pm.instruments for n in i.notes]
+        
+        if start_times:
+            midi_start = min(start_times)
+            midi_end = max(end_times)
+            midi_active_dur = midi_end - midi_start
+        else:
+            midi_active_dur = 0.0
+    except:
+        midi_active_dur = 0.0
+
+    # 3. Apply Heuristics
+    calc_offset = 0.0
+    calc_speed = 1.0
+    offset_method = "silence" if cat == "first" else "heuristic"
+    sync_confidence = None
+
+    if cat == "first":
+        # Synth: Perfect speed, just need to find where audio starts
+        calc_offset = wav_start_sec
+        calc_speed = 1.0
+    else:
+        # Orchestra: Assume starts at 0 (unless the chroma sync is sure), calculate speed stretch
+        calc_offset = 0.0
+        if sync == 'xcorr':
+            try:
+                xcorr_sec, sync_confidence = xcorr_offset(wav_path, midi_path, pm)
+                if sync_confidence >= SYNC_MIN_CONFIDENCE:
+                    calc_offset, offset_method = xcorr_sec, "xcorr"
+            except Exception as e:
+                print(f"Sync calculation failed for {wav_path}: {e}")
+        if midi_active_dur > 0.5 and wav_active_dur > 0.5:
+            # Ratio of Audio Length to MIDI Length
+            calc_speed = wav_active_dur / midi_active_dur
+        else:
+            calc_speed = 1.0
+
+    result = {
+        "calc_offset": round(calc_offset, 3),
+        "calc_speed": round(calc_speed, 3),
+        "offset_method": offset_method
+    }
+    if sync_confidence is not None:
+        result["sync_confidence"] = round(sync_confidence, 2)
+    return result
+
+def load_frozen_map():
+    """{category: [frozen keys]} from setup/frozen_files.json (empty if there is none)."""
+    frozen_path = os.path.join(SETUP_DIR, "frozen_files.json")
+    if not os.path.exists(frozen_path): return {}
+    with open(frozen_path, 'r') as f: return json.load(f)
+
+def track_fingerprint(manifest, cat, wav_path, midi_path):
+    """Fingerprint of one track in the margins_{cat} manifest."""
+    return manifest.fingerprint([wav_path, midi_path], category=cat)
+
+def measure_all(force=False, sync=OFFSET_SYNC):
     print("--- Measuring Margins (Smart Heuristics) ---")
     os.makedirs(SETUP_DIR, exist_ok=True)
 
-    # Load frozen list
-    frozen_map = {}
-    frozen_path = os.path.join(SETUP_DIR, "frozen_files.json")
-    if os.path.exists(frozen_path):
-        with open(frozen_path, 'r') as f: frozen_map = json.load(f)
+    frozen_map = load_frozen_map()
 
     for cat in CATEGORIES:
         print(f"Processing category: {cat}")
         alignment_data = {}
+        out_file = os.path.join(SETUP_DIR, f"alignment_{cat}.json")
+
+        # Previous results are kept for tracks whose inputs did not change
+        manifest = build_manifest.Manifest(f"margins_{cat}", margin_params(sync), force=force)
+        conn = alignment_store.connect()
+        previous = alignment_store.load(conn, "heuristic", cat)
+        up_to_date = 0
         
         wav_dir = os.path.join(BASE_DIR, "mp3", cat, "wav")
         midi_dir = os.path.join(BASE_DIR, "mid/cleaned")
@@ -36,63 +245,25 @@ def measure_all():
             if not os.path.exists(midi_path): continue
             if i % 10 == 0: print(f"  {i}/{len(wav_files)}...", end="\r")
 
-            # 1. Measure WAV (Silence Detection)
-            try:
-                # Load with default SR for speed
-                y, sr = librosa.load(wav_path, sr=22050)
-                # Trim silence
-                yt, index = librosa.effects.trim(y, top_db=TOP_DB)
-                
-                wav_start_sec = index[0] / sr
-                wav_end_sec = index[1] / sr
-                wav_active_dur = wav_end_sec - wav_start_sec
-            except:
-                wav_start_sec = 0.0
-                wav_active_dur = 0.0
-
-            # 2. Measure MIDI
-            try:
-                pm = pretty_midi.PrettyMIDI(midi_path)
-                start_times = [n.start for i in pm.instruments for n in i.notes]
-                end_times = [n.end for i in pm.instruments for n in i.notes]
-                
-                if start_times:
-                    midi_start = min(start_times)
-                    midi_end = max(end_times)
-                    midi_active_dur = midi_end - midi_start
-                else:
-                    midi_active_dur = 0.0
-            except:
-                midi_active_dur = 0.0
-
-            # 3. Apply Heuristics
-            calc_offset = 0.0
-            calc_speed = 1.0
+            is_frozen = (key in frozen_map.get(cat, []))
+            fingerprint = track_fingerprint(manifest, cat, wav_path, midi_path)
+            if key in previous and manifest.is_fresh(key, fingerprint):
+                alignment_data[key] = dict(previous[key], is_frozen=is_frozen)
+                up_to_date += 1
+                continue
 
-            if cat == "first":
-                # Synth: Perfect speed, just need to find where audio starts
-                calc_offset = wav_start_sec
-                calc_speed = 1.0
-            else:
-                # Orchestra: Assume starts at 0, calculate speed stretch
-                calc_offset = 0.0
-                if midi_active_dur > 0.5 and wav_active_dur > 0.5:
-                    # Ratio of Audio Length to MIDI Length
-                    calc_speed = wav_active_dur / midi_active_dur
-                else:
-                    calc_speed = 1.0
-
-            alignment_data[key] = {
-                "calc_offset": round(calc_offset, 3),
-                "calc_speed": round(calc_speed, 3),
-                "is_frozen": (key in frozen_map.get(cat, []))
-            }
+            alignment_data[key] = measure_track(cat, wav_path, midi_path, sync)
+            alignment_data[key]["is_frozen"] = is_frozen
+            manifest.record(key, fingerprint)
 
-        out_file = os.path.join(SETUP_DIR, f"alignment_{cat}.json")
-        with open(out_file, 'w') as f:
-            json.dump(alignment_data, f, indent=2)
+        alignment_store.upsert_many(conn, "heuristic", cat, alignment_data.items())
+        alignment_store.export_json(conn, "heuristic", cat, keys=list(alignment_data))
+        manifest.save()
+        save_max_power_index()
             
-        print(f"\n  Saved {len(alignment_data)} records to {out_file}")
+        print(f"\n  Saved {len(alignment_data)} records to {out_file} ({up_to_date} already up to date)")
 
 if __name__ == "__main__":
-    measure_all()
\ No newline at end of file
+    # --force ignores the build manifest and re-measures everything;
+    # --xcorr takes confident chroma cross-correlation offsets for the orchestra categories
+    measure_all(force="--force" in sys.argv, sync='xcorr' if "--xcorr" in sys.argv else OFFSET_SYNC)
\ No newline at end of file
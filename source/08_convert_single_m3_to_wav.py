@@ -1,8 +1,8 @@
 import sys
 import os
-from pydub import AudioSegment
+import audio_io
 
-# Usage: python3 source/convert_single.py [path_to_mp3]
+# Usage: python3 source/convert_single.py [path_to_mp3] [--npy]
 # Example: python3 source/convert_single.py ~/ai_music/mp3/one_kor_sgl/ha-mzzllevzzzng.mp3
 
 def convert_single(file_path):
@@ -27,16 +27,9 @@ def convert_single(file_path):
     print(f"Target: Mono, 22050Hz")
 
     try:
-        # Load
-        sound = AudioSegment.from_mp3(file_path)
-        
-        # TRANSFORMATION
-        sound = sound.set_channels(1)       # Force Mono
-        sound = sound.set_frame_rate(22050) # Force 22050Hz
-        
-        # Export
-        sound.export(out_path, format="wav")
-        print(f"Success! Saved to: {out_path}")
+        # Same decode as 02_convert_to_wav (downmix + resample once, analysis format)
+        duration = audio_io.ingest_mp3(file_path, out_path, write_npy="--npy" in sys.argv)
+        print(f"Success! Saved {duration:.1f}s to: {out_path}")
         
     except Exception as e:
         print(f"Conversion Failed: {e}")
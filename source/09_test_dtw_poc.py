@@ -7,6 +7,9 @@ import librosa.display
 import pretty_midi
 import matplotlib.pyplot as plt
 import sys
+import feature_cache
+import alignment_store
+import key_schedule
 
 # --- CONFIGURATION ---
 BASE_DIR = os.path.expanduser("~/ai_music")
@@ -17,18 +20,15 @@ HOP_LENGTH = 512
 def load_manual_saves():
     """Aggregates all manual saves into a single list."""
     saves = []
+    conn = alignment_store.connect()
     for cat in ["first", "one_kor", "one_kor_sgl"]:
-        path = os.path.join(SETUP_DIR, f"alignment_manual_{cat}.json")
-        if os.path.exists(path):
-            with open(path, 'r') as f:
-                data = json.load(f)
-                for key, val in data.items():
-                    saves.append({
-                        "category": cat,
-                        "key": key,
-                        "manual_offset": float(val['offset']),
-                        "manual_speed": float(val['speed'])
-                    })
+        for key, val in alignment_store.load(conn, "manual", cat).items():
+            saves.append({
+                "category": cat,
+                "key": key,
+                "manual_offset": float(val['offset']),
+                "manual_speed": float(val['speed'])
+            })
     return saves
 
 def get_midi_start_time(pm):
@@ -41,7 +41,8 @@ def get_midi_start_time(pm):
         return min(start_times)
     return 0.0
 
-def test_dtw(track_info):
+def test_dtw(track_info, ref=None):
+    """Pass the key's key_schedule.MidiReference when testing several recordings of one key."""
     cat = track_info['category']
     key = track_info['key']
     m_offset = track_info['manual_offset']
@@ -55,18 +56,16 @@ def test_dtw(track_info):
     if not os.path.exists(wav_path):
         print(f"Audio file missing: {wav_path}")
         return
-
-    y_rec, _ = librosa.load(wav_path, sr=SR)
     
-    # 2. Load MIDI & Synthesize
+    # 2. Load MIDI
     midi_path = os.path.join(BASE_DIR, "mid/cleaned", f"{key}.mid")
     if not os.path.exists(midi_path):
         print(f"MIDI file missing: {midi_path}")
         return
 
+    ref = ref or key_schedule.MidiReference(midi_path)
     try:
-        pm = pretty_midi.PrettyMIDI(midi_path)
-        y_midi = pm.synthesize(fs=SR)
+        pm = ref.pm
         
         # KEY FIX: Get the start time of the first note
         first_note_time = get_midi_start_time(pm)
@@ -78,8 +77,8 @@ def test_dtw(track_info):
 
     # 3. Compute Chroma
     print("Computing Chroma...")
-    c_rec = librosa.feature.chroma_cqt(y=y_rec, sr=SR, hop_length=HOP_LENGTH)
-    c_midi = librosa.feature.chroma_cqt(y=y_midi, sr=SR, hop_length=HOP_LENGTH)
+    c_rec = feature_cache.audio_chroma(wav_path, SR, HOP_LENGTH)
+    c_midi = ref.chroma(SR, HOP_LENGTH)
 
     # 4. Run DTW
     D, wp = librosa.sequence.dtw(X=c_midi, Y=c_rec, metric='cosine')
@@ -128,14 +127,19 @@ if __name__ == "__main__":
         
     print(f"Found {len(saves)} manually validated files.")
     
+    # Every manual save of the key (one per category), against one MIDI reference
+    by_key = key_schedule.group_by_key((x['key'], x) for x in saves)
     if len(sys.argv) > 1:
         target = sys.argv[1]
-        found = next((x for x in saves if x['key'] == target), None)
-        if found:
-            test_dtw(found)
+        if target in by_key:
+            ref = key_schedule.MidiReference(key_schedule.midi_path(target))
+            for _, found in by_key[target]:
+                test_dtw(found, ref)
         else:
             print(f"Key '{target}' not found in manual saves.")
     else:
-        choice = random.choice(saves)
-        test_dtw(choice)
+        choice = random.choice(list(by_key))
+        ref = key_schedule.MidiReference(key_schedule.midi_path(choice))
+        for _, found in by_key[choice]:
+            test_dtw(found, ref)
         print("\nTip: Run 'python3 source/08_test_dtw_poc.py [filename]' to test a specific song.")
\ No newline at end of file
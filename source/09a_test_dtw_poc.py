@@ -7,6 +7,8 @@ import librosa.display
 import pretty_midi
 import matplotlib.pyplot as plt
 import sys
+import feature_cache
+import alignment_store
 
 # --- CONFIGURATION ---
 BASE_DIR = os.path.expanduser("~/ai_music")
@@ -17,18 +19,15 @@ HOP_LENGTH = 256
 def load_manual_saves():
     """Aggregates all manual saves into a single list."""
     saves = []
+    conn = alignment_store.connect()
     for cat in ["one_kor", "one_kor_sgl"]:
-        path = os.path.join(SETUP_DIR, f"alignment_manual_{cat}.json")
-        if os.path.exists(path):
-            with open(path, 'r') as f:
-                data = json.load(f)
-                for key, val in data.items():
-                    saves.append({
-                        "category": cat,
-                        "key": key,
-                        "manual_offset": float(val['offset']),
-                        "manual_speed": float(val['speed'])
-                    })
+        for key, val in alignment_store.load(conn, "manual", cat).items():
+            saves.append({
+                "category": cat,
+                "key": key,
+                "manual_offset": float(val['offset']),
+                "manual_speed": float(val['speed'])
+            })
     return saves
 
 def get_midi_start_time(pm):
@@ -55,10 +54,8 @@ def test_dtw(track_info):
     if not os.path.exists(wav_path):
         print(f"Audio file missing: {wav_path}")
         return
-
-    y_rec, _ = librosa.load(wav_path, sr=SR)
     
-    # 2. Load MIDI & Synthesize
+    # 2. Load MIDI
     midi_path = os.path.join(BASE_DIR, "mid/cleaned", f"{key}.mid")
     if not os.path.exists(midi_path):
         print(f"MIDI file missing: {midi_path}")
@@ -66,7 +63,6 @@ def test_dtw(track_info):
 
     try:
         pm = pretty_midi.PrettyMIDI(midi_path)
-        y_midi = pm.synthesize(fs=SR)
         
         # KEY FIX: Get the start time of the first note
         first_note_time = get_midi_start_time(pm)
@@ -78,8 +74,8 @@ def test_dtw(track_info):
 
     # 3. Compute Chroma
     print("Computing Chroma...")
-    c_rec = librosa.feature.chroma_cqt(y=y_rec, sr=SR, hop_length=HOP_LENGTH)
-    c_midi = librosa.feature.chroma_cqt(y=y_midi, sr=SR, hop_length=HOP_LENGTH)
+    c_rec = feature_cache.audio_chroma(wav_path, SR, HOP_LENGTH)
+    c_midi = feature_cache.midi_chroma(midi_path, SR, HOP_LENGTH, pm=pm)
 
     # 4. Run DTW
     D, wp = librosa.sequence.dtw(X=c_midi, Y=c_rec, metric='cosine')
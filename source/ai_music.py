@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import argparse
+import importlib
+
+# One entry point for the pipeline:  python source/ai_music.py <command> [options]
+# (or the ./ai_music launcher in the repo root, which uses the venv).
+# Only the standard library is imported up front; every command imports its stage
+# (and with it librosa, pretty_midi, matplotlib, ...) when it runs, so metadata
+# commands like `list` and `show` start instantly.
+
+BASE_DIR = os.path.expanduser("~/ai_music")
+CATEGORIES = ["first", "one_kor", "one_kor_sgl"]
+
+def stage(name):
+    """Numbered scripts can't be imported by name; load one on demand."""
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    if source_dir not in sys.path:
+        sys.path.insert(0, source_dir)
+    return importlib.import_module(name)
+
+# --- COMMANDS ---
+
+def cmd_verify(args):
+    stage("00_verify_environment").check_pairs()
+
+def cmd_convert(args):
+    if args.mp3:
+        for path in args.mp3:
+            stage("08_convert_single_m3_to_wav").convert_single(path)
+        return
+    failed = stage("02_convert_to_wav").convert_mp3s(workers=args.workers or os.cpu_count(),
+                                                     write_npy=args.npy, force=args.force)
+    return 1 if failed else 0
+
+def cmd_analyze(args):
+    if args.midi_renderer: os.environ["AI_MUSIC_MIDI_RENDERER"] = args.midi_renderer
+    m04 = stage("04_analyze_data")
+    if args.category and args.key:
+        return 0 if m04.analyze_track(args.category, args.key) else 1
+    m04.run_batch(force=args.force)
+
+def cmd_margins(args):
+    m07 = stage("07_measure_margins")
+    m07.measure_all(force=args.force, sync='xcorr' if args.xcorr else m07.OFFSET_SYNC)
+
+def cmd_dtw(args):
+    if args.midi_renderer: os.environ["AI_MUSIC_MIDI_RENDERER"] = args.midi_renderer
+    if args.perf: stage("perf_log").enable()
+    m010 = stage("010_generate_dtw_alignment")
+    mode = 'multiscale' if args.multiscale else m010.DTW_MODE
+    m010.process_categories(args.category or m010.CATEGORIES, mode, args.workers or m010.WORKERS,
+                            force=args.force)
+
+def cmd_sweep(args):
+    sweep = stage("dtw_sweep")
+    grid = None
+    if args.grid:
+        with open(args.grid, 'r') as f: grid = json.load(f)
+    for cat in args.category or sweep.CATEGORIES:
+        sweep.sweep_category(cat, grid, workers=args.workers or sweep.WORKERS, top=args.top)
+
+def cmd_bench(args):
+    regressions = []
+    bench = stage("benchmark")
+    for name in args.fixture or list(bench.FIXTURES):
+        regressions += bench.run_fixture(name, args.stage, save_baseline=args.save_baseline)
+    return 1 if regressions else 0
+
+def cmd_follow(args):
+    follower = stage("online_follower")
+    midi_path = os.path.join(BASE_DIR, "mid", "cleaned", f"{args.key}.mid")
+    if args.live:
+        for audio_t, midi_t, spent in follower.follow(follower.mic_blocks(), midi_path):
+            print(f"\r  {audio_t:7.2f}s -> MIDI {midi_t:7.2f}s  ({spent * 1000:.1f} ms)", end="")
+        return 0
+    wav_path = os.path.join(BASE_DIR, "mp3", args.category, "wav", f"{args.key}.wav")
+    return 0 if follower.run_file(wav_path, midi_path, args.category, args.key) else 1
+
+def cmd_index(args):
+    index = stage("melody_index")
+    index.build(midi_dir=args.midi_dir or index.MIDI_DIR, workers=args.workers or index.WORKERS, force=args.force)
+
+def cmd_identify(args):
+    index = stage("melody_index")
+    results = index.identify_file(args.recording, args.start, args.duration, args.top)
+    for rank, r in enumerate(results, 1):
+        print(f"{rank:>3}. {r['key']:<40} cost {r['cost']:.3f}  index score {r['score']:.2f}  at {r['midi_start']:.1f}s")
+    return 0 if results else 1
+
+def cmd_search(args):
+    search = stage("corpus_search")
+    if args.build:
+        search.build_corpus(workers=args.workers or search.WORKERS, force=args.force)
+    if not args.recording:
+        return
+    corpus = search.load_corpus()
+    for path in args.recording:
+        results, stats = search.search_file(path, args.start, args.duration, args.top, corpus)
+        print(f"\n{path}")
+        search.print_stats(stats)
+        for rank, (key, cost) in enumerate(results, 1):
+            print(f"{rank:>3}. {key:<40} cost {cost:.4f}")
+
+def cmd_dataset(args):
+    if args.perf: stage("perf_log").enable()
+    m011 = stage("011_prepare_dataset")
+    m011.run_batch(force=args.force, fmt="npz" if args.npz else m011.DATASET_FORMAT,
+                   workers=args.workers or m011.WORKERS)
+
+def cmd_inspect(args):
+    stage("012_inspect_dataset").inspect_random()
+
+def cmd_freeze(args):
+    if args.undo:
+        stage("06_unfreeze_and_list").unfreeze_data()
+    else:
+        stage("05_freeze_validation_set").freeze_dataset()
+
+def cmd_perf(args):
+    perf_log = stage("perf_log")
+    paths = args.log
+    if not paths and os.path.isdir(perf_log.PERF_DIR):
+        paths = [os.path.join(perf_log.PERF_DIR, f) for f in sorted(os.listdir(perf_log.PERF_DIR)) if f.endswith(".jsonl")]
+    for p in paths:
+        perf_log.summarize(p, worst=args.worst)
+        print()
+
+def cmd_list(args):
+    """Keys that have both a WAV and a cleaned MIDI, per category."""
+    unknown = [c for c in args.category if c not in CATEGORIES]
+    if unknown:
+        print(f"Unknown category: {', '.join(unknown)}. Options: {CATEGORIES}")
+        return 1
+    midi_dir = os.path.join(BASE_DIR, "mid", "cleaned")
+    midi_keys = {f[:-4] for f in os.listdir(midi_dir) if f.endswith(".mid")} if os.path.isdir(midi_dir) else set()
+    for cat in args.category or CATEGORIES:
+        wav_dir = os.path.join(BASE_DIR, "mp3", cat, "wav")
+        keys = sorted(f[:-4] for f in os.listdir(wav_dir) if f.endswith(".wav")) if os.path.isdir(wav_dir) else []
+        if args.json:
+            print(json.dumps({"category": cat, "keys": [k for k in keys if k in midi_keys]}))
+            continue
+        print(f"{cat}: {len(keys)} recordings, {sum(k in midi_keys for k in keys)} with MIDI")
+        for k in keys:
+            print(f"  {k}" + ("" if k in midi_keys else "  (no MIDI)"))
+
+def cmd_show(args):
+    """Prints stored alignment entries (alignment_store only needs sqlite3)."""
+    store = stage("alignment_store")
+    conn = store.connect()
+    if args.key:
+        entry = store.get(conn, args.kind, args.category, args.key)
+        if entry is None:
+            print(f"No {args.kind} entry for {args.category}/{args.key}")
+            return 1
+        print(json.dumps(entry, indent=2))
+    else:
+        print(json.dumps(store.load(conn, args.kind, args.category), indent=2))
+
+# --- CLI ---
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ai_music", description="ai_music pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("verify", help="check that every MP3 has a matching MIDI (00)")
+    p.set_defaults(func=cmd_verify)
+
+    p = sub.add_parser("convert", help="MP3 -> mono 22050 Hz WAV (02, or 08 for single files)")
+    p.add_argument("mp3", nargs="*", help="convert only these files")
+    p.add_argument("--npy", action="store_true", help="also write float32 .npy copies")
+    p.add_argument("--force", action="store_true")
+    p.add_argument("--workers", type=int)
+    p.set_defaults(func=cmd_convert)
+
+    p = sub.add_parser("analyze", help="waveform peaks + auto-sync (04)")
+    p.add_argument("category", nargs="?")
+    p.add_argument("key", nargs="?")
+    p.add_argument("--force", action="store_true")
+    p.add_argument("--midi-renderer", choices=["synth", "symbolic"], help="how MIDI features are made (feature_cache)")
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser("margins", help="heuristic offset/speed from silence margins (07)")
+    p.add_argument("--force", action="store_true")
+    p.add_argument("--xcorr", action="store_true", help="use confident chroma cross-correlation offsets")
+    p.set_defaults(func=cmd_margins)
+
+    p = sub.add_parser("dtw", help="DTW alignment (010)")
+    p.add_argument("--category", action="append", choices=CATEGORIES)
+    p.add_argument("--multiscale", action="store_true")
+    p.add_argument("--workers", type=int)
+    p.add_argument("--force", action="store_true")
+    p.add_argument("--perf", action="store_true", help="log per-track stage timings")
+    p.add_argument("--midi-renderer", choices=["synth", "symbolic"], help="how MIDI features are made (feature_cache)")
+    p.set_defaults(func=cmd_dtw)
+
+    p = sub.add_parser("sweep", help="rank DTW parameter combinations against manual alignments")
+    p.add_argument("--category", action="append", choices=CATEGORIES)
+    p.add_argument("--grid", help="JSON file overriding keys of dtw_sweep.SWEEP_GRID")
+    p.add_argument("--workers", type=int)
+    p.add_argument("--top", type=int, default=10)
+    p.set_defaults(func=cmd_sweep)
+
+    p = sub.add_parser("bench", help="time / memory / accuracy benchmark on synthetic fixtures")
+    p.add_argument("--fixture", action="append")
+    p.add_argument("--stage", action="append")
+    p.add_argument("--save-baseline", action="store_true")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("follow", help="online score following; streams the WAV faster than real time")
+    p.add_argument("category", choices=CATEGORIES)
+    p.add_argument("key")
+    p.add_argument("--live", action="store_true", help="follow the microphone instead")
+    p.set_defaults(func=cmd_follow)
+
+    p = sub.add_parser("index", help="build the melody index over mid/cleaned")
+    p.add_argument("--midi-dir")
+    p.add_argument("--workers", type=int)
+    p.add_argument("--force", action="store_true", help="re-fingerprint unchanged MIDIs too")
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser("identify", help="which tune is this recording? (needs `index`)")
+    p.add_argument("recording")
+    p.add_argument("--start", type=float, default=0.0)
+    p.add_argument("--duration", type=float)
+    p.add_argument("--top", type=int, default=5)
+    p.set_defaults(func=cmd_identify)
+
+    p = sub.add_parser("search", help="exact subsequence DTW search of recordings over all of mid/cleaned")
+    p.add_argument("recording", nargs="*")
+    p.add_argument("--build", action="store_true", help="(re)pack the reference chroma first")
+    p.add_argument("--start", type=float, default=0.0)
+    p.add_argument("--duration", type=float)
+    p.add_argument("--top", type=int, default=5)
+    p.add_argument("--workers", type=int)
+    p.add_argument("--force", action="store_true")
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser("dataset", help="build the training dataset (011)")
+    p.add_argument("--npz", action="store_true", help="per-track .npz instead of shards")
+    p.add_argument("--workers", type=int)
+    p.add_argument("--force", action="store_true")
+    p.add_argument("--perf", action="store_true", help="log per-track stage timings")
+    p.set_defaults(func=cmd_dataset)
+
+    p = sub.add_parser("perf", help="summarize --perf logs (p50/p95 per stage, slowest tracks)")
+    p.add_argument("log", nargs="*", help="JSONL files (default: all in cache/perf)")
+    p.add_argument("--worst", type=int, default=10)
+    p.set_defaults(func=cmd_perf)
+
+    p = sub.add_parser("inspect", help="plot a random dataset track (012)")
+    p.set_defaults(func=cmd_inspect)
+
+    p = sub.add_parser("freeze", help="move a validation set aside (05); --undo restores it (06)")
+    p.add_argument("--undo", action="store_true")
+    p.set_defaults(func=cmd_freeze)
+
+    p = sub.add_parser("list", help="list recordings per category")
+    p.add_argument("category", nargs="*", help=f"any of {CATEGORIES} (default: all)")
+    p.add_argument("--json", action="store_true", help="one JSON line per category")
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser("show", help="print stored alignments")
+    p.add_argument("kind", choices=["manual", "heuristic", "dtw"])
+    p.add_argument("category", choices=CATEGORIES)
+    p.add_argument("key", nargs="?")
+    p.set_defaults(func=cmd_show)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args) or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
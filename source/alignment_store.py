@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+SETUP_DIR = os.path.join(BASE_DIR, "setup")
+DB_PATH = os.path.join(SETUP_DIR, "alignments.db")
+CATEGORIES = ["first", "one_kor", "one_kor_sgl"]
+
+# Kind -> JSON export file (the format the player and older scripts read) and its indent
+EXPORTS = {
+    "manual": ("alignment_manual_{cat}.json", 2),
+    "heuristic": ("alignment_{cat}.json", 2),
+    "dtw": ("alignment_dtw_{cat}.json", None),
+}
+
+# One row per (kind, category, key). SQLite in WAL mode gives per-key upserts that
+# survive a crash mid-batch, and lets the player and batch scripts read while another
+# process writes. The alignment_*.json files are exports of this store.
+
+def connect(path=DB_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS alignments (
+                        kind TEXT NOT NULL,
+                        category TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        data TEXT NOT NULL,
+                        updated REAL NOT NULL,
+                        UNIQUE (kind, category, key))""")
+    return conn
+
+def export_path(kind, category):
+    filename, _ = EXPORTS[kind]
+    return os.path.join(SETUP_DIR, filename.format(cat=category))
+
+def _ensure_imported(conn, kind, category):
+    """
+    First use of a (kind, category): seed the store from the existing JSON file. Runs
+    before reads and writes, so a first save cannot shadow (and then overwrite) the JSON.
+    """
+    row = conn.execute("SELECT 1 FROM alignments WHERE kind=? AND category=? LIMIT 1",
+                       (kind, category)).fetchone()
+    if row is None:
+        import_json(conn, kind, category)
+
+def import_json(conn, kind, category):
+    path = export_path(kind, category)
+    if not os.path.exists(path): return 0
+    try:
+        with open(path, 'r') as f: data = json.load(f)
+    except ValueError as e:
+        print(f"Skipping unreadable {path}: {e}")
+        return 0
+    _write_many(conn, kind, category, data.items())
+    return len(data)
+
+def upsert(conn, kind, category, key, entry):
+    upsert_many(conn, kind, category, [(key, entry)])
+
+def upsert_many(conn, kind, category, items):
+    _ensure_imported(conn, kind, category)
+    _write_many(conn, kind, category, items)
+
+def _write_many(conn, kind, category, items):
+    now = time.time()
+    with conn:
+        conn.executemany("""INSERT INTO alignments (kind, category, key, data, updated)
+                            VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT (kind, category, key)
+                            DO UPDATE SET data=excluded.data, updated=excluded.updated""",
+                         [(kind, category, key, json.dumps(entry), now) for key, entry in items])
+
+def delete(conn, kind, category, key):
+    _ensure_imported(conn, kind, category)
+    with conn:
+        conn.execute("DELETE FROM alignments WHERE kind=? AND category=? AND key=?",
+                     (kind, category, key))
+
+def get(conn, kind, category, key):
+    _ensure_imported(conn, kind, category)
+    row = conn.execute("SELECT data FROM alignments WHERE kind=? AND category=? AND key=?",
+                       (kind, category, key)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def load(conn, kind, category):
+    """All entries of a category as {key: entry}, in first-insert order."""
+    _ensure_imported(conn, kind, category)
+    rows = conn.execute("SELECT key, data FROM alignments WHERE kind=? AND category=? ORDER BY rowid",
+                        (kind, category))
+    return {key: json.loads(data) for key, data in rows}
+
+def export_json(conn, kind, category, keys=None):
+    """Writes the JSON export atomically. `keys` fixes the order (and subset) of entries."""
+    data = load(conn, kind, category)
+    if keys is not None:
+        data = {k: data[k] for k in keys if k in data}
+    path = export_path(kind, category)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=EXPORTS[kind][1])
+    os.replace(tmp_path, path)
+    return path
+
+if __name__ == "__main__":
+    # python alignment_store.py save manual [category] [key] '{"offset": 1.2, "speed": 1.0}'
+    # python alignment_store.py export          (rewrite every alignment_*.json)
+    # python alignment_store.py import          (re-read every alignment_*.json into the store)
+    conn = connect()
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "save" and len(sys.argv) == 6:
+        kind, category, key, entry = sys.argv[2], sys.argv[3], sys.argv[4], json.loads(sys.argv[5])
+        if kind not in EXPORTS or category not in CATEGORIES:
+            print(f"Unknown kind/category: {kind}/{category}")
+            sys.exit(1)
+        upsert(conn, kind, category, key, entry)
+        export_json(conn, kind, category)
+        print(f"Saved {key} ({len(load(conn, kind, category))} total)")
+    elif cmd in ("export", "import"):
+        for kind in EXPORTS:
+            for category in CATEGORIES:
+                if cmd == "import":
+                    print(f"{kind}/{category}: imported {import_json(conn, kind, category)}")
+                elif load(conn, kind, category):
+                    print(f"{kind}/{category}: {export_json(conn, kind, category)}")
+    else:
+        print("Usage: alignment_store.py save [kind] [category] [key] [json] | export | import")
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import importlib
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+HOST = "127.0.0.1"
+PORT = int(os.environ.get("AI_MUSIC_ANALYSIS_PORT", 8765))
+# Finished jobs kept for GET /jobs/<id>
+KEEP_FINISHED = 200
+
+# Long-running analysis worker. The heavy modules (librosa, pretty_midi, numba kernels)
+# are imported once, so a job only pays for its own work; features come from the
+# on-disk feature_cache. Jobs run one at a time from a queue in a single worker thread.
+#
+#   POST /jobs  {"type": "analyze" | "dtw" | "margins", "category": ..., "key": ..., "wait": true}
+#               -> the finished job (wait) or {"id": ...}
+#   GET  /jobs/<id>  -> {"id", "type", "status": queued|running|done|failed, "result"|"error", "seconds"}
+#   GET  /health
+
+_modules = {}
+
+def stage(name):
+    """Numbered scripts can't be imported by name, so load them once via importlib."""
+    if name not in _modules:
+        _modules[name] = importlib.import_module(name)
+    return _modules[name]
+
+def track_files(category, key):
+    wav_path = os.path.join(BASE_DIR, "mp3", category, "wav", f"{key}.wav")
+    midi_path = os.path.join(BASE_DIR, "mid/cleaned", f"{key}.mid")
+    for p in (wav_path, midi_path):
+        if not os.path.exists(p): raise FileNotFoundError(p)
+    return wav_path, midi_path
+
+def run_analyze(category, key):
+    if not stage("04_analyze_data").analyze_track(category, key):
+        raise RuntimeError(f"analyze_track failed for {category}/{key}")
+    return {"analysis": stage("04_analyze_data").track_paths(category, key)[2]}
+
+def run_dtw(category, key):
+    m010 = stage("010_generate_dtw_alignment")
+    store = stage("alignment_store")
+    build_manifest = stage("build_manifest")
+    wav_path, midi_path = track_files(category, key)
+    conn = store.connect()
+    manual_entry = store.get(conn, "manual", category, key)
+    manifest = build_manifest.Manifest(f"dtw_{category}", m010.dtw_params(m010.DTW_MODE))
+    fingerprint = m010.track_fingerprint(manifest, wav_path, midi_path, manual_entry)
+    _, entry, error_line = m010.align_track(key, wav_path, midi_path, manual_entry, m010.DTW_MODE)
+    if entry is None:
+        raise RuntimeError(f"DTW failed for {category}/{key}")
+    store.upsert(conn, "dtw", category, key, entry)
+    # Same keys and order as a batch run of 010 would export
+    store.export_json(conn, "dtw", category, keys=m010.export_keys(category, conn))
+    # So the next batch run does not redo this track
+    manifest.record(key, fingerprint)
+    manifest.save()
+    return {"error": entry["error"], "warning": error_line}
+
+def run_margins(category, key):
+    m07 = stage("07_measure_margins")
+    store = stage("alignment_store")
+    build_manifest = stage("build_manifest")
+    wav_path, midi_path = track_files(category, key)
+    conn = store.connect()
+    manifest = build_manifest.Manifest(f"margins_{category}", m07.margin_params())
+    fingerprint = m07.track_fingerprint(manifest, category, wav_path, midi_path)
+    entry = m07.measure_track(category, wav_path, midi_path)
+    entry["is_frozen"] = key in m07.load_frozen_map().get(category, [])
+    store.upsert(conn, "heuristic", category, key, entry)
+    store.export_json(conn, "heuristic", category)
+    manifest.record(key, fingerprint)
+    manifest.save()
+    m07.save_max_power_index()
+    return entry
+
+JOBS = {"analyze": run_analyze, "dtw": run_dtw, "margins": run_margins}
+
+class JobQueue:
+    def __init__(self):
+        self.pending = queue.Queue()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.next_id = 1
+        threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, job_type, category, key):
+        if job_type not in JOBS:
+            raise ValueError(f"Unknown job type '{job_type}'. Options: {list(JOBS)}")
+        with self.lock:
+            job = {"id": self.next_id, "type": job_type, "category": category, "key": key,
+                   "status": "queued", "done": threading.Event()}
+            self.jobs[job["id"]] = job
+            self.next_id += 1
+        self.pending.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            job = self.pending.get()
+            job["status"] = "running"
+            start = time.time()
+            try:
+                job["result"] = JOBS[job["type"]](job["category"], job["key"])
+                job["status"] = "done"
+            except Exception as e:
+                job["error"] = f"{type(e).__name__}: {e}"
+                job["status"] = "failed"
+            job["seconds"] = round(time.time() - start, 3)
+            print(f"[{job['status']}] {job['type']} {job['category']}/{job['key']} ({job['seconds']}s)")
+            job["done"].set()
+            self._forget_old()
+
+    def _forget_old(self):
+        with self.lock:
+            finished = [i for i, j in self.jobs.items() if j["done"].is_set()]
+            for i in finished[:-KEEP_FINISHED]:
+                del self.jobs[i]
+
+def job_view(job):
+    return {k: v for k, v in job.items() if k != "done"}
+
+class Handler(BaseHTTPRequestHandler):
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self._reply(200, {"ok": True, "queued": self.server.jobs.pending.qsize()})
+        if self.path.startswith("/jobs/"):
+            job_id = self.path[len("/jobs/"):]
+            job = self.server.jobs.get(int(job_id)) if job_id.isdigit() else None
+            if job: return self._reply(200, job_view(job))
+        self._reply(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            return self._reply(404, {"error": "Not found"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            job = self.server.jobs.submit(body.get("type"), body["category"], body["key"])
+        except (ValueError, KeyError) as e:
+            return self._reply(400, {"error": str(e)})
+        if body.get("wait", True):
+            job["done"].wait()
+            return self._reply(200 if job["status"] == "done" else 500, job_view(job))
+        self._reply(202, {"id": job["id"]})
+
+    def log_message(self, fmt, *args):
+        pass
+
+def serve(host=HOST, port=PORT):
+    # Warm up: import the stages (and with them librosa, pretty_midi, numba) before accepting jobs
+    start = time.time()
+    for name in ("04_analyze_data", "07_measure_margins", "010_generate_dtw_alignment", "alignment_store"):
+        stage(name)
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.jobs = JobQueue()
+    print(f"Analysis server ready on http://{host}:{port} (warm-up {time.time() - start:.1f}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def submit(job_type, category, key, wait=True, host=HOST, port=PORT, timeout=600):
+    """Client side, for batch scripts: runs a job on the server. Raises URLError if it is not running."""
+    req = urllib.request.Request(f"http://{host}:{port}/jobs", method="POST",
+                                 data=json.dumps({"type": job_type, "category": category,
+                                                  "key": key, "wait": wait}).encode(),
+                                 headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return json.load(r)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+if __name__ == "__main__":
+    # python analysis_server.py                      -> serve
+    # python analysis_server.py [type] [category] [key]  -> submit one job and print the result
+    if len(sys.argv) == 4:
+        print(json.dumps(submit(*sys.argv[1:]), indent=2))
+    else:
+        serve()
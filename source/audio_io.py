@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import soundfile as sf
+import librosa
+
+# --- CONFIG ---
+# Canonical analysis format written by 02_convert_to_wav: mono, 22050 Hz, 16-bit PCM WAV,
+# optionally with a float32 .npy copy next to it that loads as a memory map.
+ANALYSIS_SR = 22050
+
+def npy_path(wav_path):
+    return os.path.splitext(wav_path)[0] + ".npy"
+
+def is_canonical(wav_path, sr=ANALYSIS_SR):
+    try:
+        info = sf.info(wav_path)
+    except RuntimeError:
+        return False
+    return info.samplerate == sr and info.channels == 1
+
+def load(path, sr=ANALYSIS_SR):
+    """
+    Drop-in for librosa.load(path, sr=sr) -> (y, sr).
+    Canonical files are read without downmixing or resampling: the .npy copy (mmap)
+    if it is up to date and at the requested rate, else the WAV itself. Anything else
+    goes through librosa.
+    """
+    npy = npy_path(path)
+    if sr in (None, ANALYSIS_SR) and os.path.exists(npy) and os.path.getmtime(npy) >= os.path.getmtime(path):
+        # The .npy is always written at ANALYSIS_SR
+        return np.load(npy, mmap_mode='r'), ANALYSIS_SR
+    if is_canonical(path, sr):
+        y, _ = sf.read(path, dtype='float32')
+        return y, sr
+    return librosa.load(path, sr=sr)
+
+def decode_mp3(mp3_path, sr=ANALYSIS_SR):
+    """Decodes once and returns mono float32 at `sr` (same downmix + soxr resampling as librosa.load)."""
+    from pydub import AudioSegment
+    sound = AudioSegment.from_mp3(mp3_path)
+    samples = np.array(sound.get_array_of_samples(), dtype=np.float32).reshape(-1, sound.channels)
+    y = samples.mean(axis=1) / float(1 << (8 * sound.sample_width - 1))
+    if sound.frame_rate != sr:
+        y = librosa.resample(y, orig_sr=sound.frame_rate, target_sr=sr, res_type='soxr_hq')
+    return y.astype(np.float32)
+
+def ingest_mp3(mp3_path, wav_path, sr=ANALYSIS_SR, write_npy=False):
+    """MP3 -> canonical WAV (+ optional .npy). Returns the duration in seconds."""
+    y = decode_mp3(mp3_path, sr)
+    tmp_path = f"{wav_path}.{os.getpid()}.tmp"
+    sf.write(tmp_path, y, sr, subtype='PCM_16', format='WAV')
+    os.replace(tmp_path, wav_path)
+
+    npy = npy_path(wav_path)
+    if write_npy:
+        # Exactly what reading the WAV back gives, so both paths load the same samples
+        y, _ = sf.read(wav_path, dtype='float32')
+        tmp_path = f"{npy}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, y)
+        os.replace(tmp_path, npy)
+    elif os.path.exists(npy):
+        os.remove(npy)
+    return len(y) / sr
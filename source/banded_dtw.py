@@ -0,0 +1,185 @@
+import numpy as np
+from numba import njit
+
+# Banded DTW: same recursion, tie-breaking and warping path as
+# librosa.sequence.dtw(..., global_constraints=True, band_rad=...),
+# but only the Sakoe-Chiba band is allocated and the local cost is computed
+# inside the kernel, so memory is O(N * band) instead of O(N * M).
+
+METRICS = {'euclidean': 0, 'sqeuclidean': 1, 'seuclidean': 2, 'cosine': 3, 'cityblock': 4}
+DEFAULT_STEPS = np.array([[1, 1], [0, 1], [1, 0]])
+
+def band_bounds(n, m, band_rad):
+    """
+    Per-row column range [lo, hi) of the band, identical to librosa's fill_off_diagonal.
+    band_rad is a fraction of min(n, m); None means no band (full matrix).
+    """
+    if band_rad is None:
+        return np.zeros(n, dtype=np.int64), np.full(n, m, dtype=np.int64)
+
+    radius = int(np.round(band_rad * min(n, m)))
+    offset = abs(n - m)
+    rows = np.arange(n, dtype=np.int64)
+    if n < m:
+        lo, hi = rows - radius + 1, rows + radius + offset
+    else:
+        lo, hi = rows - radius - offset + 1, rows + radius
+    return np.clip(lo, 0, m), np.clip(hi, 0, m)
+
+@njit(cache=True)
+def _local_cost(x, y, metric, var, x_norm, y_norm):
+    acc = 0.0
+    if metric == 3:
+        for k in range(x.shape[0]):
+            acc += x[k] * y[k]
+        return 1.0 - acc / (x_norm * y_norm)
+    for k in range(x.shape[0]):
+        d = x[k] - y[k]
+        if metric == 4:
+            acc += abs(d)
+        elif metric == 2:
+            acc += d * d / var[k]
+        else:
+            acc += d * d
+    if metric == 1 or metric == 4:
+        return acc
+    return np.sqrt(acc)
+
+@njit(cache=True)
+def _accumulate(X, Y, lo, hi, width, steps, metric, var, x_norm, y_norm, subseq):
+    n = X.shape[0]
+    D = np.full((n, width), np.inf)
+    step_idx = np.zeros((n, width), dtype=np.int8)
+
+    for i in range(n):
+        for j in range(lo[i], hi[i]):
+            c = _local_cost(X[i], Y[j], metric, var, x_norm[i], y_norm[j])
+            if np.isnan(c):
+                return D, step_idx, False
+            jj = j - lo[i]
+            if i == 0 and (subseq or j == 0):
+                D[i, jj] = c
+                continue
+            best = np.inf
+            for s in range(steps.shape[0]):
+                pi = i - steps[s, 0]
+                pj = j - steps[s, 1]
+                if pi < 0 or pj < 0 or pj < lo[pi] or pj >= hi[pi]:
+                    continue
+                cost = D[pi, pj - lo[pi]] + c
+                if cost < best:
+                    best = cost
+                    step_idx[i, jj] = s
+            D[i, jj] = best
+    return D, step_idx, True
+
+@njit(cache=True)
+def _backtrack(step_idx, lo, steps, end_j, subseq):
+    i = step_idx.shape[0] - 1
+    j = end_j
+    path = [(i, j)]
+    while (subseq and i > 0) or (not subseq and (i != 0 or j != 0)):
+        s = step_idx[i, j - lo[i]]
+        i -= steps[s, 0]
+        j -= steps[s, 1]
+        if i < 0 or j < 0:
+            break
+        path.append((i, j))
+    return path
+
+def dtw(X, Y, metric='euclidean', step_sizes_sigma=None, band_rad=0.25, subseq=False, bounds=None):
+    """
+    Drop-in for librosa.sequence.dtw(X=X, Y=Y, metric=..., step_sizes_sigma=...,
+    global_constraints=True, band_rad=...). X is (K, N), Y is (K, M).
+    With subseq=True, X may start and end anywhere in Y (Y must be the longer one).
+    bounds=(lo, hi) replaces the Sakoe-Chiba band by an arbitrary per-row corridor.
+    Returns (total_cost, wp) where wp runs from the end to the start like librosa's.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unsupported metric '{metric}'. Options: {list(METRICS)}")
+
+    X = np.ascontiguousarray(np.atleast_2d(X).T, dtype=np.float64)
+    Y = np.ascontiguousarray(np.atleast_2d(Y).T, dtype=np.float64)
+    n, m = X.shape[0], Y.shape[0]
+    steps = DEFAULT_STEPS if step_sizes_sigma is None else np.asarray(step_sizes_sigma)
+    steps = np.ascontiguousarray(steps, dtype=np.int64)
+    if np.any(steps < 0):
+        raise ValueError("step_sizes_sigma cannot contain negative values")
+
+    # Same per-dimension variance scipy's cdist uses for 'seuclidean'
+    var = np.ones(X.shape[1])
+    if metric == 'seuclidean':
+        var = np.var(np.vstack((X, Y)), axis=0, ddof=1)
+    x_norm = np.linalg.norm(X, axis=1)
+    y_norm = np.linalg.norm(Y, axis=1)
+
+    if bounds is None:
+        lo, hi = band_bounds(n, m, band_rad)
+    else:
+        lo, hi = (np.ascontiguousarray(b, dtype=np.int64) for b in bounds)
+    width = max(1, int(np.max(hi - lo)))
+    D, step_idx, ok = _accumulate(X, Y, lo, hi, width, steps, METRICS[metric],
+                                  var, x_norm, y_norm, subseq)
+    if not ok:
+        raise ValueError("DTW cost matrix has NaN values (e.g. silent frames with metric='cosine').")
+
+    if subseq:
+        last = D[n - 1, :hi[n - 1] - lo[n - 1]]
+        if last.size == 0 or np.all(np.isinf(last)):
+            raise ValueError("No valid sub-sequence warping path inside the band.")
+        end_j = lo[n - 1] + int(np.argmin(last))
+    else:
+        end_j = m - 1
+        if not (lo[n - 1] <= end_j < hi[n - 1]) or np.isinf(D[n - 1, end_j - lo[n - 1]]):
+            raise ValueError("No valid warping path inside the band. Try a larger band_rad.")
+
+    total_cost = float(D[n - 1, end_j - lo[n - 1]])
+    wp = np.asarray(_backtrack(step_idx, lo, steps, end_j, subseq), dtype=int)
+    if not subseq and tuple(wp[-1]) != (0, 0):
+        raise ValueError("Unable to compute a full DTW warping path inside the band.")
+    return total_cost, wp
+
+# --- MULTISCALE ---
+
+def corridor_bounds(wp, factor, n, m, radius):
+    """
+    Projects a coarse warping path onto a grid `factor` times finer and widens it
+    by `radius` fine frames. Returns per-row bounds (lo, hi) for dtw(bounds=...).
+    """
+    lo = np.full(n, m, dtype=np.int64)
+    hi = np.zeros(n, dtype=np.int64)
+    half = factor // 2
+    i, j = wp[:, 0] * factor, wp[:, 1] * factor
+    for d in range(-half, half + 1):
+        rows = i + d
+        ok = (rows >= 0) & (rows < n)
+        np.minimum.at(lo, rows[ok], j[ok] - half - radius)
+        np.maximum.at(hi, rows[ok], j[ok] + half + 1 + radius)
+
+    # Rows not hit by the projection (the tail, when n is not a multiple of factor)
+    # inherit the previous row, and the corridor is made monotone so it always
+    # contains a connected path from (0, 0) to (n-1, m-1)
+    hit = hi > 0
+    fill = np.maximum.accumulate(np.where(hit, np.arange(n), 0))
+    lo, hi = lo[fill], hi[fill]
+    lo = np.minimum.accumulate(lo[::-1])[::-1]
+    hi = np.maximum.accumulate(hi)
+    lo[0], hi[-1] = 0, m
+    return np.clip(lo, 0, m), np.clip(hi, 1, m)
+
+def multiscale_dtw(levels, hops, metric='euclidean', step_sizes_sigma=None, band_rad=0.25,
+                   subseq=False, radius=8):
+    """
+    Coarse-to-fine DTW. levels = [(X, Y), ...] are the features at each hop in `hops`
+    (coarse first, each hop a multiple of the next). The coarsest level runs banded DTW,
+    every finer level only fills a corridor of `radius` frames around the projected path.
+    Returns (total_cost, wp) of the finest level.
+    """
+    X, Y = levels[0]
+    cost, wp = dtw(X, Y, metric=metric, step_sizes_sigma=step_sizes_sigma,
+                   band_rad=band_rad, subseq=subseq)
+    for (X, Y), coarse_hop, hop in zip(levels[1:], hops[:-1], hops[1:]):
+        bounds = corridor_bounds(wp, coarse_hop // hop, X.shape[1], Y.shape[1], radius)
+        cost, wp = dtw(X, Y, metric=metric, step_sizes_sigma=step_sizes_sigma,
+                       subseq=subseq, bounds=bounds)
+    return cost, wp
@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+BENCH_DIR = os.path.join(BASE_DIR, "bench")
+SR = 22050
+HOP_LENGTH = 512
+# Fixtures: name -> (MIDI length in seconds, notes per chord)
+FIXTURES = {
+    "short_mono": (30, 1),
+    "long_poly": (180, 3),
+}
+# Piecewise tempo warp of the rendered "recording": a new speed every WARP_SEGMENT_SEC
+WARP_SEGMENT_SEC = 10.0
+WARP_SPEED_RANGE = (0.85, 1.15)
+WARP_OFFSET_SEC = 1.5
+# A stage regresses when it is this much slower / bigger / less accurate than the baseline
+REGRESSION_TIME_RATIO = 1.25
+REGRESSION_RSS_RATIO = 1.25
+REGRESSION_ERROR_SEC = 0.05
+
+# Offline benchmark of the pipeline stages on synthetic MIDI with a known warp.
+# Each stage runs in a fresh (spawned) process, so its peak RSS is its own and no
+# module, numba or feature cache is warm. Results go to BENCH_DIR/results_<fixture>.json;
+# --save-baseline stores them as baseline_<fixture>.json for later comparison.
+
+# --- FIXTURES ---
+
+def make_midi(duration, polyphony, seed=0):
+    import pretty_midi
+    rng = np.random.default_rng(seed)
+    pm = pretty_midi.PrettyMIDI(initial_tempo=120)
+    inst = pretty_midi.Instrument(program=0)
+    chord_shape = [0, 4, 7, 12, 16, 19][:polyphony]
+    t = 0.5
+    while t < duration:
+        length = float(rng.choice([0.25, 0.5, 0.75, 1.0]))
+        root = int(rng.integers(55, 72))
+        for step in chord_shape:
+            inst.notes.append(pretty_midi.Note(velocity=90, pitch=root + step, start=t, end=t + length * 0.9))
+        t += length
+    pm.instruments.append(inst)
+    return pm
+
+def make_warp(duration, seed=0):
+    """Knots (midi_sec, audio_sec) of a piecewise linear warp; audio = np.interp(midi, *knots)."""
+    rng = np.random.default_rng(seed + 1)
+    midi_t = np.arange(0.0, duration + 2 * WARP_SEGMENT_SEC, WARP_SEGMENT_SEC)
+    speeds = rng.uniform(*WARP_SPEED_RANGE, size=len(midi_t) - 1)
+    audio_t = WARP_OFFSET_SEC + np.concatenate(([0.0], np.cumsum(np.diff(midi_t) * speeds)))
+    return midi_t, audio_t
+
+def build_fixture(name, duration, polyphony, seed=0):
+    """Writes <BENCH_DIR>/fixtures/<name>/{score.mid, recording.wav, warp.json} (once)."""
+    import pretty_midi
+    import soundfile as sf
+    out_dir = os.path.join(BENCH_DIR, "fixtures", name)
+    done_flag = os.path.join(out_dir, "warp.json")
+    if os.path.exists(done_flag):
+        return out_dir
+    os.makedirs(out_dir, exist_ok=True)
+
+    pm = make_midi(duration, polyphony, seed)
+    pm.write(os.path.join(out_dir, "score.mid"))
+    midi_t, audio_t = make_warp(duration, seed)
+
+    # The "recording": the same notes moved through the warp, synthesized, plus a little noise
+    warped = pretty_midi.PrettyMIDI(initial_tempo=120)
+    inst = pretty_midi.Instrument(program=0)
+    for n in pm.instruments[0].notes:
+        inst.notes.append(pretty_midi.Note(velocity=n.velocity, pitch=n.pitch,
+                                           start=float(np.interp(n.start, midi_t, audio_t)),
+                                           end=float(np.interp(n.end, midi_t, audio_t))))
+    warped.instruments.append(inst)
+    y = warped.synthesize(fs=SR)
+    y = y / (np.max(np.abs(y)) + 1e-9) * 0.8
+    y += np.random.default_rng(seed + 2).normal(0, 0.003, len(y))
+    sf.write(os.path.join(out_dir, "recording.wav"), y.astype(np.float32), SR, subtype='PCM_16')
+
+    with open(done_flag, 'w') as f:
+        json.dump({"duration": duration, "polyphony": polyphony, "seed": seed,
+                   "midi_t": midi_t.tolist(), "audio_t": audio_t.tolist()}, f)
+    return out_dir
+
+def warp_error(fixture_dir, midi_sec, audio_sec):
+    """Mean |audio - true audio time| (s) of an alignment given as midi -> audio seconds."""
+    with open(os.path.join(fixture_dir, "warp.json"), 'r') as f: warp = json.load(f)
+    truth = np.interp(midi_sec, warp["midi_t"], warp["audio_t"])
+    return float(np.mean(np.abs(np.asarray(audio_sec) - truth)))
+
+# --- STAGES ---
+# Each stage: fn(fixture_dir, tmp_dir, inputs) -> dict of extra metrics. The inputs come from
+# _setup, which runs before the clock and the memory baseline start.
+
+def _chroma(fixture_dir):
+    import librosa
+    import pretty_midi
+    y, _ = librosa.load(os.path.join(fixture_dir, "recording.wav"), sr=SR)
+    y_midi = pretty_midi.PrettyMIDI(os.path.join(fixture_dir, "score.mid")).synthesize(fs=SR)
+    return (librosa.feature.chroma_cqt(y=y_midi, sr=SR, hop_length=HOP_LENGTH),
+            librosa.feature.chroma_cqt(y=y, sr=SR, hop_length=HOP_LENGTH))
+
+def _path_error(fixture_dir, wp):
+    wp = wp[::-1] * (HOP_LENGTH / SR)
+    return warp_error(fixture_dir, wp[:, 0], wp[:, 1])
+
+def stage_synthesize(fixture_dir, tmp_dir, pm):
+    pm.synthesize(fs=SR)
+    return {}
+
+def stage_synthesize_fast(fixture_dir, tmp_dir, pm):
+    """midi_synth, the drop-in for pm.synthesize (kernel compiled in _setup)."""
+    import midi_synth
+    midi_synth.synthesize(pm, SR)
+    return {}
+
+def stage_chroma_cqt(fixture_dir, tmp_dir, y):
+    import librosa
+    librosa.feature.chroma_cqt(y=y, sr=SR, hop_length=HOP_LENGTH)
+    return {}
+
+def stage_render_symbolic(fixture_dir, tmp_dir, pm):
+    """The replacement for synthesize + chroma_cqt of the MIDI side."""
+    import midi_features
+    midi_features.render_chroma(pm, SR, HOP_LENGTH)
+    return {}
+
+def stage_dtw_librosa(fixture_dir, tmp_dir, chroma):
+    import librosa
+    m010 = importlib.import_module("010_generate_dtw_alignment")
+    _, wp = librosa.sequence.dtw(X=chroma[0], Y=chroma[1], metric=m010.DTW_METRIC,
+                                 step_sizes_sigma=m010.DTW_STEP_SIZES, global_constraints=True,
+                                 band_rad=m010.DTW_BAND_WIDTH)
+    return {"error_sec": _path_error(fixture_dir, wp)}
+
+def stage_dtw_banded(fixture_dir, tmp_dir, chroma):
+    import banded_dtw
+    m010 = importlib.import_module("010_generate_dtw_alignment")
+    _, wp = banded_dtw.dtw(chroma[0], chroma[1], metric=m010.DTW_METRIC,
+                           step_sizes_sigma=m010.DTW_STEP_SIZES, band_rad=m010.DTW_BAND_WIDTH)
+    return {"error_sec": _path_error(fixture_dir, wp)}
+
+def stage_align_track(fixture_dir, tmp_dir, m010):
+    """The whole 010 track job (synthesis, CQT at its hop, DTW, point export) with a cold cache."""
+    _, entry, _ = m010.align_track("bench", os.path.join(fixture_dir, "recording.wav"),
+                                   os.path.join(fixture_dir, "score.mid"), None, m010.DTW_MODE)
+    points = np.asarray(entry["points"])
+    return {"error_sec": warp_error(fixture_dir, points[:, 0], points[:, 1])}
+
+def stage_align_symbolic(fixture_dir, tmp_dir, m010):
+    """align_track with MIDI features rendered from the notes (feature_cache 'symbolic')."""
+    return stage_align_track(fixture_dir, tmp_dir, m010)
+
+def stage_midi_roll(fixture_dir, tmp_dir, args):
+    m011, points, frames = args
+    m011.get_aligned_midi_roll(os.path.join(fixture_dir, "score.mid"), frames,
+                               {"mode": "dtw", "points": points})
+    return {}
+
+def stage_json_export(fixture_dir, tmp_dir, args):
+    store, entry = args
+    conn = store.connect(os.path.join(tmp_dir, "alignments.db"))
+    store.upsert_many(conn, "dtw", "first", ((f"track{i:04d}", entry) for i in range(500)))
+    store.export_json(conn, "dtw", "first")
+    return {"bytes": os.path.getsize(store.export_path("dtw", "first"))}
+
+def _setup(stage, fixture_dir, tmp_dir):
+    import feature_cache
+    # Cold, private feature cache: the benchmark must not read or fill the real one
+    feature_cache.CACHE_DIR = os.path.join(tmp_dir, "features")
+    if stage in ("synthesize", "synthesize_fast", "render_symbolic"):
+        import pretty_midi
+        pm = pretty_midi.PrettyMIDI(os.path.join(fixture_dir, "score.mid"))
+        if stage == "synthesize_fast":
+            import midi_synth
+            midi_synth.synthesize(pm, SR)
+        return pm
+    if stage == "chroma_cqt":
+        import librosa
+        return librosa.load(os.path.join(fixture_dir, "recording.wav"), sr=SR)[0]
+    if stage in ("dtw_librosa", "dtw_banded"):
+        return _chroma(fixture_dir)
+    if stage in ("align_track", "align_symbolic"):
+        os.environ["AI_MUSIC_MIDI_RENDERER"] = "symbolic" if stage == "align_symbolic" else "synth"
+        return importlib.import_module("010_generate_dtw_alignment")
+    if stage == "midi_roll":
+        import soundfile as sf
+        with open(os.path.join(fixture_dir, "warp.json"), 'r') as f: warp = json.load(f)
+        lookup = np.arange(0, warp["duration"] + 1, 0.25)
+        points = np.column_stack((lookup, np.interp(lookup, warp["midi_t"], warp["audio_t"]))).round(3).tolist()
+        frames = int(sf.info(os.path.join(fixture_dir, "recording.wav")).frames // HOP_LENGTH) + 1
+        return importlib.import_module("011_prepare_dataset"), points, frames
+    if stage == "json_export":
+        import alignment_store
+        alignment_store.SETUP_DIR = tmp_dir
+        lookup = np.arange(0, 180, 0.25)
+        return alignment_store, {"points": np.column_stack((lookup, lookup + 1)).round(3).tolist(), "error": 0.0}
+
+STAGES = {
+    "synthesize": stage_synthesize,
+    "synthesize_fast": stage_synthesize_fast,
+    "chroma_cqt": stage_chroma_cqt,
+    "render_symbolic": stage_render_symbolic,
+    "dtw_librosa": stage_dtw_librosa,
+    "dtw_banded": stage_dtw_banded,
+    "align_track": stage_align_track,
+    "align_symbolic": stage_align_symbolic,
+    "midi_roll": stage_midi_roll,
+    "json_export": stage_json_export,
+}
+
+def _rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_stage(stage, fixture_dir):
+    """Runs in a fresh process. Returns the metrics of one stage."""
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    if source_dir not in sys.path: sys.path.insert(0, source_dir)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        inputs = _setup(stage, fixture_dir, tmp_dir)
+        base_rss = _rss_mb()
+        start = time.perf_counter()
+        extra = STAGES[stage](fixture_dir, tmp_dir, inputs)
+        seconds = time.perf_counter() - start
+    peak = _rss_mb()
+    return dict(extra, seconds=round(seconds, 3), peak_rss_mb=round(peak, 1),
+                stage_rss_mb=round(peak - base_rss, 1))
+
+# --- RUN / COMPARE ---
+
+def compare(results, baseline, stages=None):
+    """
+    Lines describing regressions of `results` vs `baseline` (empty if none). A stage that
+    worked in the baseline but fails now, or is missing from `results` (of the `stages`
+    asked for, default all), counts as a regression.
+    """
+    problems = []
+    for stage, old in baseline["stages"].items():
+        if stage not in results["stages"] and (stages is None or stage in stages):
+            problems.append(f"{stage}: missing from this run")
+    for stage, now in results["stages"].items():
+        old = baseline["stages"].get(stage)
+        if old and "error" in now and "error" not in old:
+            problems.append(f"{stage}: now fails ({now['error']})")
+        if not old or "error" in now or "error" in old: continue
+        if now["seconds"] > old["seconds"] * REGRESSION_TIME_RATIO and now["seconds"] - old["seconds"] > 0.05:
+            problems.append(f"{stage}: {old['seconds']}s -> {now['seconds']}s")
+        if now["peak_rss_mb"] > old["peak_rss_mb"] * REGRESSION_RSS_RATIO:
+            problems.append(f"{stage}: peak RSS {old['peak_rss_mb']} -> {now['peak_rss_mb']} MB")
+        if "error_sec" in now and now["error_sec"] > old.get("error_sec", np.inf) + REGRESSION_ERROR_SEC:
+            problems.append(f"{stage}: alignment error {old['error_sec']:.3f} -> {now['error_sec']:.3f}s")
+    return problems
+
+def run_fixture(name, stages=None, save_baseline=False):
+    duration, polyphony = FIXTURES[name]
+    fixture_dir = build_fixture(name, duration, polyphony)
+    print(f"\n--- {name}: {duration}s, polyphony {polyphony} ---")
+    print(f"{'stage':<16} {'seconds':>8} {'peak MB':>8} {'stage MB':>8} {'error s':>8}")
+
+    results = {"fixture": name, "duration": duration, "polyphony": polyphony,
+               "created": time.strftime("%Y-%m-%d %H:%M:%S"), "stages": {}}
+    ctx = multiprocessing.get_context("spawn")
+    for stage in stages or STAGES:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            try:
+                r = pool.submit(run_stage, stage, fixture_dir).result()
+            except Exception as e:
+                r = {"error": f"{type(e).__name__}: {e}"}
+        results["stages"][stage] = r
+        if "error" in r:
+            print(f"{stage:<16} failed: {r['error']}")
+            continue
+        err = f"{r['error_sec']:.3f}" if "error_sec" in r else "-"
+        print(f"{stage:<16} {r['seconds']:>8.3f} {r['peak_rss_mb']:>8.1f} {r['stage_rss_mb']:>8.1f} {err:>8}")
+
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    with open(os.path.join(BENCH_DIR, f"results_{name}.json"), 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline_path = os.path.join(BENCH_DIR, f"baseline_{name}.json")
+    if save_baseline:
+        with open(baseline_path, 'w') as f: json.dump(results, f, indent=2)
+        print(f"Saved baseline {baseline_path}")
+    elif os.path.exists(baseline_path):
+        with open(baseline_path, 'r') as f: baseline = json.load(f)
+        problems = compare(results, baseline, stages)
+        print(f"vs. baseline of {baseline['created']}: " + ("; ".join(problems) if problems else "no regressions"))
+        return problems
+    return []
+
+if __name__ == "__main__":
+    # python benchmark.py [--fixture name] [--stage name ...] [--save-baseline]
+    args = sys.argv[1:]
+    names = [args[i + 1] for i, a in enumerate(args) if a == "--fixture"] or list(FIXTURES)
+    stages = [args[i + 1] for i, a in enumerate(args) if a == "--stage"] or None
+    regressions = []
+    for name in names:
+        regressions += run_fixture(name, stages, save_baseline="--save-baseline" in args)
+    sys.exit(1 if regressions else 0)
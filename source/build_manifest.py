@@ -0,0 +1,92 @@
+import os
+import json
+import hashlib
+from feature_cache import file_hash
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+MANIFEST_DIR = os.path.join(BASE_DIR, "cache", "manifest")
+HASH_INDEX_PATH = os.path.join(MANIFEST_DIR, "file_hashes.json")
+
+# Build manifests: for every output of a stage, the fingerprint of the inputs it was
+# built from (file content hashes, alignment entries, stage parameters).
+# A stage only recomputes outputs whose fingerprint changed.
+
+_hash_index = None
+
+def content_hash(path):
+    """
+    Content hash of a file. Hashes are remembered per (path, size, mtime) across runs,
+    so unchanged files are never re-read.
+    """
+    global _hash_index
+    if _hash_index is None:
+        _hash_index = {}
+        if os.path.exists(HASH_INDEX_PATH):
+            try:
+                with open(HASH_INDEX_PATH, 'r') as f: _hash_index = json.load(f)
+            except ValueError:
+                pass
+
+    st = os.stat(path)
+    abs_path = os.path.abspath(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    known = _hash_index.get(abs_path)
+    if known and known[:2] == stamp:
+        return known[2]
+    digest = file_hash(path)
+    _hash_index[abs_path] = stamp + [digest]
+    return digest
+
+def save_hash_index():
+    if _hash_index is None: return
+    write_json(HASH_INDEX_PATH, _hash_index)
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _jsonable(o):
+    return o.tolist() if hasattr(o, 'tolist') else str(o)
+
+class Manifest:
+    """Input fingerprints of one stage's outputs, e.g. Manifest("dtw_one_kor", params)."""
+
+    def __init__(self, stage, params=None, force=False):
+        self.path = os.path.join(MANIFEST_DIR, f"{stage}.json")
+        self.params = params or {}
+        self.force = force
+        self.records = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f: self.records = json.load(f)
+            except ValueError:
+                print(f"Warning: unreadable manifest {self.path}, rebuilding.")
+
+    def fingerprint(self, files=(), **inputs):
+        """Fingerprint of input files (by content), other inputs and the stage params."""
+        payload = {
+            "files": [content_hash(p) if p and os.path.exists(p) else None for p in files],
+            "inputs": inputs,
+            "params": self.params,
+        }
+        blob = json.dumps(payload, sort_keys=True, default=_jsonable)
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+    def is_fresh(self, output_key, fingerprint, output_path=None):
+        if self.force: return False
+        if output_path is not None and not os.path.exists(output_path): return False
+        return self.records.get(output_key) == fingerprint
+
+    def record(self, output_key, fingerprint):
+        self.records[output_key] = fingerprint
+
+    def forget(self, output_key):
+        self.records.pop(output_key, None)
+
+    def save(self):
+        write_json(self.path, self.records)
+        save_hash_index()
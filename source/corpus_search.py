@@ -0,0 +1,251 @@
+import os
+import sys
+import time
+import heapq
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from numba import njit
+import librosa
+import pretty_midi
+import melody_index
+import audio_io
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+MIDI_DIR = os.path.join(BASE_DIR, "mid", "cleaned")
+CORPUS_DIR = os.path.join(BASE_DIR, "cache", "search_corpus")
+SR = 22050
+HOP_LENGTH = melody_index.RERANK_HOP
+WORKERS = os.cpu_count() or 1
+# Frames per block of the block envelopes (stage 2)
+BLOCK = 16
+TOP_K = 5
+# Same floor as melody_index.subsequence_cost: keeps the cosine of silent frames defined
+FLOOR = 1e-6
+
+# Exhaustive, exact subsequence DTW search (cosine cost, steps (1,1), (1,0), (0,1),
+# same recursion and cost as banded_dtw.dtw(subseq=True)) of a query recording against every
+# tune in mid/cleaned, top-k by cost. Every warping path visits each query frame at
+# least once and local costs are >= 0, so sum_i min_j cost(q_i, r_j) is a lower bound
+# of the DTW cost. Cheaper relaxations of that bound drop tunes before any DTW runs:
+#   1. envelope:   max_j q.r_j <= q.U with U the per-bin max of the whole tune (all tunes in one matmul)
+#   2. blocks:     the same with one envelope per BLOCK frames
+#   3. row minima: the exact per-frame minimum (one matmul per tune)
+#   4. DTW:        abandoned as soon as the best row so far plus the row minima still
+#                  to come can't beat the current k-th best
+# Tunes are visited in order of their envelope bound, so the k-th best drops quickly.
+# References are piano-roll chroma (melody_index.midi_roll_chroma), unit length, packed
+# into one memory-mapped float32 array under CORPUS_DIR. Dot products run in float32,
+# the DTW accumulates in float64.
+
+# --- CORPUS ---
+
+def _paths(corpus_dir):
+    return (os.path.join(corpus_dir, "meta.npz"), os.path.join(corpus_dir, "frames.npy"),
+            os.path.join(corpus_dir, "blocks.npy"))
+
+def _normalize(frames):
+    return frames / np.linalg.norm(frames, axis=1, keepdims=True)
+
+def _chroma_job(midi_path):
+    try:
+        chroma = melody_index.midi_roll_chroma(pretty_midi.PrettyMIDI(midi_path), SR, HOP_LENGTH)
+        return _normalize(chroma.T + FLOOR).astype(np.float32)
+    except Exception as e:
+        print(f"\n  Skipping {os.path.basename(midi_path)}: {e}")
+        return np.zeros((0, 12), dtype=np.float32)
+
+def _block_envelopes(frames):
+    """(ceil(T / BLOCK), 12) per-bin maxima of the (unit) frames."""
+    pad = (-len(frames)) % BLOCK
+    frames = np.concatenate((frames, np.zeros((pad, 12), dtype=frames.dtype)))
+    return frames.reshape(-1, BLOCK, 12).max(axis=1)
+
+def build_corpus(midi_dir=MIDI_DIR, corpus_dir=CORPUS_DIR, workers=WORKERS, force=False):
+    """(Re)packs the reference chroma; tunes whose MIDI size/mtime didn't change are copied over."""
+    meta_path, frames_path, blocks_path = _paths(corpus_dir)
+    files = sorted(f for f in os.listdir(midi_dir) if f.lower().endswith(".mid"))
+    stats = {f: os.stat(os.path.join(midi_dir, f)) for f in files}
+    old = load_corpus(corpus_dir) if os.path.exists(meta_path) and not force else None
+    old_pos = {k: i for i, k in enumerate(old["keys"])} if old else {}
+
+    chroma = [None] * len(files)
+    todo = []
+    for i, f in enumerate(files):
+        j = old_pos.get(f[:-4])
+        if j is not None and old["mtimes"][j] == stats[f].st_mtime and old["sizes"][j] == stats[f].st_size:
+            chroma[i] = np.asarray(old["frames"][old["offsets"][j]:old["offsets"][j + 1]])
+        else:
+            todo.append(i)
+    print(f"Packing {len(todo)} of {len(files)} MIDI files ({len(files) - len(todo)} unchanged)...")
+
+    start = time.time()
+    paths = [os.path.join(midi_dir, files[i]) for i in todo]
+    if workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_chroma_job, paths, chunksize=16))
+    else:
+        results = [_chroma_job(p) for p in paths]
+    for i, c in zip(todo, results):
+        chroma[i] = c
+
+    lengths = np.array([len(c) for c in chroma], dtype=np.int64)
+    blocks = [_block_envelopes(c) for c in chroma]
+    n_blocks = np.array([len(b) for b in blocks], dtype=np.int64)
+    frames = np.concatenate(chroma) if chroma else np.zeros((0, 12), dtype=np.float32)
+    blocks = np.concatenate(blocks) if blocks else np.zeros((0, 12), dtype=np.float32)
+    block_offsets = np.concatenate(([0], np.cumsum(n_blocks)))
+    envelopes = np.stack([blocks[a:b].max(axis=0) if b > a else np.zeros(12)
+                          for a, b in zip(block_offsets[:-1], block_offsets[1:])]) if files else np.zeros((0, 12))
+    old = None  # release the memory maps before replacing the files
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    pid = os.getpid()
+    np.save(f"{frames_path}.{pid}.tmp.npy", frames)
+    np.save(f"{blocks_path}.{pid}.tmp.npy", blocks.astype(np.float32))
+    np.savez(f"{meta_path}.{pid}.tmp.npz", keys=np.array([f[:-4] for f in files], dtype=str),
+             midi_dir=midi_dir, sr=SR, hop_length=HOP_LENGTH, block=BLOCK,
+             mtimes=np.array([stats[f].st_mtime for f in files]),
+             sizes=np.array([stats[f].st_size for f in files], dtype=np.int64),
+             offsets=np.concatenate(([0], np.cumsum(lengths))), block_offsets=block_offsets,
+             envelopes=envelopes.astype(np.float32))
+    os.replace(f"{frames_path}.{pid}.tmp.npy", frames_path)
+    os.replace(f"{blocks_path}.{pid}.tmp.npy", blocks_path)
+    os.replace(f"{meta_path}.{pid}.tmp.npz", meta_path)
+    print(f"Packed {len(files)} tunes, {len(frames)} frames ({frames.nbytes / 1024**2:.0f} MB) "
+          f"in {time.time() - start:.1f}s -> {corpus_dir}")
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    meta_path, frames_path, blocks_path = _paths(corpus_dir)
+    with np.load(meta_path, allow_pickle=False) as z:
+        corpus = {k: z[k] for k in z.files}
+    corpus["keys"] = corpus["keys"].tolist()
+    corpus["frames"] = np.load(frames_path, mmap_mode='r')
+    corpus["blocks"] = np.load(blocks_path, mmap_mode='r')
+    return corpus
+
+# --- SEARCH ---
+
+@njit(cache=True)
+def _subseq_cost(S, rest_lb, threshold):
+    """
+    Subsequence DTW cost over the local costs 1 - S (S: cosine similarities; same
+    recursion as banded_dtw), keeping two rows. Returns (cost, rows computed); cost
+    is inf when abandoned.
+    """
+    n, m = S.shape
+    prev = np.empty(m)
+    cur = np.empty(m)
+    for i in range(n):
+        row_min = np.inf
+        for j in range(m):
+            c = 1.0 - S[i, j]
+            if i == 0:
+                v = c
+            else:
+                v = prev[j]
+                if j > 0:
+                    if prev[j - 1] < v: v = prev[j - 1]
+                    if cur[j - 1] < v: v = cur[j - 1]
+                v += c
+            cur[j] = v
+            if v < row_min: row_min = v
+        if row_min + rest_lb[i] >= threshold:
+            return np.inf, i + 1
+        prev, cur = cur, prev
+    return prev.min(), n
+
+def query_chroma(y, sr=SR):
+    """(T, 12) floored, unit-length chroma_cqt of an excerpt, at the corpus frame rate."""
+    chroma = librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=HOP_LENGTH)
+    return _normalize(chroma.T + FLOOR).astype(np.float32)
+
+def search(query, corpus=None, top_k=TOP_K):
+    """
+    query: (T, 12) from query_chroma(). Returns ([(key, cost per query frame)] best
+    first, stats) where stats counts the tunes each stage removed.
+    """
+    corpus = corpus if corpus is not None else load_corpus()
+    t0 = time.perf_counter()
+    Q_unit = np.ascontiguousarray(query, dtype=np.float32)
+    n = len(Q_unit)
+    # float32 round-off (~1e-7 per dot product) must never make a bound exceed the true cost
+    slack = 1e-5 * n
+
+    def bound(dots):
+        return np.maximum(0.0, 1.0 - np.minimum(1.0, dots.astype(np.float64))).sum(axis=0) - slack
+
+    offsets, block_offsets = corpus["offsets"], corpus["block_offsets"]
+    lb_env = bound(Q_unit @ corpus["envelopes"].T)
+    stats = {"tunes": len(corpus["keys"]), "envelope": 0, "blocks": 0, "row_min": 0,
+             "abandoned": 0, "dtw": 0, "dtw_rows": 0}
+
+    best = []   # max-heap of (-cost, index) holding the top_k so far
+    threshold = np.inf
+    order = np.argsort(lb_env, kind='stable')
+    for rank, t in enumerate(order):
+        if lb_env[t] >= threshold:
+            stats["envelope"] += len(order) - rank   # sorted: no later tune can pass either
+            break
+        blocks = corpus["blocks"][block_offsets[t]:block_offsets[t + 1]]
+        if len(blocks) == 0 or bound((Q_unit @ blocks.T).max(axis=1, keepdims=True))[0] >= threshold:
+            stats["blocks"] += 1
+            continue
+        # Similarities of every frame pair, used by both the row minima and the DTW
+        S = Q_unit @ corpus["frames"][offsets[t]:offsets[t + 1]].T
+        row_lb = np.maximum(0.0, 1.0 - np.minimum(1.0, S.max(axis=1).astype(np.float64)))
+        if row_lb.sum() - slack >= threshold:
+            stats["row_min"] += 1
+            continue
+        # Bound of the rows after row i
+        rest_lb = np.concatenate((np.cumsum(row_lb[::-1])[::-1][1:], [0.0])) - slack
+        cost, rows = _subseq_cost(S, rest_lb, threshold)
+        stats["dtw_rows"] += rows
+        if not np.isfinite(cost):
+            stats["abandoned"] += 1
+            continue
+        stats["dtw"] += 1
+        heapq.heappush(best, (-cost, t))
+        if len(best) > top_k:
+            heapq.heappop(best)
+        if len(best) == top_k:
+            threshold = -best[0][0]
+
+    stats["seconds"] = round(time.perf_counter() - t0, 4)
+    results = [(corpus["keys"][t], -c / n) for c, t in sorted(best, reverse=True)]
+    return results, stats
+
+def print_stats(stats):
+    print(f"{stats['tunes']} tunes in {stats['seconds'] * 1000:.0f} ms: pruned by envelope {stats['envelope']}, "
+          f"blocks {stats['blocks']}, row minima {stats['row_min']}; DTW abandoned {stats['abandoned']}, "
+          f"completed {stats['dtw']} ({stats['dtw_rows']} rows)")
+
+def search_file(path, start=0.0, duration=None, top_k=TOP_K, corpus=None):
+    y, sr = audio_io.load(path, sr=SR)
+    a = int(start * sr)
+    b = len(y) if duration is None else a + int(duration * sr)
+    return search(query_chroma(np.asarray(y[a:b], dtype=np.float32), sr), corpus, top_k)
+
+if __name__ == "__main__":
+    # python corpus_search.py build [--force] [--midi-dir dir]
+    # python corpus_search.py query excerpt.wav [more.wav ...] [--start s] [--duration s] [--top N]
+    args = sys.argv[1:]
+    def opt(name, default=None):
+        return args[args.index(name) + 1] if name in args else default
+    if args and args[0] == "build":
+        build_corpus(midi_dir=opt("--midi-dir", MIDI_DIR), workers=int(opt("--workers", WORKERS)), force="--force" in args)
+    elif len(args) >= 2 and args[0] == "query":
+        values = {opt(o) for o in ("--start", "--duration", "--top")}
+        files = [a for a in args[1:] if not a.startswith("--") and a not in values]
+        corpus = load_corpus()
+        for path in files:
+            duration = opt("--duration")
+            results, stats = search_file(path, float(opt("--start", 0.0)), float(duration) if duration else None,
+                                         int(opt("--top", TOP_K)), corpus)
+            print(f"\n{path}")
+            print_stats(stats)
+            for rank, (key, cost) in enumerate(results, 1):
+                print(f"{rank:>3}. {key:<40} cost {cost:.4f}")
+    else:
+        print("Usage: corpus_search.py build [--force] | query excerpt.wav [...] [--start s] [--duration s] [--top N]")
+        sys.exit(1)
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import itertools
+from collections import deque
+import importlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pretty_midi
+import feature_cache
+import banded_dtw
+import alignment_store
+import feature_pool
+import transposition
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+SWEEP_DIR = os.path.join(BASE_DIR, "setup", "sweeps")
+CATEGORIES = ["first", "one_kor", "one_kor_sgl"]
+SR = 22050
+WORKERS = os.cpu_count() or 1
+
+# Every combination of these is run on every track that has a manual alignment.
+# Override with --grid grid.json (same keys).
+SWEEP_GRID = {
+    "hop_length": [512, 256, 128],
+    "metric": ['seuclidean', 'cosine', 'euclidean'],
+    "step_sizes": [[[1, 1], [1, 0], [0, 1]]],
+    "band_width": [0.06, 0.12, 0.25],
+    "subsequence": [False],
+}
+
+# DTW parameter sweep scored like 010_generate_dtw_alignment: the mean deviation (s)
+# of the warping path from the manual alignment line. The chroma of every (track, hop) is
+# made first, in parallel, into feature_cache. The parent then publishes each one once in
+# a feature_pool.FeaturePool and runs one task per combination on it, so the combinations
+# of a slow track spread over all workers without any of them reloading or copying the
+# chroma. Only a few (track, hop) groups are published at a time; each is released when
+# its combinations are done. Like 010, the MIDI chroma is moved into the recording's key
+# first (detect_shift, once per track at its finest hop) and published shifted.
+
+def _stage010():
+    return importlib.import_module("010_generate_dtw_alignment")
+
+def expand_grid(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def prepare_track(wav_path, midi_path, hop):
+    """Pool task: fills the feature cache with the chroma of one (track, hop)."""
+    feature_cache.audio_chroma(wav_path, SR, hop)
+    feature_cache.midi_chroma(midi_path, SR, hop)
+
+def sweep_track(rec_handle, midi_handle, first_note_time, manual_entry, hop, combos):
+    """Runs in a worker on shared chroma. Returns [(combo_index, deviation or None, seconds)] for the combos at `hop`."""
+    m010 = _stage010()
+    c_rec = feature_pool.attach(rec_handle)
+    c_midi = feature_pool.attach(midi_handle)
+
+    results = []
+    for idx, combo in combos:
+        start = time.time()
+        try:
+            _, wp = banded_dtw.dtw(c_midi, c_rec, metric=combo["metric"],
+                                   step_sizes_sigma=np.array(combo["step_sizes"]),
+                                   band_rad=combo["band_width"], subseq=combo["subsequence"])
+            wp = wp[::-1] * (hop / SR)
+            deviation = m010.manual_deviation(wp[:, 0] - first_note_time, wp[:, 1], manual_entry)
+        except Exception:
+            deviation = None
+        results.append((idx, deviation, time.time() - start))
+    return results
+
+def leaderboard(combos, scores, n_tracks):
+    """Ranks combinations: fewest failed tracks first, then lowest mean deviation."""
+    rows = []
+    for idx, combo in enumerate(combos):
+        devs = [d for _, d, _ in scores[idx] if d is not None]
+        rows.append({
+            "params": combo,
+            "mean_deviation": round(float(np.mean(devs)), 4) if devs else None,
+            "median_deviation": round(float(np.median(devs)), 4) if devs else None,
+            "max_deviation": round(float(np.max(devs)), 4) if devs else None,
+            "failed": n_tracks - len(devs),
+            "seconds": round(sum(t for _, _, t in scores[idx]), 2),
+            "per_track": {key: (round(d, 4) if d is not None else None) for key, d, _ in scores[idx]},
+        })
+    rows.sort(key=lambda r: (r["failed"], r["mean_deviation"] if r["mean_deviation"] is not None else np.inf))
+    return rows
+
+def sweep_category(cat, grid=None, workers=WORKERS, top=10):
+    grid = dict(SWEEP_GRID, **(grid or {}))
+    combos = expand_grid(grid)
+    conn = alignment_store.connect()
+    manual = alignment_store.load(conn, "manual", cat)
+
+    tracks = []
+    for key, entry in manual.items():
+        wav_path = os.path.join(BASE_DIR, "mp3", cat, "wav", f"{key}.wav")
+        midi_path = os.path.join(BASE_DIR, "mid/cleaned", f"{key}.mid")
+        if os.path.exists(wav_path) and os.path.exists(midi_path):
+            tracks.append((key, wav_path, midi_path, entry))
+    print(f"\n--- Sweep {cat}: {len(combos)} combinations x {len(tracks)} tracks ({workers} workers) ---")
+    if not tracks:
+        print("No tracks with a manual alignment, skipping.")
+        return None
+
+    by_hop = {}
+    for idx, combo in enumerate(combos):
+        by_hop.setdefault(combo["hop_length"], []).append((idx, combo))
+
+    scores = {idx: [] for idx in range(len(combos))}
+    shifts = {}
+    n_tasks = len(tracks) * len(combos)
+    done = 0
+    start = time.time()
+    m010 = _stage010()
+    with feature_pool.FeaturePool() as features, \
+         ProcessPoolExecutor(max_workers=max(1, workers), initializer=feature_pool.worker_init) as pool:
+        for fut in [pool.submit(prepare_track, wav_path, midi_path, hop)
+                    for _, wav_path, midi_path, _ in tracks for hop in by_hop]:
+            fut.exception()  # A failing track fails again below, where it is reported
+
+        def drain(group):
+            nonlocal done
+            handles, futures = group
+            for key, fut in futures:
+                try:
+                    for idx, deviation, seconds in fut.result():
+                        scores[idx].append((key, deviation, seconds))
+                except Exception as e:
+                    print(f"\nTask failed: {e}")
+                done += 1
+                print(f"  {done}/{n_tasks} tasks...", end="\r")
+            for handle in handles:
+                features.release(handle)
+
+        groups = deque()
+        for key, wav_path, midi_path, entry in tracks:
+            try:
+                pm = pretty_midi.PrettyMIDI(midi_path)
+            except Exception as e:
+                print(f"\nTask failed: {e}")
+                continue
+            first_note_time = m010.get_midi_start_time(pm)
+            try:
+                finest = min(by_hop)
+                shifts[key] = m010.detect_shift(feature_cache.audio_chroma(wav_path, SR, finest),
+                                                feature_cache.midi_chroma(midi_path, SR, finest, pm=pm))
+            except Exception as e:
+                print(f"\nTask failed: {e}")
+                continue
+            for hop, hop_combos in by_hop.items():
+                try:
+                    c_midi = transposition.apply(feature_cache.midi_chroma(midi_path, SR, hop, pm=pm), shifts[key])
+                    handles = (features.publish(feature_cache.audio_chroma(wav_path, SR, hop)),
+                               features.publish(c_midi))
+                except Exception as e:
+                    print(f"\nTask failed: {e}")
+                    continue
+                groups.append((handles, [(key, pool.submit(sweep_track, *handles, first_note_time, entry, hop, [c]))
+                                         for c in hop_combos]))
+                while len(groups) > workers:
+                    drain(groups.popleft())
+        while groups:
+            drain(groups.popleft())
+
+    # Tasks that crashed completely count as failures for all their combos
+    for idx in scores:
+        seen = {key for key, _, _ in scores[idx]}
+        scores[idx] += [(t[0], None, 0.0) for t in tracks if t[0] not in seen]
+    board = leaderboard(combos, scores, len(tracks))
+
+    os.makedirs(SWEEP_DIR, exist_ok=True)
+    out_file = os.path.join(SWEEP_DIR, f"sweep_{cat}.json")
+    with open(out_file, 'w') as f:
+        json.dump({"category": cat, "tracks": [t[0] for t in tracks], "grid": grid,
+                   "transpose": shifts, "seconds": round(time.time() - start, 1), "leaderboard": board}, f, indent=2)
+
+    print(f"\n{'rank':>4} {'mean':>7} {'median':>7} {'max':>7} {'fail':>4}  params")
+    for rank, row in enumerate(board[:top], 1):
+        mean = f"{row['mean_deviation']:.3f}" if row['mean_deviation'] is not None else "-"
+        median = f"{row['median_deviation']:.3f}" if row['median_deviation'] is not None else "-"
+        worst = f"{row['max_deviation']:.3f}" if row['max_deviation'] is not None else "-"
+        print(f"{rank:>4} {mean:>7} {median:>7} {worst:>7} {row['failed']:>4}  {json.dumps(row['params'])}")
+    print(f"Saved leaderboard to {out_file}")
+    return board
+
+if __name__ == "__main__":
+    # python dtw_sweep.py [--category cat] [--grid grid.json] [--workers N] [--top N]
+    args = sys.argv[1:]
+    def opt(name, default=None):
+        return args[args.index(name) + 1] if name in args else default
+    grid = None
+    if opt("--grid"):
+        with open(opt("--grid"), 'r') as f: grid = json.load(f)
+    cats = [opt("--category")] if opt("--category") else CATEGORIES
+    for cat in cats:
+        sweep_category(cat, grid, workers=int(opt("--workers", WORKERS)), top=int(opt("--top", 10)))
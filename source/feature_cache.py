@@ -0,0 +1,156 @@
+import os
+import sys
+import hashlib
+import numpy as np
+import librosa
+import pretty_midi
+import audio_io
+import perf_log
+import midi_features
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+CACHE_DIR = os.path.join(BASE_DIR, "cache", "features")
+# Total size of all cached .npy files. Least recently used entries are deleted above this.
+MAX_CACHE_BYTES = 8 * 1024 ** 3
+HASH_BLOCK_SIZE = 1 << 20
+# How midi_chroma makes MIDI features: 'synth' (midi_synth, same audio as pretty_midi, + chroma_cqt) or
+# 'symbolic' (midi_features, straight from the notes). AI_MUSIC_MIDI_RENDERER overrides
+# it; being an environment variable, it also reaches process pool workers.
+MIDI_RENDERER = 'synth'
+RENDERERS = ('synth', 'symbolic')
+
+# (abs path, size, mtime) -> content hash, so a file is only hashed once per process
+_hash_memo = {}
+
+def file_hash(path):
+    """SHA1 of the file content. Renamed/copied files share cache entries."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _hash_memo:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                h.update(block)
+        _hash_memo[memo_key] = h.hexdigest()
+    return _hash_memo[memo_key]
+
+def cache_key(path, feature, **params):
+    """Key = content hash of the source file + feature type + feature parameters."""
+    parts = [file_hash(path), feature] + [f"{k}={params[k]}" for k in sorted(params)]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+def cache_path(key):
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.npy")
+
+def feature_path(path, feature, **params):
+    """Where get_feature(path, feature, ..., **params) keeps its entry (it may not exist)."""
+    return cache_path(cache_key(path, feature, **params))
+
+def get_feature(path, feature, compute, **params):
+    """
+    Returns the feature array for `path`, computing it with `compute()` on a miss.
+    Hits are returned as read-only memory maps of the cached .npy file.
+    """
+    npy_path = feature_path(path, feature, **params)
+
+    if os.path.exists(npy_path):
+        try:
+            data = np.load(npy_path, mmap_mode='r')
+            os.utime(npy_path)  # Mark as recently used for eviction
+            return data
+        except (ValueError, OSError):
+            pass  # Broken entry (e.g. killed mid-write): recompute below
+
+    data = np.ascontiguousarray(compute())
+    store(npy_path, data)
+    evict()
+    return data
+
+def store(npy_path, data):
+    # Write to a temp file and rename, so parallel runs never see half-written entries
+    os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+    tmp_path = f"{npy_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp_path, npy_path)
+    except OSError as e:
+        print(f"Feature cache write failed: {e}")
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
+def list_entries():
+    entries = []
+    if not os.path.exists(CACHE_DIR): return entries
+    for sub in os.listdir(CACHE_DIR):
+        sub_dir = os.path.join(CACHE_DIR, sub)
+        if not os.path.isdir(sub_dir): continue
+        for f in os.listdir(sub_dir):
+            if not f.endswith('.npy'): continue
+            p = os.path.join(sub_dir, f)
+            try:
+                st = os.stat(p)
+                entries.append((st.st_mtime, st.st_size, p))
+            except OSError:
+                pass  # Deleted by another process
+    return entries
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """Deletes least recently used entries until the cache fits in max_bytes."""
+    entries = list_entries()
+    total = sum(e[1] for e in entries)
+    if total <= max_bytes: return
+    for _, size, p in sorted(entries):
+        try:
+            os.remove(p)
+        except OSError:
+            continue
+        total -= size
+        if total <= max_bytes: break
+
+# --- FEATURES ---
+
+def audio_chroma(audio_path, sr, hop_length, y=None):
+    """chroma_cqt of a recording. Pass `y` if the audio is already loaded."""
+    def compute():
+        with perf_log.span("decode"):
+            sig = y if y is not None else audio_io.load(audio_path, sr=sr)[0]
+        with perf_log.span("cqt"):
+            return librosa.feature.chroma_cqt(y=sig, sr=sr, hop_length=hop_length)
+    return get_feature(audio_path, "chroma_cqt", compute, sr=sr, hop_length=hop_length)
+
+def midi_renderer():
+    renderer = os.environ.get("AI_MUSIC_MIDI_RENDERER") or MIDI_RENDERER
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unknown MIDI renderer '{renderer}'. Options: {RENDERERS}")
+    return renderer
+
+def midi_chroma(midi_path, sr, hop_length, pm=None, renderer=None):
+    """chroma_cqt of the pretty_midi synthesis of a MIDI file, or its symbolic stand-in."""
+    renderer = renderer or midi_renderer()
+    if renderer == 'symbolic':
+        def compute():
+            midi = pm if pm is not None else pretty_midi.PrettyMIDI(midi_path)
+            with perf_log.span("render"):
+                return midi_features.render_chroma(midi, sr, hop_length)
+        return get_feature(midi_path, "chroma_symbolic", compute, sr=sr, hop_length=hop_length,
+                           **midi_features.RENDER_PARAMS)
+
+    def compute():
+        import midi_synth  # imports this module
+        midi = pm if pm is not None else pretty_midi.PrettyMIDI(midi_path)
+        with perf_log.span("synthesize"):
+            y = midi_synth.synthesize(midi, sr)
+        with perf_log.span("cqt"):
+            return librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=hop_length)
+    return get_feature(midi_path, "chroma_cqt_synth", compute, sr=sr, hop_length=hop_length)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "clear":
+        evict(0)
+        print(f"Cleared {CACHE_DIR}")
+    else:
+        entries = list_entries()
+        total = sum(e[1] for e in entries)
+        print(f"{len(entries)} cached features, {total / 1024**2:.1f} MB "
+              f"(limit {MAX_CACHE_BYTES / 1024**2:.0f} MB) in {CACHE_DIR}")
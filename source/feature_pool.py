@@ -0,0 +1,141 @@
+import os
+import sys
+import atexit
+import secrets
+import threading
+import time
+import weakref
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# --- CONFIG ---
+# Segment names (/dev/shm/<PREFIX>_<pid>_<random> on Linux); the pid tells whose they are
+PREFIX = "ai_music"
+
+# Zero-copy feature handoff between a parent and its pool workers. The parent publishes
+# an array once into a multiprocessing.shared_memory segment and hands tasks a small
+# picklable handle; a worker attach()es it as a read-only NumPy view instead of
+# recomputing the feature or receiving a pickled copy. For results going the other way,
+# file_handle() names a feature_cache .npy entry, which attaches as a read-only memory map.
+#
+# Lifecycle: a FeaturePool owns its segments. release() frees one after its last task,
+# close() frees the rest (also when leaving the with block on an exception, and at
+# interpreter exit). If the parent is killed, multiprocessing's resource tracker unlinks
+# the segments it created, once every process holding its pipe is gone: pools pass
+# initializer=worker_init so their workers exit when the parent does instead of lingering
+# as orphans. Workers attach untracked, so a worker that exits or dies
+# never unlinks a segment the parent still serves. A worker drops its mappings of earlier
+# tasks' segments on its next attach (once no view of them is left), so memory of
+# released segments is returned while the pool keeps running.
+
+# Worker side: name -> (SharedMemory, weak references to the views handed out). A segment
+# stays mapped while any of those views (or an array derived from one) is alive.
+_attached = {}
+
+class FeaturePool:
+    def __init__(self):
+        self._segments = {}
+        atexit.register(self.close)
+
+    def publish(self, array):
+        """Copies `array` into a new segment once. Returns the handle to pass to tasks."""
+        array = np.ascontiguousarray(array)
+        name = f"{PREFIX}_{os.getpid()}_{secrets.token_hex(6)}"
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        self._segments[name] = shm
+        return ("shm", name, array.shape, array.dtype.str)
+
+    def release(self, handle):
+        """Unlinks a published segment; workers still mapping it keep it until they drop it."""
+        shm = self._segments.pop(handle[1], None)
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    def close(self):
+        for name in list(self._segments):
+            self.release(("shm", name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        atexit.unregister(self.close)
+
+    def __len__(self):
+        return len(self._segments)
+
+def file_handle(npy_path):
+    """Handle for a .npy file (e.g. a feature_cache entry): attaches as a read-only memory map."""
+    return ("file", npy_path)
+
+def _open_untracked(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Before 3.13 attaching registers the segment with the tracker, which would then
+    # unlink it when this process exits; the owner alone is responsible for it
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+def attach(handle):
+    """Read-only NumPy view of a handle from FeaturePool.publish or file_handle."""
+    if handle[0] == "file":
+        return np.load(handle[1], mmap_mode='r')
+    _, name, shape, dtype = handle
+    detach_unused(keep=name)
+    if name not in _attached:
+        _attached[name] = (_open_untracked(name), [])
+    shm, views = _attached[name]
+    view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    view.flags.writeable = False
+    views.append(weakref.ref(view))
+    return view
+
+def detach_unused(keep=None):
+    """Closes this process's mappings that no view uses any more."""
+    for name, (shm, views) in list(_attached.items()):
+        if name == keep or any(view() is not None for view in views):
+            continue
+        shm.close()
+        del _attached[name]
+
+def worker_init():
+    """ProcessPoolExecutor initializer: exit when the parent process goes away."""
+    parent = os.getppid()
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(1.0)
+        os._exit(1)
+    threading.Thread(target=watch, daemon=True).start()
+
+def leaked():
+    """Segments in /dev/shm whose creating process is gone (Linux), e.g. after kill -9 of the tracker too."""
+    if not os.path.isdir("/dev/shm"):
+        return []
+    names = []
+    for name in os.listdir("/dev/shm"):
+        parts = name.split("_")
+        if not name.startswith(PREFIX + "_") or len(parts) < 3 or not parts[-2].isdigit():
+            continue
+        try:
+            os.kill(int(parts[-2]), 0)
+        except ProcessLookupError:
+            names.append(name)
+        except PermissionError:
+            pass
+    return names
+
+if __name__ == "__main__":
+    # python feature_pool.py [clean]   list (or remove) segments left behind by dead processes
+    stale = leaked()
+    for name in stale:
+        if sys.argv[1:2] == ["clean"]:
+            os.remove(os.path.join("/dev/shm", name))
+        print(("Removed " if sys.argv[1:2] == ["clean"] else "") + name)
+    print(f"{len(stale)} leaked segments")
@@ -0,0 +1,75 @@
+import os
+import pretty_midi
+import feature_cache
+import perf_log
+import feature_pool
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+MIDI_DIR = os.path.join(BASE_DIR, "mid/cleaned")
+CATEGORIES = ["first", "one_kor", "one_kor_sgl"]
+
+# Key-centric scheduling. A key of mid/cleaned usually has a recording in every category,
+# and all of them align against the same MIDI. Batches that loop category-first parse the
+# MIDI and fetch its features once per category; grouping the work by key does it once per
+# key. A MidiReference keeps the parsed MIDI and its chroma in memory while every recording
+# of its key is processed (in one process, so nothing has to be shared between workers),
+# and is dropped before the next key. To spread one key's recordings over pool workers,
+# share() publishes the chroma fetched so far through a feature_pool.FeaturePool; the
+# SharedMidiReference it returns pickles as handles and attaches them in the worker.
+
+def midi_path(key):
+    return os.path.join(MIDI_DIR, f"{key}.mid")
+
+def group_by_key(jobs):
+    """{key: [job, ...]} for (key, ...) tuples; keys in first-seen order, jobs in input order."""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job[0], []).append(job)
+    return groups
+
+class MidiReference:
+    """The MIDI side of one key, computed on first use and shared by all its recordings."""
+
+    def __init__(self, path):
+        self.path = path
+        self._pm = None
+        self._chroma = {}
+
+    @property
+    def pm(self):
+        if self._pm is None:
+            with perf_log.span("midi_parse"):
+                self._pm = pretty_midi.PrettyMIDI(self.path)
+        return self._pm
+
+    def chroma(self, sr, hop_length):
+        """feature_cache.midi_chroma of this MIDI (current renderer), fetched once per (sr, hop)."""
+        memo_key = (sr, hop_length, feature_cache.midi_renderer())
+        if memo_key not in self._chroma:
+            # A cache hit needs no parse; reuse the PrettyMIDI only if something already parsed it
+            self._chroma[memo_key] = feature_cache.midi_chroma(self.path, sr, hop_length, pm=self._pm)
+        return self._chroma[memo_key]
+
+    def share(self, pool):
+        """Picklable stand-in for pool workers; the chroma fetched so far is published once in `pool`."""
+        return SharedMidiReference(self.path, {k: pool.publish(v) for k, v in self._chroma.items()})
+
+class SharedMidiReference(MidiReference):
+    """A MidiReference whose chroma lives in a FeaturePool. Worker side; the MIDI is parsed on demand."""
+
+    def __init__(self, path, handles):
+        super().__init__(path)
+        self.handles = handles
+
+    def chroma(self, sr, hop_length):
+        memo_key = (sr, hop_length, feature_cache.midi_renderer())
+        if memo_key in self.handles and memo_key not in self._chroma:
+            self._chroma[memo_key] = feature_pool.attach(self.handles[memo_key])
+        return super().chroma(sr, hop_length)
+
+    def __getstate__(self):
+        return {"path": self.path, "handles": self.handles}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["handles"])
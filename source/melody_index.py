@@ -0,0 +1,240 @@
+import os
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import librosa
+import pretty_midi
+import scipy.ndimage
+import feature_cache
+import banded_dtw
+import audio_io
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+MIDI_DIR = os.path.join(BASE_DIR, "mid", "cleaned")
+INDEX_PATH = os.path.join(BASE_DIR, "cache", "melody_index.npz")
+SR = 22050
+WORKERS = os.cpu_count() or 1
+# Fingerprint: n-grams of melodic intervals (semitones mod 12, repeated notes merged)
+NGRAM = 4
+# MIDI melody = highest note among notes starting within CHORD_SEC of each other
+CHORD_SEC = 0.03
+MIN_NOTE_SEC = 0.06
+# Query transcription: chroma argmax per frame, kept where the winning pitch class
+# clearly dominates, median filtered, runs shorter than MIN_NOTE_SEC dropped
+QUERY_HOP = 512
+DOMINANCE = 1.25
+MEDIAN_FRAMES = 5
+# Stage 2: subsequence DTW of the excerpt against the best CANDIDATES tunes
+CANDIDATES = 50
+RERANK_HOP = 2048
+TOP_K = 5
+
+# Melody identification over the whole MIDI collection, without knowing the key:
+#   1. build(): every tune in mid/cleaned -> set of interval n-gram tokens, stored as
+#      an inverted index (postings sorted by token, looked up with searchsorted), so a
+#      query touches only the postings of its own tokens, not every tune.
+#   2. identify(): transcribe the excerpt to the same tokens, score tunes by summed
+#      idf of shared tokens, then re-rank the top CANDIDATES with subsequence DTW of
+#      the excerpt's chroma_cqt against the tune's piano-roll chroma (no synthesis,
+#      ~10 ms per candidate, cached through feature_cache).
+# Intervals make the first stage independent of key and tempo.
+
+# --- FINGERPRINTS ---
+
+def intervals_to_tokens(pitch_classes, n=NGRAM):
+    """Pitch-class sequence -> unique n-gram tokens (int, base 12) of its intervals."""
+    pc = np.asarray(pitch_classes, dtype=np.int64)
+    if len(pc) > 1:
+        pc = pc[np.concatenate(([True], pc[1:] != pc[:-1]))]
+    iv = np.mod(np.diff(pc), 12)
+    if len(iv) < n:
+        return np.zeros(0, dtype=np.int64)
+    grams = np.lib.stride_tricks.sliding_window_view(iv, n)
+    return np.unique(grams @ (12 ** np.arange(n - 1, -1, -1)))
+
+def midi_melody(pm):
+    """Skyline melody of a PrettyMIDI as pitch classes in time order."""
+    notes = sorted(((n.start, n.pitch) for inst in pm.instruments if not inst.is_drum
+                    for n in inst.notes if n.end - n.start >= MIN_NOTE_SEC))
+    melody, group_start, top = [], None, -1
+    for start, pitch in notes:
+        if group_start is None or start - group_start > CHORD_SEC:
+            if top >= 0: melody.append(top % 12)
+            group_start, top = start, pitch
+        else:
+            top = max(top, pitch)
+    if top >= 0: melody.append(top % 12)
+    return melody
+
+def midi_tokens(midi_path):
+    return intervals_to_tokens(midi_melody(pretty_midi.PrettyMIDI(midi_path)))
+
+def audio_melody(chroma, hop_length=QUERY_HOP, sr=SR):
+    """Dominant pitch class per note from a (12, T) chroma."""
+    ordered = np.sort(chroma, axis=0)
+    pc = np.argmax(chroma, axis=0)
+    pc[ordered[-1] < DOMINANCE * ordered[-2]] = -1   # no clear winner: unvoiced
+    pc = scipy.ndimage.median_filter(pc, size=MEDIAN_FRAMES, mode='nearest')
+
+    min_frames = max(1, int(round(MIN_NOTE_SEC * sr / hop_length)))
+    change = np.flatnonzero(np.diff(pc)) + 1
+    starts = np.concatenate(([0], change))
+    lengths = np.diff(np.concatenate((starts, [len(pc)])))
+    keep = (lengths >= min_frames) & (pc[starts] >= 0)
+    return pc[starts[keep]].tolist()
+
+# --- INDEX ---
+
+def _tokens_job(midi_path):
+    try:
+        return midi_tokens(midi_path)
+    except Exception as e:
+        print(f"\n  Skipping {os.path.basename(midi_path)}: {e}")
+        return np.zeros(0, dtype=np.int64)
+
+def build(midi_dir=MIDI_DIR, index_path=INDEX_PATH, workers=WORKERS, force=False):
+    """(Re)builds the index; tunes whose MIDI size/mtime didn't change keep their tokens."""
+    files = sorted(f for f in os.listdir(midi_dir) if f.lower().endswith(".mid"))
+    stats = {f: os.stat(os.path.join(midi_dir, f)) for f in files}
+    old = {}
+    if os.path.exists(index_path) and not force:
+        idx = load(index_path)
+        for i, key in enumerate(idx["keys"]):
+            old[key] = (idx["mtimes"][i], idx["sizes"][i], idx["tune_tokens"][idx["tune_offsets"][i]:idx["tune_offsets"][i + 1]])
+
+    keys = [f[:-4] for f in files]
+    tokens = [None] * len(files)
+    todo = []
+    for i, (f, key) in enumerate(zip(files, keys)):
+        st = stats[f]
+        if key in old and old[key][0] == st.st_mtime and old[key][1] == st.st_size:
+            tokens[i] = old[key][2]
+        else:
+            todo.append(i)
+    print(f"Indexing {len(todo)} of {len(files)} MIDI files ({len(files) - len(todo)} unchanged)...")
+
+    start = time.time()
+    if todo:
+        paths = [os.path.join(midi_dir, files[i]) for i in todo]
+        if workers > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_tokens_job, paths, chunksize=16))
+        else:
+            results = [_tokens_job(p) for p in paths]
+        for i, t in zip(todo, results):
+            tokens[i] = t
+
+    lengths = np.array([len(t) for t in tokens], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    tune_tokens = np.concatenate(tokens) if tokens else np.zeros(0, dtype=np.int64)
+    # Inverted lists: all (token, tune) pairs sorted by token
+    tune_of = np.repeat(np.arange(len(tokens), dtype=np.int32), lengths)
+    order = np.argsort(tune_tokens, kind='stable')
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, keys=np.array(keys, dtype=str), midi_dir=midi_dir, ngram=NGRAM,
+             mtimes=np.array([stats[f].st_mtime for f in files]),
+             sizes=np.array([stats[f].st_size for f in files], dtype=np.int64),
+             tune_tokens=tune_tokens, tune_offsets=offsets,
+             post_tokens=tune_tokens[order], post_tunes=tune_of[order])
+    os.replace(tmp_path, index_path)
+    print(f"Indexed {len(keys)} tunes, {len(tune_tokens)} postings in {time.time() - start:.1f}s -> {index_path}")
+
+def load(index_path=INDEX_PATH):
+    with np.load(index_path, allow_pickle=False) as z:
+        idx = {k: z[k] for k in z.files}
+    idx["keys"] = idx["keys"].tolist()
+    idx["midi_dir"] = str(idx["midi_dir"])
+    return idx
+
+def candidates(idx, tokens, n=CANDIDATES):
+    """Top-n tune indices by idf-weighted shared tokens (normalized by tune size)."""
+    n_tunes = len(idx["keys"])
+    post_tokens, post_tunes = idx["post_tokens"], idx["post_tunes"]
+    lo = np.searchsorted(post_tokens, tokens, side='left')
+    hi = np.searchsorted(post_tokens, tokens, side='right')
+    scores = np.zeros(n_tunes)
+    for a, b in zip(lo, hi):
+        if b > a:
+            np.add.at(scores, post_tunes[a:b], np.log1p(n_tunes / (b - a)))
+    sizes = np.maximum(np.diff(idx["tune_offsets"]), 1)
+    scores /= np.sqrt(sizes)
+    hit = np.flatnonzero(scores > 0)
+    best = hit[np.argsort(-scores[hit], kind='stable')[:n]]
+    return best, scores[best]
+
+# --- QUERY ---
+
+def midi_roll_chroma(pm, sr=SR, hop_length=RERANK_HOP):
+    """Chroma straight from the MIDI notes at the frame rate of chroma_cqt(hop_length)."""
+    chroma = pm.get_chroma(fs=sr / hop_length)
+    peak = chroma.max(axis=0, keepdims=True)
+    return np.divide(chroma, peak, out=np.zeros_like(chroma), where=peak > 0)
+
+def roll_chroma(midi_path, sr=SR, hop_length=RERANK_HOP):
+    def compute():
+        return midi_roll_chroma(pretty_midi.PrettyMIDI(midi_path), sr, hop_length)
+    return feature_cache.get_feature(midi_path, "chroma_roll", compute, sr=sr, hop_length=hop_length)
+
+def subsequence_cost(query_chroma, ref_chroma):
+    """Mean cosine cost per query frame of the best match anywhere in the reference, and where it starts."""
+    # Silent frames have no direction; a tiny floor keeps the cosine defined
+    q, r = query_chroma + 1e-6, ref_chroma + 1e-6
+    if r.shape[1] < q.shape[1]:
+        return np.inf, 0
+    cost, wp = banded_dtw.dtw(q, r, metric='cosine', band_rad=None, subseq=True)
+    return cost / q.shape[1], int(wp[-1, 1])
+
+def identify(y, idx=None, top_k=TOP_K, n_candidates=CANDIDATES, sr=SR):
+    """Excerpt samples -> [{"key", "cost", "score", "midi_start"}] best first."""
+    idx = idx if idx is not None else load()
+    t0 = time.perf_counter()
+    query_tokens = intervals_to_tokens(audio_melody(librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=QUERY_HOP)))
+    cand, scores = candidates(idx, query_tokens, n_candidates)
+    t1 = time.perf_counter()
+
+    q = librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=RERANK_HOP)
+    results = []
+    for i, score in zip(cand, scores):
+        key = idx["keys"][i]
+        midi_path = os.path.join(idx["midi_dir"], f"{key}.mid")
+        try:
+            ref = roll_chroma(midi_path, sr, RERANK_HOP)
+            cost, start = subsequence_cost(q, ref)
+        except Exception as e:
+            print(f"  {key}: {e}")
+            continue
+        results.append({"key": key, "cost": round(float(cost), 4), "score": round(float(score), 3),
+                        "midi_start": round(start * RERANK_HOP / sr, 2)})
+    results.sort(key=lambda r: r["cost"])
+    t2 = time.perf_counter()
+    print(f"{len(query_tokens)} query tokens -> {len(cand)} candidates of {len(idx['keys'])} tunes "
+          f"in {(t1 - t0) * 1000:.0f} ms, DTW re-rank {(t2 - t1) * 1000:.0f} ms")
+    return results[:top_k]
+
+def identify_file(path, start=0.0, duration=None, top_k=TOP_K):
+    y, sr = audio_io.load(path, sr=SR)
+    a = int(start * sr)
+    b = len(y) if duration is None else a + int(duration * sr)
+    return identify(np.asarray(y[a:b], dtype=np.float32), top_k=top_k)
+
+if __name__ == "__main__":
+    # python melody_index.py build [--force] [--midi-dir dir]
+    # python melody_index.py query excerpt.wav [--start s] [--duration s] [--top N]
+    args = sys.argv[1:]
+    def opt(name, default=None):
+        return args[args.index(name) + 1] if name in args else default
+    if args and args[0] == "build":
+        build(midi_dir=opt("--midi-dir", MIDI_DIR), workers=int(opt("--workers", WORKERS)), force="--force" in args)
+    elif len(args) >= 2 and args[0] == "query":
+        duration = opt("--duration")
+        for rank, r in enumerate(identify_file(args[1], float(opt("--start", 0.0)),
+                                               float(duration) if duration else None,
+                                               int(opt("--top", TOP_K))), 1):
+            print(f"{rank:>3}. {r['key']:<40} cost {r['cost']:.3f}  index score {r['score']:.2f}  at {r['midi_start']:.1f}s")
+    else:
+        print("Usage: melody_index.py build [--force] | query excerpt.wav [--start s] [--duration s] [--top N]")
+        sys.exit(1)
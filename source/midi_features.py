@@ -0,0 +1,76 @@
+import numpy as np
+
+# --- CONFIG ---
+# Same semitone grid as librosa's chroma_cqt: 84 bins (7 octaves) from C1
+N_BINS = 84
+FMIN_MIDI = 24
+# Relative level of harmonics 1, 2, 3, ... (2 and 4 fold onto the note's own pitch class,
+# 3 adds its fifth, 5 its major third)
+HARMONIC_WEIGHTS = [1.0, 0.5, 0.3, 0.2]
+# Note envelope: starts at 1, decays towards SUSTAIN with time constant DECAY_SEC,
+# and rings on for RELEASE_SEC (exponential) after the note-off. A release tail made
+# alignment worse on the benchmark fixtures, hence 0.
+DECAY_SEC = 0.3
+SUSTAIN = 0.2
+RELEASE_SEC = 0.0
+# Everything that changes the render; part of the feature cache key
+RENDER_PARAMS = {"n_bins": N_BINS, "fmin_midi": FMIN_MIDI, "harmonics": HARMONIC_WEIGHTS,
+                 "decay_sec": DECAY_SEC, "sustain": SUSTAIN, "release_sec": RELEASE_SEC}
+
+# Symbolic features: CQT-like spectrogram / chroma straight from the note events,
+# instead of pretty_midi.synthesize + chroma_cqt. Every (note, frame) cell is built
+# with one np.repeat and accumulated with np.bincount, once per harmonic, so the cost
+# is proportional to the number of sounding note-frames rather than the audio length.
+# Frame k is at time k * hop_length / sr, like librosa's centered frames.
+
+def note_events(pm):
+    """(start, end, pitch, velocity) arrays of all non-drum notes of a PrettyMIDI."""
+    notes = [(n.start, n.end, n.pitch, n.velocity) for inst in pm.instruments if not inst.is_drum
+             for n in inst.notes]
+    if not notes:
+        return tuple(np.zeros(0) for _ in range(4))
+    start, end, pitch, velocity = np.array(notes, dtype=np.float64).T
+    return start, end, pitch.astype(np.int64), velocity
+
+def n_frames_for(pm, sr, hop_length):
+    """Frame count chroma_cqt gives for pm.synthesize(fs=sr) (one second longer than the last instrument)."""
+    if not pm.instruments:
+        return 0
+    return 1 + max(int(sr * (inst.get_end_time() + 1)) for inst in pm.instruments) // hop_length
+
+def render_cqt(pm, sr, hop_length, n_frames=None):
+    """(N_BINS, n_frames) magnitude-like spectrogram on the chroma_cqt semitone grid."""
+    n_frames = n_frames_for(pm, sr, hop_length) if n_frames is None else n_frames
+    start, end, pitch, velocity = note_events(pm)
+    out = np.zeros(N_BINS * n_frames)
+    if len(start) == 0 or n_frames == 0:
+        return out.reshape(N_BINS, n_frames)
+
+    fps = sr / hop_length
+    first = np.clip(np.ceil(start * fps).astype(np.int64), 0, n_frames)
+    last = np.clip(np.ceil((end + RELEASE_SEC) * fps).astype(np.int64), 0, n_frames)
+    counts = np.maximum(last - first, 0)
+    # One entry per sounding (note, frame)
+    note = np.repeat(np.arange(len(start)), counts)
+    frame = first[note] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    t = frame / fps
+    since_on = t - start[note]
+    amp = (velocity[note] / 127.0) * (SUSTAIN + (1.0 - SUSTAIN) * np.exp(-since_on / DECAY_SEC))
+    if RELEASE_SEC > 0:
+        since_off = np.maximum(t - end[note], 0)
+        amp *= np.exp(-since_off / RELEASE_SEC)
+
+    for h, weight in enumerate(HARMONIC_WEIGHTS, 1):
+        b = pitch[note] - FMIN_MIDI + int(round(12 * np.log2(h)))
+        ok = (b >= 0) & (b < N_BINS)
+        out += np.bincount(b[ok] * n_frames + frame[ok], weights=weight * amp[ok], minlength=out.size)
+    return out.reshape(N_BINS, n_frames)
+
+def render_chroma(pm, sr, hop_length, n_frames=None):
+    """(12, n_frames) chroma, max-normalized per frame like chroma_cqt (silent frames stay 0)."""
+    cqt = render_cqt(pm, sr, hop_length, n_frames)
+    chroma = np.zeros((12, cqt.shape[1]))
+    np.add.at(chroma, (FMIN_MIDI + np.arange(N_BINS)) % 12, cqt)
+    peak = chroma.max(axis=0, keepdims=True)
+    return np.divide(chroma, peak, out=chroma, where=peak > 0)
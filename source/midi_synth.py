@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import numpy as np
+from numba import njit
+import pretty_midi
+import feature_cache
+
+# --- CONFIG ---
+SR = 22050
+# pretty_midi's note shape: exp(-t / 1 s) decay, linear fade over the last 0.1 s
+DECAY_SEC = 1.0
+FADE_SEC = 0.1
+
+# Drop-in for PrettyMIDI.synthesize (same notes, envelope, lengths and normalization).
+# pretty_midi evaluates wave() and exp() for every sample of every note in Python;
+# here each distinct pitch gets one oscillator table (wave(omega * k) up to its longest
+# note), all notes share one decay table, and a compiled kernel mixes the table
+# slices into the output. render() keeps the result as float32 in feature_cache,
+# keyed by MIDI content hash and sample rate.
+# Instruments with pitch bends fall back to pretty_midi for that instrument.
+
+@njit(cache=True)
+def _mix(out, starts, lengths, velocities, table_ids, table_offsets, tables, decay, fade):
+    n_fade = fade.shape[0]
+    for n in range(starts.shape[0]):
+        start, length, vel = starts[n], lengths[n], velocities[n]
+        t0 = table_offsets[table_ids[n]]
+        if length > n_fade:
+            body = length - n_fade
+            # Same products in the same order as pretty_midi: (envelope * velocity) * wave
+            for k in range(body):
+                out[start + k] += decay[k] * vel * tables[t0 + k]
+            for k in range(body, length):
+                out[start + k] += decay[k] * fade[k - body] * vel * tables[t0 + k]
+        else:
+            step = -1.0 / (length - 1) if length > 1 else 0.0
+            for k in range(length):
+                out[start + k] += decay[k] * (1.0 + k * step) * vel * tables[t0 + k]   # np.linspace(1, 0, length)
+
+@njit(cache=True)
+def _normalize(out):
+    hi, lo = out[0], out[0]
+    for i in range(out.shape[0]):
+        x = out[i]
+        hi = x if x > hi else hi
+        lo = x if x < lo else lo
+    peak = max(hi, -lo)
+    # Silent (drums only, no notes, notes under a sample): stays zeros instead of NaNs
+    if peak == 0:
+        return
+    for i in range(out.shape[0]):
+        out[i] /= peak
+
+def _instrument_notes(inst, fs):
+    """(start, length, pitch, velocity) sample arrays, as Instrument.synthesize rounds them."""
+    if not inst.notes:
+        return (np.zeros(0, dtype=np.int64),) * 4
+    notes = np.array([(n.start, n.end, n.pitch, n.velocity) for n in inst.notes], dtype=np.float64)
+    start = (fs * notes[:, 0]).astype(np.int64)
+    end = (fs * notes[:, 1]).astype(np.int64)
+    return start, np.maximum(end - start, 0), notes[:, 2].astype(np.int64), notes[:, 3].astype(np.int64)
+
+def synthesize(pm, fs=SR, wave=np.sin, normalize=True):
+    """Same output as pm.synthesize(fs, wave, normalize), float64."""
+    if len(pm.instruments) == 0:
+        return np.array([])
+    out = np.zeros(max(int(fs * (inst.get_end_time() + 1)) for inst in pm.instruments))
+
+    parts = []
+    for inst in pm.instruments:
+        if inst.is_drum:
+            continue
+        if inst.pitch_bends:
+            y = inst.synthesize(fs=fs, wave=wave)
+            out[:len(y)] += y
+            continue
+        parts.append(_instrument_notes(inst, fs))
+
+    if parts:
+        start, length, pitch, velocity = (np.concatenate(a) for a in zip(*parts))
+        pitches, table_ids = np.unique(pitch, return_inverse=True)
+        longest = np.zeros(len(pitches), dtype=np.int64)
+        np.maximum.at(longest, table_ids, length)
+        table_offsets = np.concatenate(([0], np.cumsum(longest)))
+        tables = np.empty(table_offsets[-1])
+        for i, p in enumerate(pitches):
+            omega = 2 * np.pi * pretty_midi.note_number_to_hz(p) / fs
+            tables[table_offsets[i]:table_offsets[i + 1]] = wave(omega * np.arange(longest[i]))
+        decay = np.exp(-np.arange(max(1, longest.max())) / (DECAY_SEC * fs))
+        fade = np.linspace(1, 0, int(FADE_SEC * fs))
+        _mix(out, start, length, velocity.astype(np.float64), table_ids.astype(np.int64),
+             table_offsets, tables, decay, fade)
+
+    if normalize:
+        _normalize(out)
+    else:
+        out /= (len(pm.instruments) * 2 ** 15)
+    return out
+
+def render(midi_path, fs=SR, pm=None):
+    """Normalized float32 synthesis of a MIDI file, cached on disk."""
+    def compute():
+        midi = pm if pm is not None else pretty_midi.PrettyMIDI(midi_path)
+        return synthesize(midi, fs).astype(np.float32)
+    return feature_cache.get_feature(midi_path, "synth", compute, sr=fs, decay_sec=DECAY_SEC, fade_sec=FADE_SEC)
+
+if __name__ == "__main__":
+    # python midi_synth.py file.mid [...]   compare speed and output with pretty_midi
+    for path in sys.argv[1:]:
+        pm = pretty_midi.PrettyMIDI(path)
+        synthesize(pm, SR)  # compile / load the kernel
+        t_ours, t_ref = np.inf, np.inf
+        for _ in range(3):
+            start = time.perf_counter()
+            ours = synthesize(pm, SR)
+            t_ours = min(t_ours, time.perf_counter() - start)
+            start = time.perf_counter()
+            ref = pm.synthesize(fs=SR)
+            t_ref = min(t_ref, time.perf_counter() - start)
+        print(f"{os.path.basename(path)}: {len(ref) / SR:.1f}s of audio, pretty_midi {t_ref:.3f}s, "
+              f"midi_synth {t_ours:.4f}s ({t_ref / max(t_ours, 1e-9):.0f}x), "
+              f"max difference {np.max(np.abs(ours - ref)):.2e}")
@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import numpy as np
+import scipy.signal
+import soundfile as sf
+import librosa
+import pretty_midi
+from numba import njit
+import feature_cache
+import midi_synth
+import audio_io
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+SR = 22050
+# Analysis frame / hop of the live chroma. One hop (~46 ms) is also the block size.
+N_FFT = 4096
+HOP_LENGTH = 1024
+# Reference frames searched ahead of / behind the current position per live frame
+SEARCH_AHEAD = 100   # ~4.6 s
+SEARCH_BACK = 20
+# Live frames quieter than this RMS don't move the follower
+SILENCE_RMS = 1e-3
+
+# Online time warping: a forward DTW that only keeps the current row of the cost
+# matrix, restricted to a window around the current score position. Every live
+# frame costs O(window) work, independent of the length of the piece.
+# Live and reference chroma come from the same STFT chroma (chroma_frames), the
+# reference is the synthesized MIDI from mid/cleaned, cached in feature_cache.
+
+# --- CHROMA ---
+
+_filters = {}
+
+def _chroma_filter(sr, n_fft):
+    """(window, chroma filterbank), built once per (sr, n_fft)."""
+    if (sr, n_fft) not in _filters:
+        _filters[sr, n_fft] = (scipy.signal.get_window('hann', n_fft, fftbins=True).astype(np.float32),
+                               librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=0.0))
+    return _filters[sr, n_fft]
+
+def _frames_to_chroma(frames, sr, n_fft):
+    """frames: (n_fft, n) samples -> (12, n) chroma, max-normalized like chroma_stft."""
+    window, fb = _chroma_filter(sr, n_fft)
+    power = np.abs(np.fft.rfft(frames * window[:, None], axis=0)) ** 2
+    chroma = fb @ power
+    peak = chroma.max(axis=0, keepdims=True)
+    return np.divide(chroma, peak, out=np.zeros_like(chroma), where=peak > 0)
+
+def chroma_frames(y, sr=SR, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    """
+    Batch version of ChromaStream: frame t ends at sample (t + 1) * hop_length
+    (zeros before the start), exactly the frames the stream produces.
+    """
+    y = np.concatenate((np.zeros(n_fft - hop_length, dtype=np.float32), np.asarray(y, dtype=np.float32)))
+    if len(y) < n_fft:
+        return np.zeros((12, 0))
+    frames = librosa.util.frame(y, frame_length=n_fft, hop_length=hop_length)
+    return _frames_to_chroma(frames, sr, n_fft)
+
+def frame_time(t, sr=SR, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    """Time (s) of the center of frame t."""
+    return ((np.asarray(t) + 1) * hop_length - n_fft / 2) / sr
+
+class ChromaStream:
+    """Incremental chroma: push() audio blocks of any size, get the finished frames back."""
+
+    def __init__(self, sr=SR, n_fft=N_FFT, hop_length=HOP_LENGTH):
+        self.sr, self.n_fft, self.hop = sr, n_fft, hop_length
+        self.buf = np.zeros(n_fft, dtype=np.float32)
+        self.pending = np.zeros(0, dtype=np.float32)
+        _chroma_filter(sr, n_fft)
+
+    def push(self, samples):
+        """Returns [(chroma (12,), rms)] for every hop completed by `samples`."""
+        self.pending = np.concatenate((self.pending, np.asarray(samples, dtype=np.float32)))
+        out = []
+        while len(self.pending) >= self.hop:
+            self.buf = np.concatenate((self.buf[self.hop:], self.pending[:self.hop]))
+            self.pending = self.pending[self.hop:]
+            chroma = _frames_to_chroma(self.buf[:, None], self.sr, self.n_fft)[:, 0]
+            out.append((chroma, float(np.sqrt(np.mean(self.buf[-self.hop:] ** 2)))))
+        return out
+
+def midi_reference(midi_path, sr=SR, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    """(12, M) chroma of the synthesized MIDI; frame k is at MIDI time frame_time(k)."""
+    def compute():
+        y = midi_synth.synthesize(pretty_midi.PrettyMIDI(midi_path), sr)
+        return chroma_frames(y, sr, n_fft, hop_length)
+    return feature_cache.get_feature(midi_path, "chroma_stream_synth", compute,
+                                     sr=sr, n_fft=n_fft, hop_length=hop_length)
+
+# --- FOLLOWER ---
+
+@njit(cache=True)
+def _step_row(cost, lo, prev_D, prev_L, prev_lo, first):
+    """One DTW row over reference frames [lo, lo + len(cost)), steps (1,1), (1,0), (0,1)."""
+    n = cost.shape[0]
+    D = np.empty(n)
+    L = np.empty(n)
+    for k in range(n):
+        if first:
+            # The performance may start anywhere in the first window
+            best, best_len = 0.0, 0.0
+        else:
+            best, best_len = np.inf, 0.0
+            j = lo + k - prev_lo
+            if 0 <= j < prev_D.shape[0] and prev_D[j] < best:          # live advanced, score held
+                best, best_len = prev_D[j], prev_L[j]
+            if 0 <= j - 1 < prev_D.shape[0] and prev_D[j - 1] < best:  # both advanced
+                best, best_len = prev_D[j - 1], prev_L[j - 1]
+        if k > 0 and D[k - 1] < best:                                   # score advanced, live held
+            best, best_len = D[k - 1], L[k - 1]
+        D[k] = best + cost[k]
+        L[k] = best_len + 1.0
+    return D, L
+
+class OnlineFollower:
+    """Score position of a live performance, one chroma frame at a time."""
+
+    def __init__(self, ref_chroma, ahead=SEARCH_AHEAD, back=SEARCH_BACK):
+        ref = np.asarray(ref_chroma, dtype=np.float64)
+        norms = np.linalg.norm(ref, axis=0, keepdims=True)
+        self.ref = np.divide(ref, norms, out=np.zeros_like(ref), where=norms > 0).T.copy()
+        self.ahead, self.back = ahead, back
+        self.position = 0
+        self.D = self.L = None
+        self.lo = 0
+        # Compile / load the kernel now rather than inside the first live block
+        _step_row(np.zeros(1), 0, np.zeros(1), np.ones(1), 0, False)
+
+    def step(self, chroma, rms=1.0):
+        """Feeds one live frame, returns the current reference frame index."""
+        if rms < SILENCE_RMS:
+            return self.position
+        norm = np.linalg.norm(chroma)
+        if norm == 0:
+            return self.position
+        lo = max(0, self.position - self.back)
+        hi = min(len(self.ref), self.position + self.ahead)
+        cost = 1.0 - self.ref[lo:hi] @ (np.asarray(chroma, dtype=np.float64) / norm)
+
+        first = self.D is None
+        prev_D = self.D if not first else np.zeros(0)
+        prev_L = self.L if not first else np.zeros(0)
+        self.D, self.L = _step_row(cost, lo, prev_D, prev_L, self.lo, first)
+        self.lo = lo
+        # Cheapest path per step, so long and short paths compare fairly
+        self.position = lo + int(np.argmin(self.D / self.L))
+        return self.position
+
+# --- SOURCES ---
+
+def file_blocks(path, block=HOP_LENGTH):
+    """Audio blocks of a file as fast as they can be read (offline testing)."""
+    if audio_io.is_canonical(path, SR):
+        for b in sf.blocks(path, blocksize=block, dtype='float32', always_2d=True):
+            yield b.mean(axis=1)
+    else:
+        y, _ = audio_io.load(path, sr=SR)
+        for start in range(0, len(y), block):
+            yield y[start:start + block]
+
+def mic_blocks(block=HOP_LENGTH, device=None):
+    """Live input from sounddevice (imported only when used)."""
+    import sounddevice as sd
+    with sd.InputStream(samplerate=SR, channels=1, blocksize=block, device=device, dtype='float32') as stream:
+        while True:
+            data, _ = stream.read(block)
+            yield data[:, 0]
+
+def follow(blocks, midi_path):
+    """
+    Yields (audio_time, midi_time, seconds_spent) per live frame. midi_time is the
+    score position extrapolated to the newest sample (the frame center lags by N_FFT / 2).
+    """
+    follower = OnlineFollower(midi_reference(midi_path))
+    stream = ChromaStream()
+    t = -1
+    for block in blocks:
+        start = time.perf_counter()
+        for chroma, rms in stream.push(block):
+            t += 1
+            k = follower.step(chroma, rms)
+            lag = N_FFT / 2 / SR
+            yield frame_time(t) + lag, frame_time(k) + lag, time.perf_counter() - start
+
+# --- OFFLINE CHECK ---
+
+def reference_midi_times(category, key, audio_times):
+    """Expected MIDI position at each audio time, from the DTW alignment in the store."""
+    import alignment_store
+    entry = alignment_store.get(alignment_store.connect(), "dtw", category, key)
+    if not entry: return None
+    points = np.asarray(entry["points"])
+    return np.interp(audio_times, points[:, 1], points[:, 0])
+
+def run_file(wav_path, midi_path, category=None, key=None, verbose=False):
+    start = time.perf_counter()
+    rows = []
+    for audio_t, midi_t, spent in follow(file_blocks(wav_path), midi_path):
+        rows.append((audio_t, midi_t, spent))
+        if verbose and len(rows) % 20 == 0:
+            print(f"  audio {audio_t:7.2f}s -> midi {midi_t:7.2f}s")
+    wall = time.perf_counter() - start
+    if not rows:
+        print("No audio frames.")
+        return None
+
+    audio_t, midi_t, spent = (np.array(c) for c in zip(*rows))
+    ms = np.sort(spent) * 1000
+    print(f"{len(rows)} frames, {audio_t[-1]:.1f}s of audio in {wall:.2f}s ({audio_t[-1] / wall:.0f}x real time)")
+    print(f"per-block latency ms: p50 {ms[len(ms) // 2]:.2f}, p95 {ms[int(0.95 * (len(ms) - 1))]:.2f}, max {ms[-1]:.2f}")
+    result = {"frames": len(rows), "realtime_factor": audio_t[-1] / wall, "latency_ms_max": ms[-1]}
+    if category and key:
+        expected = reference_midi_times(category, key, audio_t)
+        if expected is not None:
+            err = np.abs(midi_t - expected)
+            print(f"vs. offline DTW: mean error {err.mean():.3f}s, median {np.median(err):.3f}s, "
+                  f"{np.mean(err < 0.5) * 100:.0f}% within 0.5s")
+            result["mean_error"] = float(err.mean())
+    return result
+
+if __name__ == "__main__":
+    # python online_follower.py [category] [key]        stream the WAV faster than real time
+    # python online_follower.py [category] [key] --live follow the microphone against that MIDI
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) < 2:
+        print("Usage: online_follower.py [category] [key] [--live]")
+        sys.exit(1)
+    category, key = args[0], args[1]
+    midi_path = os.path.join(BASE_DIR, "mid/cleaned", f"{key}.mid")
+    if "--live" in sys.argv:
+        for audio_t, midi_t, spent in follow(mic_blocks(), midi_path):
+            print(f"\r  {audio_t:7.2f}s -> MIDI {midi_t:7.2f}s  ({spent * 1000:.1f} ms)", end="")
+    else:
+        wav_path = os.path.join(BASE_DIR, "mp3", category, "wav", f"{key}.wav")
+        run_file(wav_path, midi_path, category, key, verbose="--verbose" in sys.argv)
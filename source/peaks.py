@@ -0,0 +1,87 @@
+import os
+import sys
+import struct
+import numpy as np
+
+# --- CONFIG ---
+# Resolutions of the waveform overview, coarse to fine
+PEAK_LEVELS = [10, 50, 200, 1000]
+
+# Peak pyramid file (.peaks), little-endian:
+#   header  b"AIMPEAK1", uint32 sr, uint32 n_levels, float64 duration
+#   table   n_levels x (uint32 pixels_per_second, uint32 samples_per_pixel, uint32 count, uint32 byte_offset)
+#   data    per level, count x (int16 min, int16 max), amplitudes scaled by 32767
+# A reader only needs the header and table to fetch one level with a single seek.
+MAGIC = b"AIMPEAK1"
+HEADER = struct.Struct("<8sIId")
+LEVEL = struct.Struct("<IIII")
+SCALE = 32767
+
+def samples_per_pixel(sr, pixels_per_second):
+    return max(1, int(round(sr / pixels_per_second)))
+
+def min_max(y, hop):
+    """(count, 2) array of [min, max] over consecutive blocks of `hop` samples (last block may be short)."""
+    y = np.asarray(y, dtype=np.float32)
+    count = -(-len(y) // hop)
+    if count == 0:
+        return np.zeros((0, 2), dtype=np.float32)
+    # Pad with the last sample so the short tail block keeps its own min/max
+    padded = np.pad(y, (0, count * hop - len(y)), mode='edge').reshape(count, hop)
+    return np.stack([padded.min(axis=1), padded.max(axis=1)], axis=1)
+
+def build_pyramid(y, sr, levels=PEAK_LEVELS):
+    """{pixels_per_second: (count, 2) float32 [min, max]} for every level."""
+    return {pps: min_max(y, samples_per_pixel(sr, pps)) for pps in levels}
+
+def write_peaks(path, pyramid, sr, duration):
+    levels = sorted(pyramid)
+    offset = HEADER.size + LEVEL.size * len(levels)
+    table, blobs = [], []
+    for pps in levels:
+        data = np.clip(np.round(pyramid[pps] * SCALE), -SCALE, SCALE).astype('<i2')
+        table.append(LEVEL.pack(pps, samples_per_pixel(sr, pps), len(data), offset))
+        blobs.append(data.tobytes())
+        offset += len(blobs[-1])
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, sr, len(levels), duration))
+        f.write(b"".join(table))
+        f.write(b"".join(blobs))
+    os.replace(tmp_path, path)
+
+def read_header(f):
+    """Returns (sr, duration, {pixels_per_second: (samples_per_pixel, count, byte_offset)})."""
+    magic, sr, n_levels, duration = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"Not a peaks file (magic {magic!r})")
+    table = {}
+    for _ in range(n_levels):
+        pps, spp, count, offset = LEVEL.unpack(f.read(LEVEL.size))
+        table[pps] = (spp, count, offset)
+    return sr, duration, table
+
+def read_level(path, pixels_per_second=None):
+    """
+    One level as (pixels_per_second, (count, 2) float32 [min, max]).
+    Picks the closest stored level; None means the finest.
+    """
+    with open(path, 'rb') as f:
+        _, _, table = read_header(f)
+        if pixels_per_second is None:
+            pps = max(table)
+        else:
+            pps = min(table, key=lambda p: abs(p - pixels_per_second))
+        _, count, offset = table[pps]
+        f.seek(offset)
+        data = np.fromfile(f, dtype='<i2', count=count * 2).reshape(count, 2)
+    return pps, data.astype(np.float32) / SCALE
+
+if __name__ == "__main__":
+    # python peaks.py file.peaks   -> list the levels
+    with open(sys.argv[1], 'rb') as f:
+        sr, duration, table = read_header(f)
+    print(f"sr={sr} duration={duration:.2f}s")
+    for pps, (spp, count, offset) in sorted(table.items()):
+        print(f"  {pps:5d} px/s: {count} peaks ({spp} samples each) at byte {offset}")
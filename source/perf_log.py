@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager, nullcontext
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+PERF_DIR = os.path.join(BASE_DIR, "cache", "perf")
+# AI_MUSIC_PERF=1 logs to PERF_DIR/<script>.jsonl, AI_MUSIC_PERF=<path> to that file.
+# Being an environment variable, it also reaches process pool workers.
+ENV_VAR = "AI_MUSIC_PERF"
+
+# Opt-in per-track instrumentation:
+#   with perf_log.track(key, category=cat):
+#       with perf_log.span("cqt"): ...
+#       perf_log.note(frames=n)
+# writes one JSON line per track with the seconds of every span (nested spans are
+# named "outer/inner"), the noted counts and the process peak RSS.
+# When disabled, track() and span() return a shared no-op context.
+
+_NOOP = nullcontext()
+_local = threading.local()
+
+def enabled():
+    return bool(os.environ.get(ENV_VAR))
+
+def enable(path="1"):
+    os.environ[ENV_VAR] = path
+
+def log_path():
+    value = os.environ.get(ENV_VAR, "")
+    if value and value != "1":
+        return value
+    script = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+    return os.path.join(PERF_DIR, f"{script}.jsonl")
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+@contextmanager
+def _track(name, fields):
+    record = {"track": name, **fields, "pid": os.getpid(), "stages": {}, "counts": {}}
+    outer = getattr(_local, "record", None), getattr(_local, "prefix", "")
+    _local.record, _local.prefix = record, ""
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 4)
+        record["peak_rss_mb"] = _peak_rss_mb()
+        record["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        _local.record, _local.prefix = outer
+        path = log_path()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # One write per line in append mode, so pool workers can share the file
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+
+def track(name, **fields):
+    """Context for one track's work; yields its record (or nothing when disabled)."""
+    if not enabled():
+        return _NOOP
+    return _track(name, fields)
+
+@contextmanager
+def _span(name, record):
+    outer_prefix = _local.prefix
+    full = outer_prefix + name
+    _local.prefix = full + "/"
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.prefix = outer_prefix
+        record["stages"][full] = round(record["stages"].get(full, 0.0) + time.perf_counter() - start, 4)
+
+def span(name):
+    """Times a stage inside the current track (durations of repeated spans add up)."""
+    record = getattr(_local, "record", None) if enabled() else None
+    if record is None:
+        return _NOOP
+    return _span(name, record)
+
+def note(**counts):
+    """Attaches counts / sizes (frames, matrix cells, ...) to the current track."""
+    record = getattr(_local, "record", None) if enabled() else None
+    if record is not None:
+        record["counts"].update(counts)
+
+# --- SUMMARY ---
+
+def load_records(path):
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+    return records
+
+def _pct(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def summarize(path, worst=10):
+    records = load_records(path)
+    if not records:
+        print(f"No records in {path}")
+        return
+    total = sum(r["seconds"] for r in records)
+    stages = {}
+    for r in records:
+        for name, sec in r["stages"].items():
+            stages.setdefault(name, []).append(sec)
+
+    print(f"{path}: {len(records)} tracks, {total:.1f}s in total")
+    print(f"{'stage':<28} {'n':>5} {'p50':>8} {'p95':>8} {'max':>8} {'total':>9} {'share':>6}")
+    for name, secs in sorted(stages.items(), key=lambda kv: -sum(kv[1])):
+        secs = sorted(secs)
+        p50, p95 = _pct(secs, 0.5), _pct(secs, 0.95)
+        # Nested spans are already inside their parent's time, so only top level gets a share
+        share = f"{100 * sum(secs) / total:5.1f}%" if "/" not in name and total > 0 else ""
+        print(f"{name:<28} {len(secs):>5} {p50:>8.3f} {p95:>8.3f} {secs[-1]:>8.3f} {sum(secs):>9.2f} {share:>6}")
+
+    rss = sorted(r["peak_rss_mb"] for r in records)
+    print(f"peak RSS MB: p50 {_pct(rss, 0.5):.0f}, p95 {_pct(rss, 0.95):.0f}, max {rss[-1]:.0f}")
+
+    print(f"\nSlowest {min(worst, len(records))} tracks:")
+    for r in sorted(records, key=lambda r: -r["seconds"])[:worst]:
+        top = {k: v for k, v in r["stages"].items() if "/" not in k}
+        slowest = max(top, key=top.get) if top else "-"
+        where = f"{r.get('category', '')}/{r['track']}".lstrip("/")
+        print(f"  {r['seconds']:8.2f}s  {where:<40} slowest stage: {slowest}  {json.dumps(r['counts'])}"
+              + (f"  ERROR {r['error']}" if "error" in r else ""))
+
+if __name__ == "__main__":
+    # python perf_log.py [file.jsonl ...]   (default: every log in PERF_DIR)
+    paths = sys.argv[1:]
+    if not paths and os.path.isdir(PERF_DIR):
+        paths = [os.path.join(PERF_DIR, f) for f in sorted(os.listdir(PERF_DIR)) if f.endswith(".jsonl")]
+    for p in paths:
+        summarize(p)
+        print()
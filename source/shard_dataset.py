@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import numpy as np
+
+# --- CONFIG ---
+BASE_DIR = os.path.expanduser("~/ai_music")
+SHARD_DIR = os.path.join(BASE_DIR, "dataset_shards")
+# A new shard is started once the current one holds this many frames (~340 MB of X at 84 bins)
+SHARD_FRAMES = 1_000_000
+# Rewrite the shards when more than this share of their frames belongs to replaced tracks
+COMPACT_GARBAGE_RATIO = 0.3
+
+# Layout of one category directory:
+#   x_00000.bin  raw X frames (frames, *x_tail) of x_dtype, tracks back to back
+#   y_00000.bin  raw Y labels (frames, *y_tail) of y_dtype, same frame offsets
+#   index.json   dtypes/shapes, frames per shard and {key: {shard, start, length}}
+# Files are uncompressed so the reader can np.memmap them and slice windows without copies.
+
+def _shard_paths(out_dir, shard_id):
+    return (os.path.join(out_dir, f"x_{shard_id:05d}.bin"),
+            os.path.join(out_dir, f"y_{shard_id:05d}.bin"))
+
+def load_index(out_dir):
+    path = os.path.join(out_dir, "index.json")
+    if not os.path.exists(path): return None
+    with open(path, 'r') as f: return json.load(f)
+
+def layout(x_dtype, x_tail, y_dtype, y_tail):
+    """The dtype/shape fields of index.json for tracks of this form."""
+    return {"x_dtype": np.dtype(x_dtype).str, "x_tail": list(x_tail),
+            "y_dtype": np.dtype(y_dtype).str, "y_tail": list(y_tail)}
+
+class ShardWriter:
+    """
+    Appends tracks to the shards of one directory. Re-adding a key replaces it
+    (the old frames stay as garbage until compact()). Use as a context manager;
+    index.json is only written on close, so a crash never exposes half-written tracks.
+    `layout` ({x_dtype, x_tail, y_dtype, y_tail}, see layout()) is what the tracks will
+    look like; existing shards with another layout (e.g. a changed label mode) are dropped.
+    """
+
+    def __init__(self, out_dir, shard_frames=SHARD_FRAMES, layout=None):
+        self.out_dir = out_dir
+        self.shard_frames = shard_frames
+        os.makedirs(out_dir, exist_ok=True)
+        self.index = load_index(out_dir) or {"shards": [], "tracks": {}}
+        self._files = None
+        if layout is not None and "x_dtype" in self.index and \
+                any(self.index[k] != v for k, v in layout.items()):
+            print(f"Shard layout changed, starting {out_dir} over")
+            for f in os.listdir(out_dir): os.remove(os.path.join(out_dir, f))
+            self.index = {"shards": [], "tracks": {}}
+        # Drop anything appended after the last index write (crashed run)
+        for shard_id, frames in enumerate(self.index["shards"]):
+            for path, item_bytes in zip(_shard_paths(out_dir, shard_id), self._item_bytes()):
+                if os.path.exists(path) and os.path.getsize(path) > frames * item_bytes:
+                    with open(path, 'r+b') as f: f.truncate(frames * item_bytes)
+
+    def _item_bytes(self):
+        if "x_dtype" not in self.index: return (0, 0)
+        return tuple(np.dtype(self.index[f"{p}_dtype"]).itemsize * int(np.prod(self.index[f"{p}_tail"]))
+                     for p in ("x", "y"))
+
+    def __contains__(self, key):
+        return key in self.index["tracks"]
+
+    def add(self, key, X, Y):
+        if len(X) != len(Y):
+            raise ValueError(f"{key}: X has {len(X)} frames but Y has {len(Y)}")
+        X, Y = np.ascontiguousarray(X), np.ascontiguousarray(Y)
+        if "x_dtype" not in self.index:
+            self.index.update(x_dtype=X.dtype.str, x_tail=list(X.shape[1:]),
+                              y_dtype=Y.dtype.str, y_tail=list(Y.shape[1:]))
+        elif (X.dtype.str, list(X.shape[1:]), Y.dtype.str, list(Y.shape[1:])) != \
+                (self.index["x_dtype"], self.index["x_tail"], self.index["y_dtype"], self.index["y_tail"]):
+            raise ValueError(f"{key}: shape/dtype differs from the existing shards in {self.out_dir}")
+
+        shards = self.index["shards"]
+        if not shards or (shards[-1] > 0 and shards[-1] + len(X) > self.shard_frames):
+            self._close_files()
+            shards.append(0)
+        if self._files is None:
+            self._files = [open(p, 'ab') for p in _shard_paths(self.out_dir, len(shards) - 1)]
+
+        self._files[0].write(X.tobytes())
+        self._files[1].write(Y.tobytes())
+        self.index["tracks"][key] = {"shard": len(shards) - 1, "start": shards[-1], "length": len(X)}
+        shards[-1] += len(X)
+
+    def remove(self, key):
+        self.index["tracks"].pop(key, None)
+
+    def garbage_ratio(self):
+        total = sum(self.index["shards"])
+        used = sum(t["length"] for t in self.index["tracks"].values())
+        return 1.0 - used / total if total else 0.0
+
+    def _close_files(self):
+        if self._files:
+            for f in self._files: f.close()
+        self._files = None
+
+    def close(self):
+        self._close_files()
+        tmp_path = os.path.join(self.out_dir, f"index.json.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, os.path.join(self.out_dir, "index.json"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def compact(out_dir, shard_frames=SHARD_FRAMES):
+    """Rewrites the shards without the frames of replaced/removed tracks."""
+    old = ShardedDataset(out_dir)
+    tmp_dir = out_dir.rstrip("/") + ".compact"
+    if os.path.exists(tmp_dir):
+        for f in os.listdir(tmp_dir): os.remove(os.path.join(tmp_dir, f))
+    with ShardWriter(tmp_dir, shard_frames) as writer:
+        for key in old.keys():
+            writer.add(key, *old.track(key))
+    old.close()
+    for f in os.listdir(out_dir): os.remove(os.path.join(out_dir, f))
+    for f in os.listdir(tmp_dir): os.replace(os.path.join(tmp_dir, f), os.path.join(out_dir, f))
+    os.rmdir(tmp_dir)
+
+class ShardedDataset:
+    """Read-only access to a shard directory. All returned arrays are np.memmap views."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.index = load_index(out_dir)
+        if self.index is None:
+            raise FileNotFoundError(f"No index.json in {out_dir}. Run 011_prepare_dataset.py first.")
+        self._maps = {}
+
+    def _shard(self, shard_id):
+        if shard_id not in self._maps:
+            frames = self.index["shards"][shard_id]
+            x_path, y_path = _shard_paths(self.out_dir, shard_id)
+            self._maps[shard_id] = (
+                np.memmap(x_path, dtype=self.index["x_dtype"], mode='r',
+                          shape=(frames, *self.index["x_tail"])),
+                np.memmap(y_path, dtype=self.index["y_dtype"], mode='r',
+                          shape=(frames, *self.index["y_tail"])))
+        return self._maps[shard_id]
+
+    def keys(self):
+        return list(self.index["tracks"])
+
+    def __len__(self):
+        return len(self.index["tracks"])
+
+    def num_frames(self, key):
+        return self.index["tracks"][key]["length"]
+
+    def track(self, key):
+        t = self.index["tracks"][key]
+        return self.window(key, 0, t["length"])
+
+    def window(self, key, start, length):
+        """Frames [start, start + length) of a track as (X, Y) views. Clipped at the track end."""
+        t = self.index["tracks"][key]
+        start = max(0, min(start, t["length"]))
+        stop = t["start"] + min(start + length, t["length"])
+        X, Y = self._shard(t["shard"])
+        return X[t["start"] + start:stop], Y[t["start"] + start:stop]
+
+    def random_window(self, length, rng=None):
+        """
+        A uniformly placed window of `length` frames from a random track long enough for it.
+        `rng` is a np.random.Generator (default np.random.default_rng()) or a legacy RandomState.
+        """
+        keys = [k for k, t in self.index["tracks"].items() if t["length"] >= length]
+        if not keys:
+            raise ValueError(f"No track has {length} frames")
+        rng = rng if rng is not None else np.random.default_rng()
+        integers = getattr(rng, "integers", None) or rng.randint
+        key = keys[integers(len(keys))]
+        start = integers(self.index["tracks"][key]["length"] - length + 1)
+        return self.window(key, start, length)
+
+    def close(self):
+        self._maps = {}
+
+if __name__ == "__main__":
+    # python shard_dataset.py [category]   -> summary;  python shard_dataset.py compact [category]
+    args = sys.argv[1:]
+    if args and args[0] == "compact":
+        compact(os.path.join(SHARD_DIR, args[1]))
+        print(f"Compacted {args[1]}")
+    else:
+        for cat in args or ["first", "one_kor", "one_kor_sgl"]:
+            out_dir = os.path.join(SHARD_DIR, cat)
+            if load_index(out_dir) is None: continue
+            ds = ShardedDataset(out_dir)
+            frames = sum(ds.num_frames(k) for k in ds.keys())
+            print(f"{cat}: {len(ds)} tracks, {frames} frames in {len(ds.index['shards'])} shards")
@@ -0,0 +1,56 @@
+import numpy as np
+
+# Global offset between a recording and its MIDI from the normalized cross-correlation
+# of their chroma. All lags are scored at once with FFTs (O(n log n)), over the whole
+# recording instead of a fixed window.
+
+# A lag must overlap at least this share of the shorter sequence to count
+MIN_OVERLAP_RATIO = 0.25
+
+def _unit_frames(chroma):
+    chroma = np.asarray(chroma, dtype=np.float64)
+    norms = np.linalg.norm(chroma, axis=0, keepdims=True)
+    # Silent frames (all-zero chroma) stay zero and simply add no similarity
+    return np.divide(chroma, norms, out=np.zeros_like(chroma), where=norms > 0)
+
+def lag_similarity(chroma_rec, chroma_midi):
+    """
+    Mean cosine similarity of rec frame i vs. midi frame i + lag, for every lag.
+    Returns (lags, similarity, overlap) with lags from -(n_rec - 1) to n_midi - 1.
+    """
+    rec = _unit_frames(chroma_rec)
+    midi = _unit_frames(chroma_midi)
+    n_rec, n_midi = rec.shape[1], midi.shape[1]
+    n_fft = 1 << int(np.ceil(np.log2(n_rec + n_midi - 1)))
+
+    # corr[lag] = sum_i sum_d rec[d, i] * midi[d, i + lag], all 12 bins summed in the spectrum
+    spectrum = np.sum(np.conj(np.fft.rfft(rec, n_fft, axis=1)) * np.fft.rfft(midi, n_fft, axis=1), axis=0)
+    corr = np.fft.irfft(spectrum, n_fft)
+
+    lags = np.arange(-(n_rec - 1), n_midi)
+    corr = corr[lags % n_fft]
+    overlap = np.minimum(n_rec, n_midi - lags) - np.maximum(0, -lags)
+    return lags, corr / np.maximum(overlap, 1), overlap
+
+def estimate_offset(chroma_rec, chroma_midi, sr, hop_length, max_lag_sec=None):
+    """
+    Returns (offset_sec, confidence) with audio_time = midi_time + offset_sec
+    (the convention of auto_offset in 04_analyze_data).
+    confidence is the z-score of the best lag against all candidate lags;
+    values above ~4 are a clear, single peak.
+    """
+    lags, sim, overlap = lag_similarity(chroma_rec, chroma_midi)
+    min_overlap = MIN_OVERLAP_RATIO * min(np.shape(chroma_rec)[1], np.shape(chroma_midi)[1])
+    valid = overlap >= max(1, min_overlap)
+    if max_lag_sec is not None:
+        valid &= np.abs(lags) <= max_lag_sec * sr / hop_length
+    if not np.any(valid):
+        return 0.0, 0.0
+
+    lags, sim = lags[valid], sim[valid]
+    best = int(np.argmax(sim))
+    spread = np.std(sim)
+    confidence = float((sim[best] - np.mean(sim)) / spread) if spread > 0 else 0.0
+    # rec frame i matches midi frame i + lag, so the audio is lag frames earlier
+    offset_sec = -(lags[best] * hop_length / sr)
+    return float(offset_sec), confidence
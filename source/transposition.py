@@ -0,0 +1,41 @@
+import numpy as np
+
+# Key difference between a recording and its MIDI. Folk musicians often play a tune
+# in another key than the mid/cleaned reference, which no chroma cost survives.
+# Instead of aligning 12 times, all 12 cyclic shifts are scored at once on the global
+# chroma profiles (optimal transposition index): one (12, 12) product per track.
+# The alignment then runs once on the MIDI chroma rolled by the winning shift.
+
+# A shift other than 0 must beat the untransposed profile similarity by this much,
+# so tracks in the reference key never move on noise
+MIN_GAIN = 0.05
+
+def profile(chroma):
+    """Mean of the unit-length chroma frames (silent frames count as zero), unit length."""
+    chroma = np.asarray(chroma, dtype=np.float64)
+    norms = np.linalg.norm(chroma, axis=0, keepdims=True)
+    mean = np.divide(chroma, norms, out=np.zeros_like(chroma), where=norms > 0).mean(axis=1)
+    total = np.linalg.norm(mean)
+    return mean / total if total > 0 else mean
+
+def shift_scores(chroma_rec, chroma_midi):
+    """Cosine similarity of the recording's profile with the MIDI's rolled up by 0..11 semitones."""
+    rec, midi = profile(chroma_rec), profile(chroma_midi)
+    # rolled[s, b] = midi[(b - s) % 12], i.e. np.roll(midi, s) for every s
+    rolled = midi[(np.arange(12)[None, :] - np.arange(12)[:, None]) % 12]
+    return rolled @ rec
+
+def estimate(chroma_rec, chroma_midi, min_gain=MIN_GAIN):
+    """
+    Returns (shift, scores): the recording sounds `shift` semitones above the MIDI,
+    in -5..6. Use apply(chroma_midi, shift) to align.
+    """
+    scores = shift_scores(chroma_rec, chroma_midi)
+    best = int(np.argmax(scores))
+    if best == 0 or scores[best] - scores[0] < min_gain:
+        return 0, scores
+    return (best + 5) % 12 - 5, scores
+
+def apply(chroma, shift):
+    """Transposes a (12, T) chroma up by `shift` semitones."""
+    return np.roll(chroma, shift, axis=0) if shift % 12 else chroma
@@ -0,0 +1,36 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "source"))
+import alignment_store
+
+
+def _store(tmp_path, monkeypatch):
+    monkeypatch.setattr(alignment_store, "SETUP_DIR", str(tmp_path))
+    return alignment_store.connect(str(tmp_path / "alignments.db"))
+
+
+def test_save_into_category_with_existing_json(tmp_path, monkeypatch):
+    conn = _store(tmp_path, monkeypatch)
+    path = alignment_store.export_path("manual", "first")
+    with open(path, 'w') as f:
+        json.dump({"a": {"offset": 1.0, "speed": 1.0}, "b": {"offset": 2.0, "speed": 1.0}}, f)
+
+    # What the player's /api/save_alignment does on a fresh DB
+    alignment_store.upsert(conn, "manual", "first", "c", {"offset": 3.0, "speed": 1.0})
+    alignment_store.export_json(conn, "manual", "first")
+
+    with open(path, 'r') as f:
+        saved = json.load(f)
+    assert list(saved) == ["a", "b", "c"]
+    assert saved["a"]["offset"] == 1.0
+
+
+def test_delete_keeps_the_other_json_entries(tmp_path, monkeypatch):
+    conn = _store(tmp_path, monkeypatch)
+    with open(alignment_store.export_path("dtw", "one_kor"), 'w') as f:
+        json.dump({"a": {"points": []}, "b": {"points": []}}, f)
+
+    alignment_store.delete(conn, "dtw", "one_kor", "a")
+    assert list(alignment_store.load(conn, "dtw", "one_kor")) == ["b"]
@@ -0,0 +1,30 @@
+import os
+import sys
+import numpy as np
+import pretty_midi
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "source"))
+import midi_synth
+
+
+def _pm(notes, is_drum=False):
+    pm = pretty_midi.PrettyMIDI()
+    inst = pretty_midi.Instrument(program=0, is_drum=is_drum)
+    inst.notes = [pretty_midi.Note(velocity=v, pitch=p, start=s, end=e) for p, v, s, e in notes]
+    pm.instruments.append(inst)
+    return pm
+
+
+def test_silent_midi_gives_zeros():
+    pm = _pm([(36, 100, 0.0, 0.5), (38, 90, 0.5, 1.0)], is_drum=True)
+    y = midi_synth.synthesize(pm, 8000)
+    assert len(y) > 0 and not np.any(y)
+
+
+def test_matches_pretty_midi():
+    notes = [(48 + (i * 7) % 24, 40 + i % 80, 0.05 * i, 0.05 * i + 0.02 + 0.03 * (i % 5)) for i in range(40)]
+    pm = _pm(notes)
+    ours = midi_synth.synthesize(pm, 8000)
+    ref = pm.synthesize(fs=8000)
+    assert ours.shape == ref.shape
+    assert np.max(np.abs(ours - ref)) < 1e-9
@@ -0,0 +1,18 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "source"))
+import shard_dataset
+
+
+def test_random_window_accepts_generator_and_random_state(tmp_path):
+    with shard_dataset.ShardWriter(str(tmp_path)) as writer:
+        writer.add("a", np.zeros((50, 4), np.float32), np.zeros((50, 2), np.uint8))
+        writer.add("b", np.ones((5, 4), np.float32), np.ones((5, 2), np.uint8))
+    ds = shard_dataset.ShardedDataset(str(tmp_path))
+
+    for rng in (np.random.default_rng(0), np.random.RandomState(0), None):
+        X, Y = ds.random_window(10, rng)
+        assert X.shape == (10, 4) and Y.shape == (10, 2)
+        assert not X.any()  # only "a" is long enough